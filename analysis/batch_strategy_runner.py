@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+对全市场遍历一次运行晚间的所有选股策略，代替crontab中分散在18:15到20:25之间的各个策略进程
+"""
+
+import datetime
+import logging
+import argparse
+import importlib
+
+from logger import setup_logging
+from config import quant_workers
+from analysis import strategy_registry
+from analysis.technical_analysis_util import start_batch_analysis, year_num
+
+
+# (策略模块, 参数)，和原来crontab中各个策略的参数一致
+evening_jobs = [
+    ('ma_quant_strategy', {'short_ma': 5, 'long_ma': 10}),
+    ('ma_quant_strategy', {'short_ma': 5, 'long_ma': 20}),
+    ('ma_macd_strategy', {'short_ma': 5, 'long_ma': 10, 'short_ema': 12, 'long_ema': 26, 'dif_ema': 9}),
+    ('ma_macd_strategy', {'short_ma': 5, 'long_ma': 20, 'short_ema': 12, 'long_ema': 26, 'dif_ema': 9}),
+    ('macd_quant_strategy', {'short_ema': 12, 'long_ema': 26, 'dif_ema': 9}),
+    ('macd_dif_strategy', {'short_ema': 12, 'long_ema': 26, 'dif_ema': 9}),
+    ('break_through_strategy', {'short_ma': 5, 'long_ma': 10}),
+    ('break_through_strategy', {'short_ma': 5, 'long_ma': 20}),
+    ('new_peak_strategy', {'length': 20}),
+    ('new_peak_strategy', {'length': 120}),
+    ('goup_staying_strategy', {}),
+    ('month_through_strategy', {'short_ma': 5, 'long_ma': 10}),
+    ('ma_month_strategy', {'short_ma': 5, 'long_ma': 10}),
+    ('macd_month_strategy', {'short_ema': 12, 'long_ema': 26, 'dif_ema': 9}),
+    ('ma_weekly_strategy', {'short_ma': 5, 'long_ma': 10}),
+    ('macd_weekly_strategy', {'short_ema': 12, 'long_ema': 26, 'dif_ema': 9}),
+    ('week_through_strategy', {'short_ma': 5, 'long_ma': 10}),
+    ('depart_quant_strategy', {}),
+    ('depart_week_strategy', {}),
+]
+panel_days = year_num + 10  # panel需要覆盖pre_sdt_check计算年线所需的交易日
+
+
+def load_jobs(names=None):
+    """
+    导入策略模块，names不为空时只保留这些模块的任务。
+    注册到strategy_registry的策略合并成一个任务，每只股票的日线只取一次，相同的指标只计算一次
+    """
+    jobs, registered = [], []
+    for module_name, params in evening_jobs:
+        if names and module_name not in names:
+            continue
+        module = importlib.import_module('analysis.' + module_name)
+        if hasattr(module, 'strategy'):
+            registered.append((module.strategy, params))
+        else:
+            jobs.append((module, params))
+
+    if registered:
+        jobs.insert(0, (strategy_registry, {'registered_jobs': registered}))
+    return jobs
+
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(description=u'一次运行所有选股策略')
+    parser.add_argument(u'-t', action=u'store', dest='qr_date', required=False, help=u'运行策略的日期')
+    parser.add_argument(u'-j', action=u'store', dest='jobs', nargs='+', required=False, help=u'只运行这些策略模块')
+    parser.add_argument(u'-p', action=u'store', type=int, dest='panel_days', default=panel_days, required=False,
+                        help=u'一次取出的日线交易日数')
+    parser.add_argument(u'-w', action=u'store', type=int, dest='workers', default=quant_workers, required=False,
+                        help=u'运行策略的进程数')
+
+    args = parser.parse_args()
+    if args.qr_date:
+        try:
+            qr_date = datetime.datetime.strptime(args.qr_date, '%Y-%m-%d')
+        except Exception as e:
+            print('Wrong date form')
+            raise e
+    else:
+        today = datetime.date.today()
+        qr_date = datetime.datetime(year=today.year, month=today.month, day=today.day)
+
+    return qr_date, args.jobs, args.panel_days, args.workers
+
+
+if __name__ == '__main__':
+    setup_logging(__file__, logging.WARNING)
+    qr_date, job_names, days, workers = setup_argparse()
+    logging.info('Start batch strategies on %s' % qr_date)
+    res = start_batch_analysis(load_jobs(job_names), qr_date=qr_date, panel_days=days, workers=workers)
+    logging.info('Batch strategies finished, %s results' % len(res or []))
@@ -5,57 +5,36 @@ import datetime
 import logging
 import argparse
 
-from mongoengine import Q
-from pandas import DataFrame
-
 from logger import setup_logging
-from models import QuantResult as QR, StockDailyTrading as SDT
-from analysis.technical_analysis_util import format_trading_data, check_duplicate_strategy, display_quant
-from analysis.technical_analysis_util import calculate_ma, start_quant_analysis, collect_stock_daily_trading
-from analysis.technical_analysis_util import pre_sdt_check, setup_realtime_sdt
+from analysis.technical_analysis_util import start_quant_analysis, collect_stock_daily_trading, display_quant
+from analysis.strategy_registry import register_strategy, evaluate_strategies, ma, close
+from analysis.signal_kernels import breakout
 
 
 timeout = 60
 
 
+def break_through(values, params):
+    close_price, short_ma, long_ma = values[close], values[ma(params['short_ma'])], values[ma(params['long_ma'])]
+    if close_price.iloc[-2] < long_ma.iloc[-2] and close_price.iloc[-1] > short_ma.iloc[-1]\
+       and close_price.iloc[-1] > long_ma.iloc[-1]:
+        return 'long'
+
+
+strategy = register_strategy(
+    'break_through',
+    indicators=lambda p: [ma(p['short_ma']), ma(p['long_ma'])],
+    rule=break_through,
+    strategy_name=lambda d, p: 'break_through_%s_%s_%s' % (d, p['short_ma'], p['long_ma']),
+    count=lambda p: p['long_ma'] + 10,
+    skip_suspended=False,
+    kernel=lambda v, p: breakout(v[close], v[ma(p['short_ma'])], v[ma(p['long_ma'])]),
+)
+
+
 def quant_stock(stock_number, stock_name, **kwargs):
-    if not pre_sdt_check(stock_number, **kwargs):
-        return
-
-    real_time = kwargs.get('real_time', False)
-    week_long = kwargs.get('week_long', False)
-    strategy_direction = 'long'
-    strategy_name = 'break_through_%s_%s_%s' % (strategy_direction, kwargs['short_ma'], kwargs['long_ma'])
-    if week_long:
-        strategy_name = 'weeklong_' + strategy_name
-
-    sdt = SDT.objects(Q(stock_number=stock_number) &
-                      Q(date__lte=kwargs['qr_date'])).order_by('-date')[:kwargs['long_ma']+10]
-
-    if sdt is None or len(sdt) == 0:
-        return
-    trading_data = format_trading_data(sdt)
-    df = calculate_ma(DataFrame(trading_data), short_ma, long_ma)
-    # print(df)
-    today = df.iloc[-1]
-    yestoday = df.iloc[-2]
-
-    if yestoday['close_price'] < yestoday['long_ma'] and today['close_price'] > today['short_ma']\
-       and today['close_price'] > today['long_ma']:
-        increase_rate = round((today['close_price'] - yestoday['close_price']) / yestoday['close_price'], 4) * 100
-        qr = QR(
-            stock_number=stock_number, stock_name=stock_name, date=today.name,
-            strategy_direction=strategy_direction, strategy_name=strategy_name,
-            init_price=today['close_price'], industry_involved=kwargs.get('industry_involved'),
-            increase_rate=increase_rate
-        )
-
-        if real_time:
-            return qr
-        if not check_duplicate_strategy(qr):
-            qr.save()
-            return qr
-    return ''
+    res = evaluate_strategies(stock_number, stock_name, [(strategy, kwargs)])
+    return res[0] if res else ''
 
 
 def setup_argparse():
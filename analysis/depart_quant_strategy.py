@@ -5,13 +5,10 @@ import datetime
 import logging
 import argparse
 
-from mongoengine import Q
-from pandas import DataFrame
-
 from logger import setup_logging
-from models import QuantResult as QR, StockDailyTrading as SDT
-from analysis.technical_analysis_util import calculate_macd, format_trading_data, calculate_ma, start_quant_analysis, \
-    check_duplicate_strategy
+from models import QuantResult as QR
+from analysis.technical_analysis_util import calculate_macd, get_daily_frame, calculate_ma, start_quant_analysis, \
+    save_quant_result
 
 
 period = 3
@@ -27,10 +24,8 @@ def quant_stock(stock_number, stock_name, **kwargs):
     qr_date = kwargs['qr_date']
 
     strategy_name = "depart_long_day"
-    sdt = SDT.objects(Q(stock_number=stock_number) & Q(today_closing_price__ne=0.0) &
-                      Q(date__lte=qr_date)).order_by('-date')[:ema_volume]
-    trading_data = format_trading_data(sdt)
-    df = calculate_ma(DataFrame(trading_data), short_ma, long_ma)
+    df = get_daily_frame(stock_number, qr_date, ema_volume, panel=kwargs.get('panel'))
+    df = calculate_ma(df, short_ma, long_ma)
     df = calculate_macd(df, short_ema, long_ema, dif_ema)
     today = df.iloc[-1]
     yestoday = df.iloc[-2]
@@ -57,9 +52,8 @@ def quant_stock(stock_number, stock_name, **kwargs):
                 increase_rate=increase_rate
             )
 
-            if not check_duplicate_strategy(qr):
-                qr.save()
-                return qr
+            save_quant_result(qr)
+            return qr
 
 
 def setup_argparse():
@@ -12,7 +12,7 @@ from pandas import DataFrame
 from logger import setup_logging
 from models import QuantResult as QR, StockWeeklyTrading as SWT
 from analysis.technical_analysis_util import calculate_macd, format_trading_data, calculate_ma, start_quant_analysis, \
-    check_duplicate_strategy, is_ad_price
+    save_quant_result, is_ad_price
 
 
 period = 3
@@ -70,9 +70,8 @@ def quant_stock(stock_number, stock_name, **kwargs):
                 strategy_direction='long', strategy_name=strategy_name, init_price=init_price,
                 industry_involved=kwargs.get('industry_involved'), increase_rate=increase_rate
             )
-            if not check_duplicate_strategy(qr):
-                qr.save()
-                return qr
+            save_quant_result(qr)
+            return qr
 
 
 def setup_argparse():
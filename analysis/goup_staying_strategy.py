@@ -12,7 +12,7 @@ from mongoengine import Q
 
 from logger import setup_logging
 from models import QuantResult as QR, StockDailyTrading as SDT
-from analysis.technical_analysis_util import check_duplicate_strategy
+from analysis.technical_analysis_util import save_quant_result, percent_value
 from analysis.technical_analysis_util import start_quant_analysis
 
 
@@ -28,21 +28,41 @@ def quant_stock(stock_number, stock_name, **kwargs):
     if week_long:
         strategy_name = 'weeklong_' + strategy_name
 
+    goup_stocks = kwargs.get('goup_stocks')
+    if goup_stocks is not None and stock_number not in goup_stocks:
+        return
+
     sdt = SDT.objects(Q(stock_number=stock_number) & Q(today_closing_price__ne=0.0) &
                       Q(date__lte=qr_date)).order_by('-date')[:quant_count]
     if len(sdt) < quant_count:
         return
 
-    if float(sdt[0].increase_rate.replace('%', '').strip()) > goup_stay:
+    increase_rate = percent_value(sdt[0], 'increase_rate')
+    if increase_rate is not None and increase_rate > goup_stay:
         qr = QR(
             stock_number=stock_number, stock_name=stock_name, date=qr_date,
             strategy_direction='long', strategy_name=strategy_name,
             init_price=sdt[0].today_closing_price, industry_involved=kwargs.get('industry_involved'),
-            increase_rate=float(sdt[0].increase_rate.replace('%', '').strip())
+            increase_rate=increase_rate
         )
-        if not check_duplicate_strategy(qr):
-            qr.save()
-            return qr
+        save_quant_result(qr)
+        return qr
+
+
+def query_goup_stocks(qr_date):
+    """
+    用increase_rate_value在数据库中一次查出当天涨幅超过goup_stay的股票，当天还有未迁移的数据时返回None
+    """
+    if SDT.objects(date=qr_date, increase_rate_value=None).count():
+        return None
+    return set(SDT.objects(date=qr_date, increase_rate_value__gt=goup_stay).distinct('stock_number'))
+
+
+def prepare_kwargs(**kwargs):
+    """
+    运行前一次性准备的参数，start_batch_analysis也会调用
+    """
+    return {'goup_stocks': query_goup_stocks(kwargs['qr_date'])}
 
 
 def setup_argparse():
@@ -70,4 +90,4 @@ if __name__ == '__main__':
     today_trading = {}
 
     real_time_res = start_quant_analysis(qr_date=qr_date, quant_stock=quant_stock, today_trading=today_trading,
-                                         week_long=week_long)
+                                         week_long=week_long, **prepare_kwargs(qr_date=qr_date))
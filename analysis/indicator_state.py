@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+MA/EMA/MACD的增量计算。每只股票每个指标只保存累加状态（MA的滑动窗口和窗口内的和，EMA的加权分子和分母），
+每天收盘后对全市场向量化地推进一根K线，计算量只和股票数有关，和回看的K线数无关。
+EMA按pandas ewm(span, adjust=True)的定义累加，所以和calculate_macd在足够长的历史上算出的值一致
+"""
+
+import logging
+import argparse
+import datetime
+
+import numpy as np
+from pandas import DataFrame
+
+from models import IndicatorState, StockDailyTrading as SDT, StockWeeklyTrading as SWT
+from models import StockMonthlyTrading as SMT
+from logger import setup_logging
+from collector.collect_data_util import bulk_upsert
+
+
+# 每个周期的K线来源：集合，日期字段，周期字段，收盘价字段。
+# 周线和月线用后复权收盘价，和is_week_long等读取的价格一致；周期字段是由日线聚合时写入的所在周期的第一天
+timeframe_bars = {
+    'day': (SDT, 'date', 'date', 'today_closing_price'),
+    'week': (SWT, 'last_trade_date', 'week', 'ad_close_price'),
+    'month': (SMT, 'last_trade_date', 'month', 'ad_close_price'),
+}
+
+# 每天需要推进的指标，和crontab中策略使用的参数一致
+indicator_specs = [
+    ('day', 'ma', (5,)), ('day', 'ma', (10,)), ('day', 'ma', (20,)), ('day', 'ma', (250,)),
+    ('day', 'macd', (12, 26, 9)),
+    ('week', 'ma', (5,)), ('week', 'ma', (10,)), ('week', 'macd', (12, 26, 9)),
+    ('month', 'ma', (5,)), ('month', 'ma', (10,)), ('month', 'macd', (12, 26, 9)),
+]
+year_ma_spec = ('day', 'ma', (250,))
+
+
+def params_key(params):
+    return '_'.join(str(p) for p in params)
+
+
+def to_value(x):
+    return None if x is None or np.isnan(x) else float(x)
+
+
+def load_bars(timeframe, date):
+    """
+    取出最后交易日为date的全市场K线，返回stock_number, period, close三列
+    """
+    document, date_field, period_field, close_field = timeframe_bars[timeframe]
+    cursor = document._get_collection().find({date_field: date, close_field: {'$gt': 0}, period_field: {'$ne': None}},
+                                             {'_id': 0, 'stock_number': 1, period_field: 1, close_field: 1})
+    df = DataFrame.from_records(cursor, columns=['stock_number', period_field, close_field])
+    df.columns = ['stock_number', 'period', 'close']
+    return df.drop_duplicates('stock_number', keep='last').reset_index(drop=True)
+
+
+def ema_step(num, den, x, span):
+    """
+    adjust=True的EMA递推：num = x + (1 - a) * num，den = 1 + (1 - a) * den，ema = num / den
+    """
+    decay = 1 - 2.0 / (span + 1)
+    num = x + decay * num
+    den = 1 + decay * den
+    return num, den, num / den
+
+
+def empty_state(indicator, params, size):
+    if indicator == 'ma':
+        return {'window': np.full((size, params[0]), np.nan), 'sum': np.zeros(size), 'count': np.zeros(size)}
+    names = ['num', 'den'] if indicator == 'ema' else ['short_num', 'short_den', 'long_num', 'long_den',
+                                                         'dea_num', 'dea_den']
+    return {k: np.zeros(size) for k in names}
+
+
+def advance(indicator, params, state, close):
+    """
+    在state上向量化地推进一根K线
+    :param state: 各累加量的数组，每个元素对应一只股票
+    :param close: 新K线的收盘价数组
+    :return: (新的state, 指标值的dict)
+    """
+    if indicator == 'ma':
+        n = params[0]
+        outgoing = np.nan_to_num(state['window'][:, 0])
+        window = np.hstack([state['window'][:, 1:], close[:, None]])
+        total = state['sum'] - outgoing + close
+        count = np.minimum(state['count'] + 1, n)
+        ma = np.where(count >= n, total / n, np.nan)
+        return {'window': window, 'sum': total, 'count': count}, {'ma': ma}
+
+    if indicator == 'ema':
+        num, den, ema = ema_step(state['num'], state['den'], close, params[0])
+        return {'num': num, 'den': den}, {'ema': ema}
+
+    short_ema, long_ema, dif_ema = params
+    short_num, short_den, short_value = ema_step(state['short_num'], state['short_den'], close, short_ema)
+    long_num, long_den, long_value = ema_step(state['long_num'], state['long_den'], close, long_ema)
+    dif = short_value - long_value
+    dea_num, dea_den, dea = ema_step(state['dea_num'], state['dea_den'], dif, dif_ema)
+    new_state = {'short_num': short_num, 'short_den': short_den, 'long_num': long_num, 'long_den': long_den,
+                 'dea_num': dea_num, 'dea_den': dea_den}
+    return new_state, {'dif': dif, 'dea': dea, 'macd': dif - dea}
+
+
+def stack_state(indicator, params, docs):
+    """
+    把每只股票保存的累加状态拼成数组，没有状态的股票从零开始
+    """
+    state = empty_state(indicator, params, len(docs))
+    for i, doc in enumerate(docs):
+        if not doc:
+            continue
+        for k, v in doc.items():
+            if k == 'window':
+                window = [np.nan if w is None else w for w in v][-params[0]:]
+                if window:
+                    state[k][i, -len(window):] = window
+            else:
+                state[k][i] = v
+    return state
+
+
+def unstack_state(state, i):
+    res = {}
+    for k, v in state.items():
+        if k == 'window':
+            res[k] = [to_value(w) for w in v[i] if not np.isnan(w)]
+        else:
+            res[k] = to_value(v[i])
+    return res
+
+
+def update_indicator(timeframe, indicator, params, date, bars=None):
+    """
+    把最后交易日为date的K线推进到(timeframe, indicator, params)的状态中。
+    K线和已保存的最后一根属于同一周期时（如周中每天更新的周线，或者重复运行），从base重新计算
+    """
+    if bars is None:
+        bars = load_bars(timeframe, date)
+    if bars.empty:
+        return {}
+
+    key = params_key(params)
+    query = {'timeframe': timeframe, 'indicator': indicator, 'params': key,
+             'stock_number': {'$in': list(bars['stock_number'])}}
+    projection = {'_id': 0, 'stock_number': 1, 'period': 1, 'base': 1, 'state': 1, 'value': 1, 'prev_value': 1}
+    saved = {i['stock_number']: i for i in IndicatorState._get_collection().find(query, projection)}
+
+    rows, start_docs, prev_values = [], [], []
+    for i, (stock_number, period) in enumerate(zip(bars['stock_number'], bars['period'])):
+        doc = saved.get(stock_number)
+        if doc and doc.get('period') and period < doc['period']:
+            continue
+        if not doc:
+            start_docs.append(None)
+            prev_values.append({})
+        elif doc.get('period') == period:
+            start_docs.append(doc.get('base'))
+            prev_values.append(doc.get('prev_value') or {})
+        else:
+            start_docs.append(doc.get('state'))
+            prev_values.append(doc.get('value') or {})
+        rows.append(i)
+    if not rows:
+        return {}
+
+    bars = bars.iloc[rows].reset_index(drop=True)
+    base = stack_state(indicator, params, start_docs)
+    state, values = advance(indicator, params, base, bars['close'].values.astype(float))
+
+    records = []
+    for i, (stock_number, period) in enumerate(zip(bars['stock_number'], bars['period'])):
+        records.append({
+            'stock_number': stock_number, 'timeframe': timeframe, 'indicator': indicator, 'params': key,
+            'period': period.to_pydatetime(), 'date': date,
+            'base': unstack_state(base, i), 'state': unstack_state(state, i),
+            'value': {k: to_value(v[i]) for k, v in values.items()},
+            'prev_value': prev_values[i],
+        })
+    bulk_upsert(IndicatorState, records, ['timeframe', 'indicator', 'params', 'stock_number'])
+    return dict(zip(bars['stock_number'], values[list(values)[0]]))
+
+
+def save_year_ma(date, year_ma):
+    """
+    把250日均线批量写回SDT的year_ma，pre_sdt_check就不用再逐只股票计算
+    """
+    records = [{'stock_number': k, 'date': date, 'year_ma': round(float(v), 4)}
+               for k, v in year_ma.items() if not np.isnan(v)]
+    return bulk_upsert(SDT, records, ['stock_number', 'date'], upsert=False)
+
+
+def processed_date(timeframe, indicator, params):
+    """
+    (timeframe, indicator, params)已经推进到的最后一个交易日，没有状态时返回None
+    """
+    doc = IndicatorState._get_collection().find_one(
+        {'timeframe': timeframe, 'indicator': indicator, 'params': params_key(params)},
+        {'_id': 0, 'date': 1}, sort=[('date', -1)]
+    )
+    return doc['date'] if doc else None
+
+
+def pending_dates(timeframe, indicator, params, date):
+    """
+    推进到date之前还没有处理的交易日。定时任务漏跑时，上一次的状态不是前一个交易日的，
+    需要先按顺序补上中间的交易日，否则漏掉的K线永远不会进入均线和EMA的累加状态
+    """
+    last = processed_date(timeframe, indicator, params)
+    if not last or last >= date:
+        return [date]
+
+    missing = sorted(SDT._get_collection().distinct('date', {'date': {'$gt': last, '$lt': date}}))
+    if missing:
+        logging.warning('Replay %s %s %s from %s to %s' % (timeframe, indicator, params, missing[0], missing[-1]))
+    return missing + [date]
+
+
+def update_indicator_state(date, specs=indicator_specs):
+    """
+    把date这一天的日线、周线、月线推进到所有指标中，每个周期每天的K线只查询一次；
+    状态落后于前一个交易日时先补上漏掉的交易日。某一天推进失败时停止这个指标，
+    状态停在失败之前，下次运行时重新补上，pre_sdt_check在这期间读不到当天的值，会自己计算
+    """
+    bars = {}
+    for timeframe, indicator, params in specs:
+        for d in pending_dates(timeframe, indicator, params, date):
+            if (timeframe, d) not in bars:
+                bars[(timeframe, d)] = load_bars(timeframe, d)
+            try:
+                values = update_indicator(timeframe, indicator, params, d, bars[(timeframe, d)])
+            except Exception as e:
+                logging.error('Update %s %s %s on %s failed: %s' % (timeframe, indicator, params, d, e))
+                break
+
+            if (timeframe, indicator, params) == year_ma_spec and values:
+                save_year_ma(d, values)
+
+
+def rebuild_indicator_state(start_date, end_date, specs=indicator_specs):
+    """
+    删除已有的状态，按交易日顺序从start_date重放到end_date
+    """
+    for timeframe, indicator, params in specs:
+        IndicatorState.objects(timeframe=timeframe, indicator=indicator, params=params_key(params)).delete()
+
+    trade_dates = SDT._get_collection().distinct('date', {'date': {'$gte': start_date, '$lte': end_date}})
+    for d in sorted(trade_dates):
+        update_indicator_state(d, specs)
+
+
+def load_indicator_values(timeframe, indicator, params, date=None):
+    """
+    一次读出全市场某个指标的值
+    :param date: 只返回最后一根K线在这一天的股票，不传则返回全部
+    :return: stock_number到{date, value, prev_value}的dict
+    """
+    query = {'timeframe': timeframe, 'indicator': indicator, 'params': params_key(params)}
+    if date:
+        query['date'] = date
+    cursor = IndicatorState._get_collection().find(query, {'_id': 0, 'stock_number': 1, 'date': 1, 'value': 1,
+                                                           'prev_value': 1})
+    return {i.pop('stock_number'): i for i in cursor}
+
+
+def load_indicator_series(timeframe, indicator, params, date, name=None):
+    """
+    全市场某个指标在date这一天的值，没有值（K线数量不足）的股票不返回
+    :param name: 指标值中的名字，默认和indicator相同，如macd的dif, dea
+    :return: stock_number到值的dict
+    """
+    name = name or indicator
+    values = load_indicator_values(timeframe, indicator, params, date)
+    return {k: v['value'][name] for k, v in values.items() if (v.get('value') or {}).get(name) is not None}
+
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(description=u'增量更新技术指标')
+    parser.add_argument(u'-t', action=u'store', dest='qr_date', required=False, help=u'推进这一天的K线')
+    parser.add_argument(u'-s', action=u'store', dest='start', required=False, help=u'重建状态的开始日期')
+    parser.add_argument(u'-e', action=u'store', dest='end', required=False, help=u'重建状态的结束日期')
+
+    args = parser.parse_args()
+    dates = []
+    for d in [args.qr_date, args.start, args.end]:
+        dates.append(datetime.datetime.strptime(d, '%Y%m%d') if d else None)
+    return dates
+
+
+if __name__ == '__main__':
+    setup_logging(__file__, logging.WARNING)
+    qr_date, start, end = setup_argparse()
+    if start:
+        rebuild_indicator_state(start, end or datetime.datetime.now())
+    else:
+        if not qr_date:
+            today = datetime.date.today()
+            qr_date = datetime.datetime(year=today.year, month=today.month, day=today.day)
+        update_indicator_state(qr_date)
@@ -5,76 +5,49 @@ import datetime
 import logging
 import argparse
 
-from mongoengine import Q
-from pandas import DataFrame
-
 from logger import setup_logging
-from models import QuantResult as QR, StockDailyTrading as SDT
-from analysis.technical_analysis_util import format_trading_data, check_duplicate_strategy, collect_stock_daily_trading
-from analysis.technical_analysis_util import calculate_macd, calculate_ma, start_quant_analysis, display_quant
-from analysis.technical_analysis_util import pre_sdt_check, setup_realtime_sdt
+from analysis.technical_analysis_util import start_quant_analysis, collect_stock_daily_trading, display_quant
+from analysis.strategy_registry import register_strategy, evaluate_strategies, ma, macd, dif, dea
+from analysis.signal_kernels import cross_up
 
 
 ema_volume = 150
 
 
-def quant_stock(stock_number, stock_name, **kwargs):
-    week_long = kwargs.get('week_long', False)
-    if not pre_sdt_check(stock_number, **kwargs):
-        return
+def direction(params):
+    return 'long' if params['short_ma'] <= params['long_ma'] else 'short'
 
-    real_time = kwargs.get('real_time', False)
-    sdt = SDT.objects(Q(stock_number=stock_number) & Q(today_closing_price__ne=0.0) &
-                      Q(date__lte=kwargs['qr_date'])).order_by('-date')[:ema_volume]
 
-    if float(sdt[0].increase_rate.replace('%', '')) > 9:
+def ma_macd(values, params):
+    diff_ma = values[ma(params['short_ma'])] - values[ma(params['long_ma'])]
+    if not diff_ma.iloc[-1] > 0 > diff_ma.iloc[-2]:
         return
 
-    if real_time:
-        sdt = setup_realtime_sdt(stock_number, sdt, kwargs)
-        if not sdt:
-            return
-    trading_data = format_trading_data(sdt)
-    df = calculate_macd(DataFrame(trading_data), kwargs['short_ema'], kwargs['long_ema'], kwargs['dif_ema'])
-    df = calculate_ma(df, kwargs['short_ma'], kwargs['long_ma'])
-    today = df.iloc[-1]
-    yestoday = df.iloc[-2]
-
-    if short_ma <= long_ma:
-        strategy_direction = 'long'
-    else:
-        strategy_direction = 'short'
-    strategy_name = 'ma_macd_%s_%s_%s' % (strategy_direction, short_ma, long_ma)
-    if week_long:
-        strategy_name = 'weeklong_' + strategy_name
-
-    if today['diff_ma'] > 0 > yestoday['diff_ma']:
-        increase_rate = round((today['close_price'] - yestoday['close_price']) / yestoday['close_price'], 4) * 100
-        qr = ''
-        if strategy_direction == 'long':
-            if today['macd'] > 0 > today['dif'] and today['dea'] < 0:
-                qr = QR(
-                    stock_number=stock_number, stock_name=stock_name, date=today.name,
-                    strategy_direction=strategy_direction, strategy_name=strategy_name,
-                    init_price=today['close_price'], industry_involved=kwargs.get('industry_involved'),
-                    increase_rate=increase_rate
-                )
-        elif strategy_direction == 'short':
-            if today['macd'] < 0 < today['dif'] and today['dea'] > 0:
-                qr = QR(
-                    stock_number=stock_number, stock_name=stock_name, date=today.name,
-                    strategy_direction=strategy_direction, strategy_name=strategy_name,
-                    init_price=today['close_price'], industry_involved=kwargs.get('industry_involved'),
-                    increase_rate=increase_rate
-                )
-
-        if isinstance(qr, QR):
-            if real_time:
-                return qr
-            if not check_duplicate_strategy(qr):
-                qr.save()
-                return qr
-    return ''
+    ema_params = (params['short_ema'], params['long_ema'], params['dif_ema'])
+    macd_value = values[macd(*ema_params)].iloc[-1]
+    dif_value = values[dif(*ema_params[:2])].iloc[-1]
+    dea_value = values[dea(*ema_params)].iloc[-1]
+    strategy_direction = direction(params)
+    if strategy_direction == 'long' and macd_value > 0 > dif_value and dea_value < 0:
+        return strategy_direction
+    if strategy_direction == 'short' and macd_value < 0 < dif_value and dea_value > 0:
+        return strategy_direction
+
+
+strategy = register_strategy(
+    'ma_macd',
+    indicators=lambda p: [ma(p['short_ma']), ma(p['long_ma']), macd(p['short_ema'], p['long_ema'], p['dif_ema'])],
+    rule=ma_macd,
+    strategy_name=lambda d, p: 'ma_macd_%s_%s_%s' % (d, p['short_ma'], p['long_ma']),
+    count=lambda p: ema_volume,
+    max_increase=9,
+    kernel=lambda v, p: cross_up(v[ma(p['short_ma'])] - v[ma(p['long_ma'])]),
+)
+
+
+def quant_stock(stock_number, stock_name, **kwargs):
+    res = evaluate_strategies(stock_number, stock_name, [(strategy, kwargs)])
+    return res[0] if res else ''
 
 
 def setup_argparse():
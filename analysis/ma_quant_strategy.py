@@ -5,68 +5,36 @@ import datetime
 import logging
 import argparse
 
-from mongoengine import Q
-from pandas import DataFrame
-
 from logger import setup_logging
-from models import QuantResult as QR, StockDailyTrading as SDT
-from analysis.technical_analysis_util import calculate_ma, format_trading_data, check_duplicate_strategy
 from analysis.technical_analysis_util import start_quant_analysis, collect_stock_daily_trading, display_quant
-from analysis.technical_analysis_util import pre_sdt_check, setup_realtime_sdt
+from analysis.strategy_registry import register_strategy, evaluate_strategies, ma
+from analysis.signal_kernels import cross_up
 
 
-def quant_stock(stock_number, stock_name, **kwargs):
-    short_ma = kwargs['short_ma']
-    long_ma = kwargs['long_ma']
-    qr_date = kwargs['qr_date']
-    week_long = kwargs.get('week_long', False)
-    if not pre_sdt_check(stock_number, **kwargs):
-        return
-
-    real_time = kwargs.get('real_time', False)
-    if short_ma <= long_ma:
-        strategy_direction = 'long'
-        quant_count = long_ma + 5
-    else:
-        strategy_direction = 'short'
-        quant_count = short_ma + 5
+def direction(params):
+    return 'long' if params['short_ma'] <= params['long_ma'] else 'short'
 
-    strategy_name = 'ma_%s_%s_%s' % (strategy_direction, short_ma, long_ma)
-    if week_long:
-        strategy_name = 'weeklong_' + strategy_name
 
-    sdt = SDT.objects(Q(stock_number=stock_number) & Q(today_closing_price__ne=0.0) &
-                      Q(date__lte=qr_date)).order_by('-date')[:quant_count]
-    if len(sdt) < quant_count:
-        # trading data not enough
-        return
+def ma_cross(values, params):
+    diff_ma = values[ma(params['short_ma'])] - values[ma(params['long_ma'])]
+    if diff_ma.iloc[-1] > 0 > diff_ma.iloc[-2]:
+        return direction(params)
 
-    if real_time:
-        sdt = setup_realtime_sdt(stock_number, sdt, kwargs)
-        if not sdt:
-            return
-    trading_data = format_trading_data(sdt)
-    if not trading_data:
-        return
-
-    df = calculate_ma(DataFrame(trading_data), short_ma, long_ma)
-    today = df.iloc[-1]
-    yestoday = df.iloc[-2]
-
-    if today['diff_ma'] > 0 > yestoday['diff_ma']:
-        increase_rate = round((today['close_price'] - yestoday['close_price']) / yestoday['close_price'], 4) * 100
-        qr = QR(
-            stock_number=stock_number, stock_name=stock_name, date=today.name,
-            strategy_direction=strategy_direction, strategy_name=strategy_name,
-            init_price=today['close_price'], industry_involved=kwargs.get('industry_involved'),
-            increase_rate=increase_rate
-        )
-        if real_time:
-            return qr
-        if not check_duplicate_strategy(qr):
-            qr.save()
-            return qr
-    return ''
+
+strategy = register_strategy(
+    'ma_quant',
+    indicators=lambda p: [ma(p['short_ma']), ma(p['long_ma'])],
+    rule=ma_cross,
+    strategy_name=lambda d, p: 'ma_%s_%s_%s' % (d, p['short_ma'], p['long_ma']),
+    count=lambda p: max(p['short_ma'], p['long_ma']) + 5,
+    min_count=True,
+    kernel=lambda v, p: cross_up(v[ma(p['short_ma'])] - v[ma(p['long_ma'])]),
+)
+
+
+def quant_stock(stock_number, stock_name, **kwargs):
+    res = evaluate_strategies(stock_number, stock_name, [(strategy, kwargs)])
+    return res[0] if res else ''
 
 
 def setup_argparse():
@@ -11,7 +11,7 @@ from pandas import DataFrame
 
 from logger import setup_logging
 from models import QuantResult as QR, StockWeeklyTrading as SWT
-from analysis.technical_analysis_util import calculate_ma, format_trading_data, check_duplicate_strategy
+from analysis.technical_analysis_util import calculate_ma, format_trading_data, save_quant_result
 from analysis.technical_analysis_util import start_quant_analysis, pre_sdt_check, is_ad_price
 
 
@@ -58,9 +58,8 @@ def quant_stock(stock_number, stock_name, **kwargs):
             init_price=init_price, industry_involved=kwargs.get('industry_involved'),
             increase_rate=increase_rate
         )
-        if not check_duplicate_strategy(qr):
-            qr.save()
-            return qr
+        save_quant_result(qr)
+        return qr
     return
 
 
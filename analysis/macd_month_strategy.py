@@ -11,7 +11,7 @@ import logging
 from models import QuantResult as QR
 from logger import setup_logging
 from analysis.technical_analysis_util import start_quant_analysis, pre_sdt_check, get_month_trading
-from analysis.technical_analysis_util import calculate_macd, check_duplicate_strategy
+from analysis.technical_analysis_util import calculate_macd, save_quant_result
 
 
 def quant_stock(stock_number, stock_name, **kwargs):
@@ -48,9 +48,8 @@ def quant_stock(stock_number, stock_name, **kwargs):
             init_price=init_price, industry_involved=kwargs.get('industry_involved'),
             increase_rate=increase_rate
         )
-        if not check_duplicate_strategy(qr):
-            qr.save()
-            return qr
+        save_quant_result(qr)
+        return qr
     return
 
 
@@ -5,63 +5,42 @@ import datetime
 import logging
 import argparse
 
-from mongoengine import Q
-from pandas import DataFrame
-
 from logger import setup_logging
-from models import QuantResult as QR, StockDailyTrading as SDT
-from analysis.technical_analysis_util import calculate_macd, format_trading_data, check_duplicate_strategy
 from analysis.technical_analysis_util import start_quant_analysis, collect_stock_daily_trading, display_quant
-from analysis.technical_analysis_util import pre_sdt_check, setup_realtime_sdt
+from analysis.strategy_registry import register_strategy, evaluate_strategies, macd
+from analysis.signal_kernels import cross_up, cross_down
 
 
 ema_volume = 250
 
 
-def quant_stock(stock_number, stock_name, **kwargs):
-    week_long = kwargs.get('week_long', False)
-    if not pre_sdt_check(stock_number, **kwargs):
-        return
+def ema_params(params):
+    return params['short_ema'], params['long_ema'], params['dif_ema']
 
-    real_time = kwargs.get('real_time', False)
-    sdt = SDT.objects(Q(stock_number=stock_number) & Q(today_closing_price__ne=0.0) &
-                      Q(date__lte=kwargs['qr_date'])).order_by('-date')[:ema_volume]
 
-    if float(sdt[0].increase_rate.replace('%', '')) > 9:
-        return ''
+def macd_cross(values, params):
+    value = values[macd(*ema_params(params))]
+    if value.iloc[-2] < 0 < value.iloc[-1]:
+        return 'long'
+    elif value.iloc[-2] > 0 > value.iloc[-1]:
+        return 'short'
 
-    if real_time:
-        sdt = setup_realtime_sdt(stock_number, sdt, kwargs)
-        if not sdt:
-            return
-    trading_data = format_trading_data(sdt)
-    df = calculate_macd(DataFrame(trading_data), kwargs['short_ema'], kwargs['long_ema'], kwargs['dif_ema'])
-    today = df.iloc[-1]
-    yestoday = df.iloc[-2]
-
-    strategy_direction = ''
-    if yestoday['macd'] < 0 < today['macd']:
-        strategy_direction = 'long'
-    elif yestoday['macd'] > 0 > today['macd']:
-        strategy_direction = 'short'
-
-    if strategy_direction:
-        strategy_name = 'macd_%s_%s_%s_%s' % (strategy_direction, kwargs['short_ema'], kwargs['long_ema'],
-                                              kwargs['dif_ema'])
-        if week_long:
-            strategy_name = 'weeklong_' + strategy_name
-        increase_rate = round((today['close_price'] - yestoday['close_price']) / yestoday['close_price'], 4) * 100
-        qr = QR(
-            stock_number=stock_number, stock_name=stock_name, date=today.name,
-            strategy_direction=strategy_direction, strategy_name=strategy_name, init_price=today['close_price'],
-            industry_involved=kwargs.get('industry_involved'), increase_rate=increase_rate
-        )
-        if real_time and strategy_direction == 'long':
-            return qr
-        if not real_time and not check_duplicate_strategy(qr):
-            qr.save()
-            return qr
-    return ''
+
+strategy = register_strategy(
+    'macd_quant',
+    indicators=lambda p: [macd(*ema_params(p))],
+    rule=macd_cross,
+    strategy_name=lambda d, p: 'macd_%s_%s_%s_%s' % (d, p['short_ema'], p['long_ema'], p['dif_ema']),
+    count=lambda p: ema_volume,
+    max_increase=9,
+    realtime_directions=('long',),
+    kernel=lambda v, p: cross_up(v[macd(*ema_params(p))]) | cross_down(v[macd(*ema_params(p))]),
+)
+
+
+def quant_stock(stock_number, stock_name, **kwargs):
+    res = evaluate_strategies(stock_number, stock_name, [(strategy, kwargs)])
+    return res[0] if res else ''
 
 
 def setup_argparse():
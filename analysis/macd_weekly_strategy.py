@@ -9,7 +9,7 @@ import logging
 from mongoengine import Q
 from pandas import DataFrame
 
-from analysis.technical_analysis_util import pre_sdt_check, calculate_macd, check_duplicate_strategy
+from analysis.technical_analysis_util import pre_sdt_check, calculate_macd, save_quant_result
 from analysis.technical_analysis_util import format_trading_data, start_quant_analysis, is_ad_price
 from models import StockWeeklyTrading as SWT, StockDailyTrading as SDT
 from models import QuantResult as QR
@@ -54,8 +54,7 @@ def quant_stock(stock_number, stock_name, **kwargs):
             strategy_direction=strategy_direction, strategy_name=strategy_name, init_price=init_price,
             industry_involved=kwargs.get('industry_involved'), increase_rate=increase_rate
         )
-        if not check_duplicate_strategy(qr):
-            qr.save()
+        save_quant_result(qr)
 
 
 def setup_argparse():
@@ -13,15 +13,15 @@ import pandas as pd
 from pandas import DataFrame
 
 from logger import setup_logging
-from models import StockInfo,StockNotice as SN
-from models import StockDailyTrading as SDT
+from config import excluded_account_firms
+from models import StockNotice as SN
+from universe import iter_stock_info
 
 
 mining_keywords = [u'要约收购', u'协议收购', u'异常波动', u'权益变动', u'股东增持', u'股票异动', u'交易异常',
                    u'受让', u'股份转让', u'购买资产', u'资产出售', u'资产重组', u'利润分配', u'回购', u'非公开发行']
 time_interval = 0
 timeout = 30  # 发送http请求的超时时间
-query_step = 30  # 一次从数据库中取出的数据量
 
 
 def collect_event_notice(stock_number):
@@ -43,40 +43,18 @@ def collect_event_notice(stock_number):
 
 
 def start_mining_notice():
-    try:
-        all_stocks = StockInfo.objects()
-    except Exception as e:
-        logging.error('Error when query StockInfo:' + str(e))
-        raise e
-
-    stocks_count = len(all_stocks)
-    skip = 0
+    # 过滤瑞华的客户和仍在停牌的票
+    stocks = iter_stock_info('stock_number', exclude_firms=excluded_account_firms, trade_date=datetime.date.today())
 
     notice_data = []
-    while skip < stocks_count:
+    for i in stocks:
+        notice = []
         try:
-            stocks = StockInfo.objects().skip(skip).limit(query_step)
+            notice = collect_event_notice(i.stock_number)
         except Exception as e:
-            logging.error('Error when query skip %s  StockInfo:%s' % (skip, e))
-            stocks = []
-
-        for i in stocks:
-            if i.account_firm and u'瑞华会计师' in i.account_firm:
-                # 过滤瑞华的客户
-                continue
-
-            sdt = SDT.objects(Q(stock_number=i.stock_number) & Q(date=datetime.date.today()))
-            if not sdt:
-                # 过滤仍在停牌的票
-                continue
-
-            try:
-                notice = collect_event_notice(i.stock_number)
-            except Exception as e:
-                logging.error('Error when collect %s notice: %s' % (i.stock_number, e))
-            if notice:
-                notice_data += notice
-        skip += query_step
+            logging.error('Error when collect %s notice: %s' % (i.stock_number, e))
+        if notice:
+            notice_data += notice
 
     if not notice_data:
         return
@@ -9,7 +9,7 @@ import argparse
 
 from logger import setup_logging
 from models import QuantResult as QR
-from analysis.technical_analysis_util import calculate_ma, check_duplicate_strategy
+from analysis.technical_analysis_util import calculate_ma, save_quant_result
 from analysis.technical_analysis_util import start_quant_analysis, pre_sdt_check, get_month_trading
 
 
@@ -46,9 +46,8 @@ def quant_stock(stock_number, stock_name, **kwargs):
             init_price=init_price, industry_involved=kwargs.get('industry_involved'),
             increase_rate=increase_rate
         )
-        if not check_duplicate_strategy(qr):
-            qr.save()
-            return qr
+        save_quant_result(qr)
+        return qr
     return
 
 
@@ -5,13 +5,11 @@ import datetime
 import logging
 import argparse
 
-from mongoengine import Q
-from pandas import DataFrame
-
 from logger import setup_logging
-from models import QuantResult as QR, StockDailyTrading as SDT
-from analysis.technical_analysis_util import collect_stock_daily_trading, start_quant_analysis, format_trading_data
-from analysis.technical_analysis_util import pre_sdt_check, check_duplicate_strategy, display_quant, setup_realtime_sdt
+from models import QuantResult as QR
+from analysis.technical_analysis_util import collect_stock_daily_trading, start_quant_analysis, get_daily_frame
+from analysis.technical_analysis_util import pre_sdt_check, save_quant_result, display_quant, setup_realtime_frame
+from analysis.technical_analysis_util import percent_value, daily_columns, rate_columns
 
 
 def quant_stock(stock_number, stock_name, **kwargs):
@@ -24,16 +22,14 @@ def quant_stock(stock_number, stock_name, **kwargs):
     strategy_name = 'new_peak_%s' % length
     strategy_direction = 'long'
 
-    sdt = SDT.objects(Q(stock_number=stock_number) & Q(today_closing_price__ne=0.0) &
-                      Q(date__lte=qr_date)).order_by('-date')[:length]
+    columns = dict(daily_columns, **rate_columns)
+    df = get_daily_frame(stock_number, qr_date, length, columns, panel=kwargs.get('panel'))
 
     if real_time:
-        sdt = setup_realtime_sdt(stock_number, sdt, kwargs)
-    trading_data = format_trading_data(sdt)
-    if not trading_data:
+        df = setup_realtime_frame(stock_number, df, kwargs, columns)
+    if df.empty:
         return
 
-    df = DataFrame(trading_data)
     today_data = df.iloc[-1]
 
     if df['close_price'].max() <= today_data['close_price']:
@@ -41,13 +37,12 @@ def quant_stock(stock_number, stock_name, **kwargs):
             stock_number=stock_number, stock_name=stock_name, date=today_data.date,
             strategy_direction=strategy_direction, strategy_name=strategy_name,
             init_price=today_data['close_price'], industry_involved=kwargs.get('industry_involved'),
-            increase_rate=float(sdt[0].increase_rate.replace('%', ''))
+            increase_rate=percent_value(today_data, 'increase_rate')
         )
         if real_time:
             return qr
-        if not check_duplicate_strategy(qr):
-            qr.save()
-            return qr
+        save_quant_result(qr)
+        return qr
     return
 
 
@@ -12,6 +12,7 @@ from pandas import DataFrame
 from models import StockInfo
 from models import StockDailyTrading as SDT
 from logger import setup_logging
+from analysis.technical_analysis_util import percent_value
 
 
 def query_market_plate_stock(market_plate, filter_ruihua=True):
@@ -52,11 +53,10 @@ def main(market_plate=u'创业板', filter_ruihua=True):
         today = datetime.date.today()
         if sdt.today_closing_price > 0 and sdt.date.date() == today:
             item = {u'stock_number': i.stock_number, u'stock_name': i.stock_name.encode('utf-8'),
-                    u'increase_rate': sdt.increase_rate, u'today_closing_price': sdt.today_closing_price}
+                    u'increase_rate': percent_value(sdt, 'increase_rate'), u'today_closing_price': sdt.today_closing_price}
             plate_stocks.append(item)
 
-    plate_stocks = sorted(plate_stocks, key=lambda stock: float(stock.get('increase_rate').replace('%', '')),
-                          reverse=True)
+    plate_stocks = sorted(plate_stocks, key=lambda stock: stock.get('increase_rate') or 0, reverse=True)
 
     print(market_plate)
     print(len(plate_stocks))
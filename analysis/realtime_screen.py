@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+常驻的实时选股。启动时用panel一次取出全市场的历史日线，对注册的策略算好昨天收盘时的指标值和推进需要的状态
+（均线窗口内前n-1天的和，EMA的加权分子分母），pre_sdt_check等只和历史有关的过滤也只做一次；
+之后按间隔轮询全市场行情，只对价格有变化的股票用最新价推进一步，用各策略的kernel判断信号，新出现的结果立即打印
+"""
+
+import time
+import logging
+import argparse
+import datetime
+import importlib
+
+import numpy as np
+import pandas as pd
+
+from logger import setup_logging
+from config import excluded_account_firms
+from universe import load_universe
+from analysis.batch_strategy_runner import evening_jobs
+from analysis.technical_analysis_util import load_market_panel, collect_realtime_quote, display_quant
+from analysis.technical_analysis_util import pre_sdt_check, year_num
+from analysis.strategy_registry import plan_jobs, compute_indicators, make_quant_result, close, ema, dif, dea
+from analysis.signal_kernels import align_bars, rolling_mean, ewm_mean, ewm_scan
+from analysis.indicator_state import ema_step
+
+
+poll_interval = 1.0  # 轮询行情的间隔，单位 秒
+history_days = year_num + 10  # 启动时取出的历史交易日数，需要覆盖pre_sdt_check和各策略的日线数量
+trading_end = datetime.time(15, 5)
+
+
+def load_registered_jobs(names=None):
+    """
+    evening_jobs中注册了kernel的策略，names不为空时只保留这些模块
+    """
+    jobs = []
+    for module_name, params in evening_jobs:
+        if names and module_name not in names:
+            continue
+        module = importlib.import_module('analysis.' + module_name)
+        if getattr(module, 'strategy', None) is not None and module.strategy.kernel is not None:
+            jobs.append((module.strategy, params))
+    return jobs
+
+
+def check_stock(stock_number, params):
+    try:
+        return bool(pre_sdt_check(stock_number, **params))
+    except Exception as e:
+        logging.error('Error when check %s: %s' % (stock_number, e))
+        return False
+
+
+class RealtimeScreen(object):
+    """
+    :param jobs: (strategy, params)的列表，strategy需要有kernel
+    :param qr_date: 当天的日期
+    :param days: 启动时取出的历史交易日数
+    """
+
+    def __init__(self, jobs, qr_date, days=history_days):
+        self.qr_date = qr_date
+        self.jobs = [(strategy, dict(params, qr_date=qr_date, real_time=True)) for strategy, params in jobs]
+        self.plan = plan_jobs(self.jobs)
+        panel = load_market_panel(qr_date - datetime.timedelta(days=1), days)
+
+        universe = load_universe('stock_number', 'stock_name', 'industry_involved',
+                                 exclude_firms=excluded_account_firms)
+        self.stock_info = {i.stock_number: i for i in universe}
+        self.stocks = [s for s in panel['stocks'] if s in self.stock_info]
+        rows = np.array([panel['index'][s] for s in self.stocks], dtype=int)
+
+        self.frames = {k: self.init_frame(panel, rows, k, v) for k, v in self.plan.items()}
+        self.eligible = self.init_eligible(panel)
+        self.last_price = np.full(len(self.stocks), np.nan)
+        self.found = set()
+
+    def init_frame(self, panel, rows, skip_suspended, frame):
+        """
+        取出每只股票截止昨天的count-1条日线，算出各指标昨天的值和推进需要的状态
+        """
+        valid = ~panel['missing'][rows]
+        if skip_suspended:
+            valid &= ~panel['suspended'][rows]
+        history = align_bars(panel['close'][rows], valid, frame['count'] - 1)
+        series = compute_indicators(history, frame['graph'], rolling_mean, ewm_mean)
+
+        state = {}
+        for node in frame['graph']:
+            if node[0] == 'ma':
+                # 前n-1天的和，窗口内有NaN时为NaN
+                state[node] = history[:, history.shape[1] - node[1] + 1:].sum(axis=1)
+            elif node[0] == 'ema':
+                state[node] = ewm_scan(history, node[1])[1:]
+            elif node[0] == 'dea':
+                state[node] = ewm_scan(series[dif(node[1], node[2])], node[3])[1:]
+
+        pre_close = align_bars(panel['pre_close'][rows], valid, 1)[:, 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            last_increase = np.round((history[:, -1] - pre_close) / pre_close * 100, 2)
+        return {
+            'graph': frame['graph'],
+            'prev': {node: v[:, -1] for node, v in series.items()},
+            'today': {node: np.full(len(self.stocks), np.nan) for node in frame['graph']},
+            'state': state,
+            'stored': valid.sum(axis=1),
+            'last_increase': last_increase,
+        }
+
+    def init_eligible(self, panel):
+        """
+        只和历史有关的过滤：pre_sdt_check、日线数量和昨天的涨幅，每个任务得到一个股票的mask
+        """
+        checked = {}
+        eligible = []
+        for strategy, params in self.jobs:
+            week_long = params.get('week_long', False)
+            if week_long not in checked:
+                check_params = dict(params, panel=panel)
+                checked[week_long] = np.array([check_stock(s, check_params) for s in self.stocks], dtype=bool)
+
+            mask = checked[week_long].copy()
+            frame = self.frames[strategy.skip_suspended]
+            if strategy.min_count:
+                mask &= frame['stored'] >= strategy.count(params)
+            if strategy.max_increase is not None:
+                mask &= frame['last_increase'] <= strategy.max_increase
+            eligible.append(mask)
+        return eligible
+
+    def advance(self, frame, rows, price):
+        """
+        用rows对应股票的最新价从昨天的状态推进一步，得到今天的指标值
+        """
+        today, state = frame['today'], frame['state']
+        for node in frame['graph']:
+            if node == close:
+                value = price
+            elif node[0] == 'ma':
+                value = (state[node][rows] + price) / node[1]
+            elif node[0] == 'ema':
+                value = ema_step(state[node][0][rows], state[node][1][rows], price, node[1])[2]
+            elif node[0] == 'dif':
+                value = today[ema(node[1])][rows] - today[ema(node[2])][rows]
+            elif node[0] == 'dea':
+                value = ema_step(state[node][0][rows], state[node][1][rows], today[dif(node[1], node[2])][rows],
+                                 node[3])[2]
+            else:
+                value = today[dif(node[1], node[2])][rows] - today[dea(*node[1:])][rows]
+            today[node][rows] = value
+
+    def update(self, quote):
+        """
+        用一次行情快照更新价格有变化的股票，返回新出现的QuantResult
+        """
+        price = quote.drop_duplicates('stock_number').set_index('stock_number')['today_closing_price']
+        price = price.reindex(self.stocks).values.astype(float)
+        changed = np.flatnonzero(~np.isnan(price) & (price != self.last_price))
+        if not changed.size:
+            return []
+        self.last_price[changed] = price[changed]
+
+        views = {}
+        for key, frame in self.frames.items():
+            self.advance(frame, changed, price[changed])
+            views[key] = {node: np.column_stack([frame['prev'][node][changed], frame['today'][node][changed]])
+                          for node in frame['graph']}
+
+        date = datetime.datetime.combine(self.qr_date, datetime.time(0, 0))
+        hits = []
+        for i, (strategy, params) in enumerate(self.jobs):
+            values = views[strategy.skip_suspended]
+            mask = strategy.kernel(values, params) & self.eligible[i][changed]
+            for j in np.flatnonzero(mask):
+                strategy_direction = strategy.rule({k: pd.Series(v[j]) for k, v in values.items()}, params)
+                if not strategy_direction or strategy_direction not in strategy.realtime_directions:
+                    continue
+
+                row = changed[j]
+                stock_number = self.stocks[row]
+                info = self.stock_info[stock_number]
+                key = (strategy.name, strategy.strategy_name(strategy_direction, params), stock_number)
+                if key in self.found:
+                    continue
+                self.found.add(key)
+                hits.append(make_quant_result(
+                    stock_number, info.stock_name, strategy, strategy_direction,
+                    dict(params, industry_involved=info.industry_involved), date, price[row], values[close][j, 0]
+                ))
+        return hits
+
+    def run(self, interval=poll_interval, end_time=trading_end):
+        """
+        每interval秒轮询一次行情，直到end_time
+        """
+        while datetime.datetime.now().time() < end_time:
+            start = time.time()
+            try:
+                hits = self.update(collect_realtime_quote())
+            except Exception as e:
+                logging.error('Realtime screen failed: %s' % e)
+                hits = []
+            if hits:
+                display_quant(hits)
+            time.sleep(max(0, interval - (time.time() - start)))
+
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(description=u'常驻的实时选股')
+    parser.add_argument(u'-j', action=u'store', dest='jobs', nargs='+', required=False, help=u'只运行这些策略模块')
+    parser.add_argument(u'-i', action=u'store', type=float, dest='interval', default=poll_interval, required=False,
+                        help=u'轮询行情的间隔')
+    parser.add_argument(u'-d', action=u'store', type=int, dest='days', default=history_days, required=False,
+                        help=u'启动时取出的历史交易日数')
+
+    args = parser.parse_args()
+    return args.jobs, args.interval, args.days
+
+
+if __name__ == '__main__':
+    setup_logging(__file__, logging.WARNING)
+    job_names, interval, days = setup_argparse()
+    screen = RealtimeScreen(load_registered_jobs(job_names), datetime.date.today(), days)
+    screen.run(interval)
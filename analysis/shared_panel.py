@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+把load_panel得到的panel发布到multiprocessing.shared_memory中，多进程运行策略时每个子进程只需要一个很小的描述，
+attach后得到的是指向同一块共享内存的只读numpy数组，内存占用不随进程数增加。
+发布时panel中的数组被原地换成共享内存的视图，父进程不会同时持有原来的数组和共享内存两份数据；
+来自价格库的内存映射数组本身就由页缓存共享，不再复制
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+attached_blocks = []  # 当前进程attach的共享内存，numpy视图使用期间需要保持引用
+
+
+def publish_panel(panel):
+    """
+    把panel中的数组逐个移到新建的共享内存中，panel中的数组随即替换成共享内存的视图，原来的数组被释放
+    :return: (blocks, descriptor)，blocks是字段到共享内存的dict，由创建方在用完后交给release_panel释放，
+             descriptor: {
+                stocks: 股票编号列表,
+                arrays: 字段到(共享内存名, shape, dtype)的dict,
+                mapped: 字段到价格库内存映射数组的dict，fork的子进程直接继承
+             }
+    """
+    blocks = {}
+    descriptor = {'stocks': list(panel['stocks']), 'arrays': {}, 'mapped': {}}
+    try:
+        for k, v in list(panel.items()):
+            if isinstance(v, np.memmap):
+                descriptor['mapped'][k] = v
+                continue
+            if not isinstance(v, np.ndarray):
+                continue
+            shm = shared_memory.SharedMemory(create=True, size=max(v.nbytes, 1))
+            blocks[k] = shm
+            shared = np.ndarray(v.shape, dtype=v.dtype, buffer=shm.buf)
+            shared[:] = v
+            shared.flags.writeable = False
+            panel[k] = shared
+            descriptor['arrays'][k] = (shm.name, v.shape, v.dtype.str)
+    except Exception:
+        release_panel(blocks, panel)
+        raise
+    return blocks, descriptor
+
+
+def attach_panel(descriptor):
+    """
+    按descriptor attach共享内存，返回结构和load_panel相同的panel，数组都是只读的
+    """
+    panel = {
+        'stocks': descriptor['stocks'],
+        'index': {s: i for i, s in enumerate(descriptor['stocks'])},
+    }
+    panel.update(descriptor['mapped'])
+    for k, (name, shape, dtype) in descriptor['arrays'].items():
+        shm = shared_memory.SharedMemory(name=name)
+        attached_blocks.append(shm)
+        values = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        values.flags.writeable = False
+        panel[k] = values
+    return panel
+
+
+def release_panel(blocks, panel=None):
+    """
+    删除publish_panel创建的共享内存，panel中对应的视图一并移除，之后不能再使用；
+    其他地方还持有视图时共享内存在视图释放后回收
+    """
+    for k, shm in blocks.items():
+        if panel is not None:
+            panel.pop(k, None)
+        try:
+            shm.close()
+        except BufferError:
+            pass
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
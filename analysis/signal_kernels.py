@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+在 股票 × K线 的矩阵上向量化地计算均线、MACD和信号，一次调用判断全市场，返回触发信号的股票的mask。
+矩阵每行是一只股票，按时间从左到右排列，NaN表示没有数据；计算方法和calculate_ma、calculate_macd中的pandas一致
+"""
+
+import numpy as np
+
+
+def align_bars(values, valid, count):
+    """
+    把每只股票最近count个有效的K线右对齐到 股票 × count 的矩阵，有效K线不足count条时左边为NaN，
+    和get_daily_frame对每只股票取出的日线一致
+    :param values: 股票 × 交易日 的矩阵，如panel['close']
+    :param valid: 和values形状相同的bool矩阵，如~panel['missing'] & ~panel['suspended']
+    """
+    pos = np.cumsum(valid, axis=1)
+    target = pos - 1 - (pos[:, -1:] - count)
+    rows, cols = np.nonzero(valid & (target >= 0))
+    res = np.full((values.shape[0], count), np.nan)
+    res[rows, target[rows, cols]] = values[rows, cols]
+    return res
+
+
+def rolling_mean(x, n):
+    """
+    每个位置最近n个值的均值，窗口内有NaN时为NaN，同rolling(window=n).mean()
+    """
+    res = np.full(x.shape, np.nan)
+    if x.shape[1] < n:
+        return res
+
+    zeros = np.zeros((x.shape[0], 1))
+    total = np.hstack([zeros, np.cumsum(np.nan_to_num(x), axis=1)])
+    nan_count = np.hstack([zeros, np.cumsum(np.isnan(x), axis=1)])
+    window_sum = total[:, n:] - total[:, :-n]
+    window_nan = nan_count[:, n:] - nan_count[:, :-n]
+    res[:, n - 1:] = np.where(window_nan == 0, window_sum / n, np.nan)
+    return res
+
+
+def ewm_scan(x, span):
+    """
+    同ewm(span=span).mean()，即adjust=True，NaN不产生权重但之前的权重照常衰减。
+    只在K线方向上循环，每一步处理全部股票
+    :return: (均值矩阵, 最后的加权分子, 最后的加权分母)，分子分母可以交给indicator_state.ema_step继续推进
+    """
+    decay = 1 - 2.0 / (span + 1)
+    num = np.zeros(x.shape[0])
+    den = np.zeros(x.shape[0])
+    res = np.full(x.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for j in range(x.shape[1]):
+            valid = ~np.isnan(x[:, j])
+            num = decay * num + np.where(valid, x[:, j], 0)
+            den = decay * den + valid
+            res[:, j] = np.where(den > 0, num / den, np.nan)
+    return res, num, den
+
+
+def ewm_mean(x, span):
+    return ewm_scan(x, span)[0]
+
+
+def cross_up(x):
+    """
+    最后一根K线由负转正，NaN不触发
+    """
+    return (x[:, -2] < 0) & (x[:, -1] > 0)
+
+
+def cross_down(x):
+    """
+    最后一根K线由正转负，NaN不触发
+    """
+    return (x[:, -2] > 0) & (x[:, -1] < 0)
+
+
+def breakout(close, short_value, long_value):
+    """
+    上一根K线收在长均线下，最后一根K线收在长短均线上
+    """
+    return (close[:, -2] < long_value[:, -2]) & (close[:, -1] > short_value[:, -1]) & \
+        (close[:, -1] > long_value[:, -1])
+
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+声明式的日线策略注册。策略只声明需要的日线数量、指标和信号规则，由引擎对每只股票只取一次日线，
+把所有策略需要的指标展开成去重的依赖图，每个指标只计算一次，再依次判断各策略的信号。
+指标用元组表示，如('ma', 5)，('ema', 12)，('dif', 12, 26)，('dea', 12, 26, 9)，('macd', 12, 26, 9)
+"""
+
+import numpy as np
+import pandas as pd
+
+from models import QuantResult as QR
+from analysis.technical_analysis_util import get_daily_frame, pre_sdt_check, setup_realtime_frame
+from analysis.technical_analysis_util import save_quant_result, percent_value, daily_columns, rate_columns
+from analysis.signal_kernels import align_bars, rolling_mean, ewm_mean
+
+
+registry = {}
+close = ('close',)
+frame_columns = dict(daily_columns, **rate_columns)
+
+
+def ma(n):
+    return 'ma', n
+
+
+def ema(n):
+    return 'ema', n
+
+
+def dif(short_ema, long_ema):
+    return 'dif', short_ema, long_ema
+
+
+def dea(short_ema, long_ema, dif_ema):
+    return 'dea', short_ema, long_ema, dif_ema
+
+
+def macd(short_ema, long_ema, dif_ema):
+    return 'macd', short_ema, long_ema, dif_ema
+
+
+class Strategy(object):
+    """
+    一个注册的策略，params是运行时的参数，和quant_stock的kwargs相同
+    :param name: 注册名
+    :param indicators: params -> 需要的指标列表
+    :param rule: (values, params) -> strategy_direction，没有信号时返回None，values是指标到Series的dict
+    :param strategy_name: (strategy_direction, params) -> QuantResult的strategy_name，不含weeklong_前缀
+    :param count: params -> 需要的日线数量
+    :param min_count: 是否要求日线数量达到count
+    :param skip_suspended: 是否跳过停牌的日线
+    :param max_increase: 最后一个交易日的涨幅超过该值时不选
+    :param realtime_directions: 实时计算时返回的方向
+    :param kernel: (values, params) -> 股票的mask，values是指标到 股票 × K线 矩阵的dict，
+                   用signal_kernels在全市场上预先判断rule，没有kernel的策略逐只股票判断
+    """
+
+    def __init__(self, name, indicators, rule, strategy_name, count, min_count=False, skip_suspended=True,
+                 max_increase=None, realtime_directions=('long', 'short'), kernel=None):
+        self.name = name
+        self.indicators = indicators
+        self.rule = rule
+        self.strategy_name = strategy_name
+        self.count = count
+        self.min_count = min_count
+        self.skip_suspended = skip_suspended
+        self.max_increase = max_increase
+        self.realtime_directions = realtime_directions
+        self.kernel = kernel
+
+
+def register_strategy(name, **kwargs):
+    strategy = Strategy(name, **kwargs)
+    registry[name] = strategy
+    return strategy
+
+
+def indicator_deps(node):
+    if node[0] in ('ma', 'ema'):
+        return [close]
+    if node[0] == 'dif':
+        return [ema(node[1]), ema(node[2])]
+    if node[0] == 'dea':
+        return [dif(node[1], node[2])]
+    if node[0] == 'macd':
+        return [dif(node[1], node[2]), dea(*node[1:])]
+    return []
+
+
+def build_indicator_graph(nodes):
+    """
+    展开指标的依赖并去重，按计算顺序返回
+    """
+    graph = []
+    seen = set()
+
+    def visit(node):
+        if node in seen:
+            return
+        seen.add(node)
+        for dep in indicator_deps(node):
+            visit(dep)
+        graph.append(node)
+
+    for node in nodes:
+        visit(node)
+    return graph
+
+
+def series_rolling(x, n):
+    return x.rolling(window=n, center=False).mean()
+
+
+def series_ewm(x, span):
+    return x.ewm(span=span).mean()
+
+
+def compute_indicators(close_values, graph, rolling=series_rolling, ewm=series_ewm):
+    """
+    按graph的顺序计算指标，和calculate_ma、calculate_macd的算法一致
+    :param close_values: 一只股票的收盘价Series；传入signal_kernels的rolling_mean和ewm_mean时可以是 股票 × K线 的矩阵
+    """
+    values = {}
+    for node in graph:
+        if node == close:
+            values[node] = close_values
+        elif node[0] == 'ma':
+            values[node] = rolling(values[close], node[1])
+        elif node[0] == 'ema':
+            values[node] = ewm(values[close], node[1])
+        elif node[0] == 'dif':
+            values[node] = values[ema(node[1])] - values[ema(node[2])]
+        elif node[0] == 'dea':
+            values[node] = ewm(values[dif(node[1], node[2])], node[3])
+        elif node[0] == 'macd':
+            values[node] = values[dif(node[1], node[2])] - values[dea(*node[1:])]
+    return values
+
+
+def plan_jobs(jobs):
+    """
+    合并所有任务需要的日线和指标，同一种日线（是否跳过停牌）只取一次，取各策略中最大的数量
+    :param jobs: (strategy, params)的列表
+    :return: skip_suspended到{count, graph}的dict
+    """
+    plan = {}
+    for strategy, params in jobs:
+        frame = plan.setdefault(strategy.skip_suspended, {'count': 0, 'nodes': []})
+        frame['count'] = max(frame['count'], strategy.count(params))
+        frame['nodes'].extend(strategy.indicators(params))
+    return {k: {'count': v['count'], 'graph': build_indicator_graph(v['nodes'])} for k, v in plan.items()}
+
+
+def screen_panel(jobs, plan, panel, end_date):
+    """
+    用各策略的kernel在panel上一次判断全市场，kernel只用来预先过滤，候选的股票仍由rule逐只确认
+    :return: 和jobs一一对应的候选股票集合，没有kernel的策略为None
+    """
+    end = np.searchsorted(panel['dates'], np.datetime64(pd.to_datetime(end_date)), side='right')
+    matrices = {}
+    candidates = []
+    for strategy, params in jobs:
+        if strategy.kernel is None:
+            candidates.append(None)
+            continue
+
+        key = strategy.skip_suspended
+        if key not in matrices:
+            valid = ~panel['missing'][:, :end]
+            if key:
+                valid &= ~panel['suspended'][:, :end]
+            bars = align_bars(panel['close'][:, :end], valid, plan[key]['count'])
+            matrices[key] = compute_indicators(bars, plan[key]['graph'], rolling_mean, ewm_mean)
+        mask = strategy.kernel(matrices[key], params)
+        candidates.append({s for s, m in zip(panel['stocks'], mask) if m})
+    return candidates
+
+
+def load_frame(stock_number, frame, kwargs, skip_suspended):
+    """
+    取出一只股票的日线并计算frame中的所有指标
+    :return: (df, 实时行情追加前的最后一行, 实时行情追加前的条数, 指标)
+    """
+    df = get_daily_frame(stock_number, kwargs['qr_date'], frame['count'], frame_columns, skip_suspended,
+                         panel=kwargs.get('panel'))
+    if df.empty:
+        return None
+    last, stored = df.iloc[-1], len(df)
+
+    if kwargs.get('real_time'):
+        df = setup_realtime_frame(stock_number, df, kwargs, frame_columns)
+        if df.empty:
+            return None
+    return df, last, stored, compute_indicators(df['close_price'], frame['graph'])
+
+
+def make_quant_result(stock_number, stock_name, strategy, strategy_direction, params, date, today_price,
+                      yestoday_price):
+    strategy_name = strategy.strategy_name(strategy_direction, params)
+    if params.get('week_long', False):
+        strategy_name = 'weeklong_' + strategy_name
+    increase_rate = round((today_price - yestoday_price) / yestoday_price, 4) * 100
+    return QR(
+        stock_number=stock_number, stock_name=stock_name, date=date,
+        strategy_direction=strategy_direction, strategy_name=strategy_name, init_price=today_price,
+        industry_involved=params.get('industry_involved'), increase_rate=increase_rate
+    )
+
+
+def evaluate_strategies(stock_number, stock_name, jobs, plan=None, candidates=None):
+    """
+    对一只股票运行多个注册的策略，pre_sdt_check、日线和指标都只计算一次
+    :param jobs: (strategy, params)的列表
+    :param plan: plan_jobs的结果，不传时由jobs生成
+    :param candidates: screen_panel的结果，不在候选集合中的策略直接跳过
+    :return: 选出的QuantResult列表
+    """
+    plan = plan or plan_jobs(jobs)
+    checked = {}
+    frames = {}
+    quant_res = []
+
+    for i, (strategy, params) in enumerate(jobs):
+        if candidates and candidates[i] is not None and stock_number not in candidates[i]:
+            continue
+
+        week_long = params.get('week_long', False)
+        if week_long not in checked:
+            checked[week_long] = pre_sdt_check(stock_number, **params)
+        if not checked[week_long]:
+            continue
+
+        if strategy.skip_suspended not in frames:
+            frames[strategy.skip_suspended] = load_frame(stock_number, plan[strategy.skip_suspended], params,
+                                                         strategy.skip_suspended)
+        if frames[strategy.skip_suspended] is None:
+            continue
+        df, last, stored, values = frames[strategy.skip_suspended]
+
+        if len(df) < 2 or (strategy.min_count and stored < strategy.count(params)):
+            continue
+        if strategy.max_increase is not None:
+            rate = percent_value(last, 'increase_rate')
+            if rate is None or rate > strategy.max_increase:
+                continue
+
+        strategy_direction = strategy.rule(values, params)
+        if not strategy_direction:
+            continue
+        real_time = params.get('real_time', False)
+        if real_time and strategy_direction not in strategy.realtime_directions:
+            continue
+
+        qr = make_quant_result(stock_number, stock_name, strategy, strategy_direction, params, df['date'].iloc[-1],
+                               df['close_price'].iloc[-1], df['close_price'].iloc[-2])
+        if not real_time:
+            save_quant_result(qr)
+        quant_res.append(qr)
+    return quant_res
+
+
+def quant_stock(stock_number, stock_name, **kwargs):
+    """
+    作为start_batch_analysis的任务运行所有注册的策略
+    :param kwargs:{
+        registered_jobs: (strategy, params)的列表，params是各策略自己的参数
+        indicator_plan: prepare_kwargs生成的plan
+        candidates: prepare_kwargs在panel上预先筛选的候选股票
+    }
+    """
+    jobs = [(strategy, dict(kwargs, **params)) for strategy, params in kwargs['registered_jobs']]
+    return evaluate_strategies(stock_number, stock_name, jobs, kwargs.get('indicator_plan'), kwargs.get('candidates'))
+
+
+def prepare_kwargs(**kwargs):
+    """
+    运行前一次性生成所有注册策略的指标依赖图；有panel且不是实时计算时，先用kernel在全市场上筛出候选股票
+    """
+    jobs = [(strategy, dict(kwargs, **params)) for strategy, params in kwargs['registered_jobs']]
+    res = {'indicator_plan': plan_jobs(jobs)}
+    if kwargs.get('panel') is not None and not kwargs.get('real_time'):
+        res['candidates'] = screen_panel(jobs, res['indicator_plan'], kwargs['panel'], kwargs['qr_date'])
+    return res
@@ -1,21 +1,29 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import math
+import atexit
 import logging
 import datetime
-import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import tushare as ts
-import requests
 import pandas as pd
 from pandas import DataFrame
-from models import QuantResult as QR, StockDailyTrading as SDT, StockInfo, StockWeeklyTrading as SWT
-from mongoengine import Q
-from config import eastmoney_stock_api
+from models import QuantResult as QR, StockDailyTrading as SDT, StockWeeklyTrading as SWT
+from models import StockMonthlyTrading as SMT, StockMarginTrading, remove_duplicate_quant_result
+from mongoengine import Q, connect, disconnect
+from pymongo.errors import OperationFailure
+from config import eastmoney_stock_api, excluded_account_firms, mongodb_config, quant_workers, quant_shards_per_worker
+from universe import iter_stock_info
+from price_store import load_price_store
+from analysis.shared_panel import publish_panel, attach_panel, release_panel
+from analysis.indicator_state import load_indicator_series
+from collector.collect_data_util import request_and_handle_data, parse_rank_frame, bulk_upsert
 
 
-query_step = 100
-timeout = 60
 retry = 5
 year_num = 250
 
@@ -73,38 +81,275 @@ def calculate_ma(df, short_ma, long_ma):
         raise Exception('df type is wrong')
 
 
+# 日线集合字段到DataFrame列名的映射，和format_trading_data的输出一致
+daily_columns = {
+    'date': 'date',
+    'today_closing_price': 'close_price',
+    'today_highest_price': 'high_price',
+    'today_lowest_price': 'low_price',
+}
+rate_columns = {
+    'increase_rate': 'increase_rate',
+    'increase_rate_value': 'increase_rate_value',
+}
+
+
+def query_trading_frame(document, query, columns, date_field, count=None):
+    """
+    用pymongo按投影查询，直接由cursor构造DataFrame，不构造Document对象
+    :param document: 需要查询的mongoengine Document类
+    :param query: pymongo的查询条件
+    :param columns: 集合字段到列名的映射
+    :param date_field: 排序的日期字段，取最近的count条
+    :return: 按日期升序排列的DataFrame
+    """
+    projection = {k: 1 for k in columns}
+    projection['_id'] = 0
+    cursor = document._get_collection().find(query, projection).sort(date_field, -1)
+    if count:
+        cursor = cursor.limit(count).batch_size(count)
+    df = DataFrame.from_records(cursor, columns=list(columns)).rename(columns=columns)
+    return df.iloc[::-1].reset_index(drop=True)
+
+
+def get_daily_frame(stock_number, end_date, count, columns=None, skip_suspended=True, panel=None):
+    """
+    读取一只股票截止end_date的最近count条日线，默认包含date, close_price, high_price, low_price。
+    传入load_panel返回的panel时直接从内存中切片，不再查询数据库
+    """
+    if panel is not None and panel_supports(panel, columns or daily_columns):
+        return panel_frame(panel, stock_number, end_date, count, columns or daily_columns, skip_suspended)
+
+    query = {'stock_number': stock_number, 'date': {'$lte': pd.to_datetime(end_date).to_pydatetime()}}
+    if skip_suspended:
+        query['today_closing_price'] = {'$ne': 0.0}
+    return query_trading_frame(SDT, query, columns or daily_columns, 'date', count)
+
+
+def get_weekly_frame(stock_number, end_date, count, use_ad_price=False):
+    """
+    读取一只股票截止end_date的最近count条周线，包含date和close_price
+    """
+    close_field = 'ad_close_price' if use_ad_price else 'weekly_close_price'
+    query = {'stock_number': stock_number, 'last_trade_date': {'$lte': pd.to_datetime(end_date).to_pydatetime()}}
+    return query_trading_frame(SWT, query, {'last_trade_date': 'date', close_field: 'close_price'},
+                               'last_trade_date', count)
+
+
+# panel中的字段到日线集合字段的映射
+panel_fields = {
+    'pre_close': 'yesterday_closed_price',
+    'open': 'today_opening_price',
+    'close': 'today_closing_price',
+    'high': 'today_highest_price',
+    'low': 'today_lowest_price',
+    'volume': 'turnover_volume',
+    'amount': 'turnover_amount',
+}
+
+
+def trading_dates(end_date, count):
+    """
+    截止end_date的最近count个交易日
+    """
+    end_date = pd.to_datetime(end_date).to_pydatetime()
+    dates = sorted(SDT._get_collection().distinct('date', {'date': {'$lte': end_date}}))
+    return dates[-count:]
+
+
+def load_panel(start_date, end_date, stocks=None, fields=None):
+    """
+    用一次流式聚合查询取出区间内全市场的日线，按 股票 × 交易日 对齐成二维数组
+    :param start_date: 开始日期，包含
+    :param end_date: 结束日期，包含
+    :param stocks: 只取这些股票，不传则取全部
+    :param fields: 需要的字段，panel_fields中的key，默认全部
+    :return: {
+        stocks: 股票编号列表，对应数组的行
+        index: 股票编号到行号的dict
+        dates: numpy datetime64数组，对应数组的列
+        fields中的每个字段: 股票 × 交易日 的float64数组，没有数据的位置为NaN
+        missing: 没有这一天数据的位置为True，包括未上市、已退市和缺失的数据
+        suspended: 有数据但当天停牌（收盘价为0）的位置为True
+    }
+    """
+    fields = list(fields or panel_fields)
+    if 'close' not in fields:
+        fields.append('close')
+
+    match = {'date': {'$gte': pd.to_datetime(start_date).to_pydatetime(),
+                      '$lte': pd.to_datetime(end_date).to_pydatetime()}}
+    if stocks is not None:
+        match['stock_number'] = {'$in': list(stocks)}
+    projection = {f: '$' + panel_fields[f] for f in fields}
+    projection.update({'_id': 0, 'stock_number': 1, 'date': 1})
+    cursor = SDT._get_collection().aggregate([{'$match': match}, {'$project': projection}],
+                                             allowDiskUse=True, batchSize=10000)
+    df = DataFrame.from_records(cursor, columns=['stock_number', 'date'] + fields)
+    df = df.drop_duplicates(['stock_number', 'date'], keep='last')
+
+    stock_index = pd.Index(sorted(set(stocks) if stocks is not None else df['stock_number'].unique()))
+    date_index = pd.DatetimeIndex(sorted(df['date'].unique()))
+    rows = stock_index.get_indexer(df['stock_number'])
+    cols = date_index.get_indexer(df['date'])
+    shape = (len(stock_index), len(date_index))
+
+    panel = {
+        'stocks': list(stock_index),
+        'index': {s: i for i, s in enumerate(stock_index)},
+        'dates': date_index.values,
+        'missing': np.ones(shape, dtype=bool),
+    }
+    panel['missing'][rows, cols] = False
+    for f in fields:
+        values = np.full(shape, np.nan)
+        values[rows, cols] = pd.to_numeric(df[f], errors='coerce').values
+        panel[f] = values
+    panel['suspended'] = ~panel['missing'] & ~(panel['close'] > 0)
+    return panel
+
+
+def load_store_panel(dates, stocks=None, fields=None):
+    """
+    从本地价格库读取dates这些交易日的panel，结构和load_panel相同，价格数组是价格库内存映射文件的只读视图，不复制数据。
+    价格库没有完整覆盖这些交易日或缺少需要的字段时返回None
+    """
+    fields = list(fields or panel_fields)
+    if 'close' not in fields:
+        fields.append('close')
+
+    store = load_price_store(fields, dates[0], dates[-1])
+    if not all(f in store for f in fields) or \
+            not np.array_equal(store['dates'], np.array(dates, dtype='datetime64[us]').astype('datetime64[D]')):
+        return None
+
+    stock_numbers = store['stocks']
+    if stocks is not None:
+        store_index = {s: i for i, s in enumerate(stock_numbers)}
+        stock_numbers = sorted(s for s in set(stocks) if s in store_index)
+        rows = [store_index[s] for s in stock_numbers]
+        for f in fields:
+            store[f] = store[f][rows]
+
+    panel = {
+        'stocks': list(stock_numbers),
+        'index': {s: i for i, s in enumerate(stock_numbers)},
+        'dates': store['dates'].astype('datetime64[ns]'),
+    }
+    for f in fields:
+        panel[f] = store[f]
+    panel['missing'] = np.isnan(panel['close'])
+    panel['suspended'] = ~panel['missing'] & ~(panel['close'] > 0)
+    return panel
+
+
+def load_market_panel(end_date, count, stocks=None, fields=None):
+    """
+    取截止end_date的最近count个交易日的panel，优先从本地价格库读取，价格库没有覆盖时查询数据库
+    """
+    dates = trading_dates(end_date, count)
+    if not dates:
+        return None
+    panel = load_store_panel(dates, stocks, fields)
+    if panel is None:
+        panel = load_panel(dates[0], dates[-1], stocks, fields)
+    return panel
+
+
+def panel_supports(panel, columns):
+    """
+    columns中的字段是否都可以由panel提供
+    """
+    provided = {'date', 'increase_rate_value'} | {panel_fields[f] for f in panel_fields if f in panel}
+    if 'increase_rate_value' in columns and 'pre_close' not in panel:
+        return False
+    return all(k in provided for k in columns if k != 'increase_rate')
+
+
+def panel_frame(panel, stock_number, end_date, count, columns, skip_suspended=True):
+    """
+    从panel中切出一只股票截止end_date的最近count条日线，结构和get_daily_frame的返回值相同
+    """
+    i = panel['index'].get(stock_number)
+    if i is None:
+        return DataFrame(columns=list(columns.values()))
+
+    end = np.searchsorted(panel['dates'], np.datetime64(pd.to_datetime(end_date)), side='right')
+    valid = ~panel['missing'][i, :end]
+    if skip_suspended:
+        valid &= ~panel['suspended'][i, :end]
+    cols = np.flatnonzero(valid)[-count:]
+
+    sdt_fields = {v: k for k, v in panel_fields.items()}
+    data = {}
+    for k, v in columns.items():
+        if k == 'date':
+            data[v] = panel['dates'][cols]
+        elif k == 'increase_rate_value':
+            pre_close = panel['pre_close'][i, cols]
+            data[v] = np.round((panel['close'][i, cols] - pre_close) / pre_close * 100, 2)
+        elif k in sdt_fields:
+            data[v] = panel[sdt_fields[k]][i, cols]
+        else:
+            data[v] = None
+    return DataFrame(data, columns=list(columns.values()))
+
+
+def load_stored_checks(qr_date):
+    """
+    从indicator_state一次读出pre_sdt_check需要的全市场年线和周线均线，只包含最后一根K线在qr_date的股票，
+    其余的股票仍由pre_sdt_check自己计算
+    """
+    year_ma = load_indicator_series('day', 'ma', (year_num,), qr_date)
+    week_short = load_indicator_series('week', 'ma', (5,), qr_date)
+    week_long = load_indicator_series('week', 'ma', (10,), qr_date)
+    return {
+        'stored_year_ma': {k: round(v, 4) for k, v in year_ma.items()},
+        'stored_week_long': {k: week_short[k] > v for k, v in week_long.items() if k in week_short},
+    }
+
+
 def pre_sdt_check(stock_number, **kwargs):
     """
-    依据量价进行预先筛选
+    依据量价进行预先筛选，kwargs中有load_stored_checks的结果时直接使用保存的年线和周线均线
     :param stock_number:
     :param qr_date:
     :return:
     """
     qr_date = kwargs.get('qr_date')
+    stored_year_ma = kwargs.get('stored_year_ma') or {}
+    stored_week_long = kwargs.get('stored_week_long') or {}
     if kwargs.get('week_long', False):
         short_ma = 5
         long_ma = 10
-        if not is_week_long(stock_number, qr_date, short_ma, long_ma):
+        if stock_number in stored_week_long:
+            if not stored_week_long[stock_number]:
+                return False
+        elif not is_week_long(stock_number, qr_date, short_ma, long_ma):
             return False
 
     rate_value = 0
-    cursor = SDT.objects(Q(stock_number=stock_number) & Q(today_closing_price__ne=0.0) & Q(date__lte=qr_date))\
-        .order_by('-date')
-    if not cursor:
+    panel = kwargs.get('panel')
+    columns = {'date': 'date', 'today_closing_price': 'close_price', 'turnover_amount': 'turnover_amount'}
+    if panel is None and stock_number not in stored_year_ma:
+        columns['year_ma'] = 'year_ma'
+    df = get_daily_frame(stock_number, qr_date, year_num + 5, columns, panel=panel)
+    if df.empty:
         return False
 
-    today_sdt = cursor[0]
-    today_closing_price = today_sdt.today_closing_price
+    today_sdt = df.iloc[-1]
+    today_closing_price = today_sdt['close_price']
 
-    if today_sdt.year_ma:
-        year_ma = today_sdt.year_ma
+    if stock_number in stored_year_ma:
+        year_ma = stored_year_ma[stock_number]
+    elif panel is None:
+        year_ma = frame_year_ma(stock_number, df)
+    elif len(df) >= year_num:
+        year_ma = cal_year_ma(df)
     else:
-        year_ma = cal_year_ma(cursor)
-        try:
-            today_sdt.year_ma = year_ma
-            today_sdt.save()
-        except Exception:
-            pass
+        # panel只多取了几个交易日，停牌较多的股票在panel中凑不够年线需要的K线，改从数据库往前读取
+        year_columns = {'date': 'date', 'today_closing_price': 'close_price', 'year_ma': 'year_ma'}
+        year_ma = frame_year_ma(stock_number, get_daily_frame(stock_number, qr_date, year_num + 5, year_columns))
 
     if today_closing_price >= year_ma:
         rate_value += 1
@@ -112,10 +357,9 @@ def pre_sdt_check(stock_number, **kwargs):
     max_trade_amount = 2000
     avg_trade_amount = 1000
     amount_avg_num = 5
-    amount_sdt = cursor[:amount_avg_num]
 
-    if cal_turnover_ma(cursor, amount_avg_num) >= avg_trade_amount or\
-       max([i.turnover_amount for i in amount_sdt]) >= max_trade_amount:
+    if cal_turnover_ma(df, amount_avg_num) >= avg_trade_amount or\
+       df['turnover_amount'].iloc[-amount_avg_num:].max() >= max_trade_amount:
         rate_value += 1
 
     if rate_value:
@@ -124,20 +368,41 @@ def pre_sdt_check(stock_number, **kwargs):
         return False
 
 
+def frame_year_ma(stock_number, df):
+    """
+    从数据库读出的日线中取年线，最后一天已经保存了year_ma时直接使用，否则计算后写回
+    :param df: 包含date, close_price, year_ma列的日线
+    """
+    if df.empty:
+        return np.nan
+
+    today_sdt = df.iloc[-1]
+    if today_sdt['year_ma'] and not pd.isnull(today_sdt['year_ma']):
+        return today_sdt['year_ma']
+
+    year_ma = cal_year_ma(df)
+    try:
+        SDT._get_collection().update_one(
+            {'stock_number': stock_number, 'date': today_sdt['date'].to_pydatetime()},
+            {'$set': {'year_ma': year_ma}}
+        )
+    except Exception:
+        pass
+    return year_ma
+
+
 def is_week_long(stock_number, qr_date, short_ma, long_ma):
     if short_ma < long_ma:
         quant_count = long_ma + 5
     else:
         quant_count = short_ma + 5
 
-    swt = SWT.objects(Q(stock_number=stock_number) &
-                      Q(last_trade_date__lte=qr_date)).order_by('-last_trade_date')[:quant_count]
-    if not swt:
+    use_ad_price = True
+    df = get_weekly_frame(stock_number, qr_date, quant_count, use_ad_price)
+    if df.empty:
         return False
 
-    use_ad_price = True
-    trading_data = format_trading_data(swt, use_ad_price)
-    df = calculate_ma(DataFrame(trading_data), short_ma, long_ma)
+    df = calculate_ma(df, short_ma, long_ma)
     this_week = df.iloc[-1]
     if this_week['diff_ma'] > 0:
         return True
@@ -145,36 +410,175 @@ def is_week_long(stock_number, qr_date, short_ma, long_ma):
         return False
 
 
-def cal_year_ma(cursor):
-    sdt = cursor[:year_num + 5]
-    trading_data = format_trading_data(sdt)
-    if not trading_data:
+def cal_year_ma(df):
+    if df.empty:
         return False
-    df = DataFrame(trading_data)
-    df['year_ma'] = df['close_price'].rolling(window=year_num, center=False).mean()
-    today_ma = df.iloc[-1]
-    return round(today_ma['year_ma'], 4)
+    year_ma = df['close_price'].rolling(window=year_num, center=False).mean()
+    return round(year_ma.iloc[-1], 4)
+
+
+def percent_value(doc, field):
+    """
+    读取百分比字段的数值，优先使用数值字段如increase_rate_value，还没有迁移的老数据再解析字符串
+    :param doc: Document，或者query_trading_frame返回的一行
+    """
+    if isinstance(doc, (dict, pd.Series)):
+        value, raw = doc.get(field + '_value'), doc.get(field)
+    else:
+        value, raw = getattr(doc, field + '_value', None), getattr(doc, field, None)
+    if value is not None and not pd.isnull(value):
+        return value
+    return float(raw.replace('%', '').strip()) if isinstance(raw, str) else None
+
+
+def cal_turnover_ma(df, count):
+    return df['turnover_amount'].iloc[-count:].mean()
+
+
+class QuantResultWriter(object):
+    """
+    缓存策略选出的结果，攒够flush_size条后按(strategy_name, date, stock_number)唯一索引无序批量写入，
+    已经存在的结果保持不变，重复运行或多个进程同时写同一个结果时只保留最早的一条
+    """
+    result_keys = ['strategy_name', 'date', 'stock_number']
+
+    def __init__(self, flush_size=500):
+        self.flush_size = flush_size
+        self.buffer = []
+
+    def add(self, qr):
+        self.buffer.append(qr)
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
 
+    def flush(self):
+        if not self.buffer:
+            return 0, 0
 
-def cal_turnover_ma(cursor, count):
-    amount_sdt = cursor[:count]
-    amount_li = [i.turnover_amount for i in amount_sdt]
-    amount_avg = sum(amount_li) / len(amount_li)
-    return amount_avg
+        records = []
+        for qr in self.buffer:
+            record = qr.to_mongo().to_dict()
+            record.pop('_id', None)
+            records.append(record)
+        self.buffer = []
+        return bulk_upsert(QR, records, self.result_keys, insert_only=True)
 
+    def __enter__(self):
+        return self
 
-def check_duplicate_strategy(qr):
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+
+quant_writer = QuantResultWriter()
+atexit.register(quant_writer.flush)
+
+
+def save_quant_result(qr):
+    """
+    策略选出的结果先放入quant_writer，由dispatch_quant_jobs在结束时统一写入，
+    不经过dispatch_quant_jobs调用时剩下的结果在进程退出时写入
+    """
     if isinstance(qr, QR):
-        try:
-            cursor = QR.objects(Q(stock_number=qr.stock_number) & Q(strategy_name=qr.strategy_name) &
-                                Q(date=qr.date))
-        except Exception as e:
-            logging.error('Error when check dupliate %s strategy %s date %s: %s' % (qr.stock_number, qr.strategy_name,
-                                                                                    qr.date, e))
-        if cursor:
-            return True
-        else:
-            return False
+        quant_writer.add(qr)
+
+
+worker_jobs = []  # 子进程中运行的策略任务，由init_quant_worker设置
+quant_index_ready = False  # 当前进程是否已经建立过QuantResult的唯一索引
+
+
+def ensure_quant_result_index():
+    """
+    QuantResult关闭了auto_create_index，写入结果前建立一次(strategy_name, date, stock_number)唯一索引，
+    已有重复数据导致建索引失败时先去重再重试
+    """
+    global quant_index_ready
+    if quant_index_ready:
+        return
+
+    try:
+        QR.ensure_indexes()
+    except OperationFailure as e:
+        logging.warning('Ensure quant result index failed, remove duplicate results first: %s' % e)
+        remove_duplicate_quant_result()
+        QR.ensure_indexes()
+    quant_index_ready = True
+
+
+def run_quant_jobs(stocks, jobs):
+    """
+    对stocks中的每只股票依次运行jobs中的策略
+    :param stocks: (stock_number, stock_name, industry_involved)的列表
+    :param jobs: (quant_stock, kwargs)的列表，quant_stock返回一个QuantResult，或者QuantResult的列表
+    :return: 策略选出的QuantResult列表
+    """
+    quant_res = []
+    for stock_number, stock_name, industry_involved in stocks:
+        for quant_stock, job in jobs:
+            qr = ''
+            job['industry_involved'] = industry_involved
+            try:
+                qr = quant_stock(stock_number, stock_name, **job)
+            except Exception as e:
+                logging.error('Error when quant %s %s: %s' % (stock_number, quant_stock.__module__, e))
+            if isinstance(qr, QR):
+                quant_res.append(qr)
+            elif isinstance(qr, list):
+                quant_res.extend(qr)
+    return quant_res
+
+
+def init_quant_worker(jobs, panel_descriptor=None):
+    """
+    子进程启动时丢弃从父进程fork来的数据库连接，建立自己的连接；
+    有panel_descriptor时attach共享内存中的panel，交给原来使用panel的策略
+    """
+    global worker_jobs
+    disconnect()
+    connect(mongodb_config['db'])
+    if panel_descriptor:
+        panel = attach_panel(panel_descriptor)
+        for _, job in jobs:
+            if 'panel' in job:
+                job['panel'] = panel
+    worker_jobs = jobs
+
+
+def quant_shard(stocks):
+    """
+    在子进程中运行一个分片，结果由子进程的quant_writer写入，同时返回给父进程合并
+    """
+    with quant_writer:
+        return run_quant_jobs(stocks, worker_jobs)
+
+
+def dispatch_quant_jobs(stocks, jobs, workers=1):
+    """
+    把股票池分片交给workers个进程运行jobs，workers为1时在当前进程中运行。
+    子进程用fork启动，策略函数等参数直接继承，不需要序列化；panel原地移到共享内存中，父进程和所有子进程读取同一份，
+    运行结束后panel中的数组随共享内存一起释放；分片的结果按股票池的顺序合并
+    """
+    ensure_quant_result_index()
+    stocks = [(i.stock_number, i.stock_name, i.industry_involved) for i in stocks]
+    if workers <= 1 or len(stocks) < 2:
+        with quant_writer:
+            return run_quant_jobs(stocks, jobs)
+
+    size = max(1, math.ceil(len(stocks) / (workers * quant_shards_per_worker)))
+    shards = [stocks[i:i + size] for i in range(0, len(stocks), size)]
+    panel = next((job['panel'] for _, job in jobs if job.get('panel') is not None), None)
+    blocks, descriptor = publish_panel(panel) if panel is not None else ({}, None)
+    jobs = [(quant_stock, dict(job, panel=None) if 'panel' in job else job) for quant_stock, job in jobs]
+
+    quant_res = []
+    try:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=init_quant_worker, initargs=(jobs, descriptor)) as executor:
+            for res in executor.map(quant_shard, shards):
+                quant_res.extend(res)
+    finally:
+        release_panel(blocks, panel)
+    return quant_res
 
 
 def start_quant_analysis(**kwargs):
@@ -182,6 +586,8 @@ def start_quant_analysis(**kwargs):
 
     :param kwargs:{
         qr_date: 运行策略时间
+        panel_days: 传入时先用load_market_panel一次取出最近panel_days个交易日的全市场日线，策略从panel中读取数据
+        workers: 运行策略的进程数，默认为config中的quant_workers
     }
     :return:
     """
@@ -197,116 +603,86 @@ def start_quant_analysis(**kwargs):
         print('Not a Trading Date')
         return
 
-    try:
-        all_stocks = StockInfo.objects()
-    except Exception as e:
-        logging.error('Error when query StockInfo:' + str(e))
-        raise e
-
-    stocks_count = all_stocks.count()
-    skip = 0
-    quant_res = []
-
-    while skip < stocks_count:
-        try:
-            stocks = StockInfo.objects().skip(skip).limit(query_step)
-        except Exception as e:
-            logging.error('Error when query skip %s  StockInfo:%s' % (skip, e))
-            stocks = []
+    # 过滤瑞华的客户，非实时计算时过滤当天停牌的股票
+    trade_date = None if kwargs.get('real_time') else kwargs['qr_date']
+    stocks = iter_stock_info('stock_number', 'stock_name', 'industry_involved',
+                             exclude_firms=excluded_account_firms, trade_date=trade_date)
+    if kwargs.get('panel_days') and kwargs.get('panel') is None:
+        kwargs['panel'] = load_market_panel(kwargs['qr_date'], kwargs['panel_days'])
+    if kwargs.get('real_time') and 'today_closed' not in kwargs:
+        kwargs['today_closed'] = is_today_closed(kwargs)
+    if not kwargs.get('real_time'):
+        kwargs.update(load_stored_checks(kwargs['qr_date']))
 
-        for i in stocks:
-            if i.account_firm and u'瑞华会计师' in i.account_firm:
-                # 过滤瑞华的客户
-                continue
-
-            if not kwargs.get('real_time') and\
-               not SDT.objects(Q(date=kwargs['qr_date']) & Q(stock_number=i.stock_number)):
-                continue
-
-            qr = ''
-            kwargs['industry_involved'] = i.industry_involved
-            try:
-                qr = kwargs['quant_stock'](i.stock_number, i.stock_name, **kwargs)
-            except Exception as e:
-                logging.error('Error when quant %s ma strategy: %s' % (i.stock_number, e))
-            if isinstance(qr, QR):
-                quant_res.append(qr)
-        skip += query_step
-    return quant_res
+    return dispatch_quant_jobs(stocks, [(kwargs['quant_stock'], kwargs)], kwargs.get('workers', quant_workers))
 
 
-def request_and_handle_data(url):
-    headers = {
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Encoding': 'gzip, deflate, sdch',
-        'Accept-Language': 'zh-CN,zh;q=0.8,en;q=0.6,zh-TW;q=0.4',
-        'Cache-Control': 'no-cache',
-        'Connection': 'keep-alive',
-        # 'Host': 'hqdigi2.eastmoney.com',
-        'Pragma': 'no-cache',
-        'Upgrade-Insecure-Requests': '1',
-        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/46.0.2490.86 Safari/537.36'
+def start_batch_analysis(jobs, **kwargs):
+    """
+    对全市场只遍历一次，每只股票依次运行所有策略，日线数据由同一个panel提供，结果由quant_writer统一写入
+    :param jobs: (strategy_module, params)的列表，strategy_module需要提供quant_stock，
+                 可选的prepare_kwargs(**kwargs)返回运行前一次性准备的参数
+    :param kwargs:{
+        qr_date: 运行策略时间
+        panel_days: panel包含的交易日数
+        workers: 运行策略的进程数，默认为config中的quant_workers
     }
+    :return: 各策略选出的QuantResult列表
+    """
+    if not kwargs.get('qr_date'):
+        print('no qr_date')
+        return
+    if not SDT.objects(date=kwargs['qr_date']):
+        print('Not a Trading Date')
+        return
 
-    try:
-        r = requests.get(url, headers=headers, timeout=timeout)
-        r.encoding = 'utf-8'
-    except Exception as e:
-        logging.error('Request url %s failed: %s' % (url, e))
-        raise e
+    if kwargs.get('panel_days') and kwargs.get('panel') is None:
+        kwargs['panel'] = load_market_panel(kwargs['qr_date'], kwargs['panel_days'])
+    kwargs.update(load_stored_checks(kwargs['qr_date']))
 
-    try:
-        data = json.loads(r.text.replace('var js=', '').replace('rank', '\"rank\"').replace('pages', '\"pages\"'))
-    except Exception as e:
-        logging.error('Handle data failed:' + str(e))
-        raise e
+    job_kwargs = []
+    for module, params in jobs:
+        job = dict(kwargs, **params)
+        if hasattr(module, 'prepare_kwargs'):
+            job.update(module.prepare_kwargs(**job))
+        job_kwargs.append((module.quant_stock, job))
 
-    return data
+    stocks = iter_stock_info('stock_number', 'stock_name', 'industry_involved',
+                             exclude_firms=excluded_account_firms, trade_date=kwargs['qr_date'])
+    return dispatch_quant_jobs(stocks, job_kwargs, kwargs.get('workers', quant_workers))
 
 
-def collect_stock_daily_trading():
+def collect_realtime_quote():
     """
-    获取并保存每日股票交易数据
+    获取全市场的实时行情，返回parse_rank_frame解析后的DataFrame，已去掉停牌的股票
     """
     url = eastmoney_stock_api
     data = {}
-    global retry
-    while retry > 0:
+    # 每次调用单独计数，实时选股的循环会反复调用
+    for _ in range(retry):
         try:
             data = request_and_handle_data(url)
-            retry = 0
+            break
         except Exception:
-            retry -= 1
-
-    stock_data = data.get('rank', [])
-    today_trading = {}
-    for i in stock_data:
-        stock = i.split(',')
-        if stock[4] == '-':
-            continue
-        stock_number = stock[1]
-        stock_name = stock[2]
-        sdt = SDT(stock_number=stock_number, stock_name=stock_name)
-        sdt.yesterday_closed_price = float(stock[3])
-        sdt.today_opening_price = float(stock[4])
-        sdt.today_closing_price = float(stock[5])
-        sdt.today_highest_price = float(stock[6])
-        sdt.today_lowest_price = float(stock[7])
-        sdt.turnover_amount = int(stock[8])
-        sdt.turnover_volume = int(stock[9])
-        sdt.increase_amount = float(stock[10])
-        sdt.increase_rate = stock[11]
-        sdt.today_average_price = float(stock[12])
-        quantity_relative_ratio = stock[22]
-        sdt.quantity_relative_ratio = 0 if quantity_relative_ratio == '-' else float(quantity_relative_ratio)
-        sdt.turnover_rate = stock[23]
-        sdt.date = datetime.datetime.combine(datetime.date.today(), datetime.time(0,0))
-
-        if sdt.turnover_amount == 0:
-            # 去掉停牌的交易数据
             continue
-        today_trading[stock_number] = sdt
-    return today_trading
+
+    df = parse_rank_frame(data.get('rank', []))
+    # 去掉停牌的交易数据
+    df = df[df['today_opening_price'].notnull() & (df['turnover_amount'].fillna(0) != 0)].copy()
+    df['quantity_relative_ratio'] = df['quantity_relative_ratio'].fillna(0)
+    df['date'] = datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0))
+    return df
+
+
+def collect_stock_daily_trading():
+    """
+    获取每日股票实时交易数据，返回stock_number到SDT的dict
+    """
+    df = collect_realtime_quote()
+    sdt_fields = [c for c in df.columns if c in SDT._fields]
+    int_fields = ['turnover_amount', 'turnover_volume']
+    df[int_fields] = df[int_fields].fillna(0).astype('int64')
+    return {r['stock_number']: SDT(**r) for r in df[sdt_fields].to_dict('records')}
 
 
 def display_quant(real_time_res):
@@ -333,9 +709,18 @@ def setup_realtime_swt(swt, stock_number, qr_date):
     return swt
 
 
+def is_today_closed(kwargs):
+    """
+    qr_date当天是否已经有收盘数据，start_quant_analysis实时计算时预先查询一次放入kwargs的today_closed，
+    每只股票不用再查询全市场的日线
+    """
+    if 'today_closed' in kwargs:
+        return kwargs['today_closed']
+    return bool(SDT.objects(date=kwargs['qr_date']).first())
+
+
 def setup_realtime_sdt(stock_number, sdt, kwargs):
-    today_sdt = SDT.objects(date=kwargs['qr_date'])
-    if kwargs['qr_date'] == datetime.date.today() and not today_sdt:
+    if kwargs['qr_date'] == datetime.date.today() and not is_today_closed(kwargs):
         today_trading = kwargs.get('today_trading', {})
         if not today_trading.get(stock_number):
             return list()
@@ -345,6 +730,20 @@ def setup_realtime_sdt(stock_number, sdt, kwargs):
     return sdt
 
 
+def setup_realtime_frame(stock_number, df, kwargs, columns=None):
+    """
+    和setup_realtime_sdt相同，当天还没有收盘数据时把实时行情追加到get_daily_frame返回的DataFrame末尾
+    """
+    if kwargs['qr_date'] == datetime.date.today() and not is_today_closed(kwargs):
+        today_trading = kwargs.get('today_trading', {}).get(stock_number)
+        if not today_trading:
+            return DataFrame()
+
+        row = {v: getattr(today_trading, k, None) for k, v in (columns or daily_columns).items()}
+        df = pd.concat([df, DataFrame([row])], ignore_index=True)
+    return df
+
+
 def is_ad_price(stock_number, qr_date, swt):
     use_ad_price = True
     if swt[0].last_trade_date < qr_date:
@@ -356,11 +755,73 @@ def is_ad_price(stock_number, qr_date, swt):
 
 
 def get_month_trading(stock_number, start_date=None, end_date=None):
-    return get_trading_from_tushare(stock_number, start_date=start_date, end_date=end_date, ktype="M")
+    return get_local_trading(SMT, 'monthly', stock_number, start_date=start_date, end_date=end_date)
 
 
 def get_week_trading(stock_number, start_date=None, end_date=None):
-    return get_trading_from_tushare(stock_number, start_date=start_date, end_date=end_date, ktype='W')
+    return get_local_trading(SWT, 'weekly', stock_number, start_date=start_date, end_date=end_date)
+
+
+def get_local_trading(document, prefix, stock_number, start_date=None, end_date=None):
+    """
+    从本地的周线或月线集合读取K线，返回和get_trading_from_tushare相同结构的DataFrame，以最后交易日为索引。
+    K线都有后复权价格时换算成前复权价格，即按最后一根K线的收盘价缩放，和原来ts.get_k_data的qfq数据一致；
+    有K线缺少后复权价格时用不复权的价格
+    :param document: StockWeeklyTrading或StockMonthlyTrading
+    :param prefix: 价格字段的前缀，weekly或monthly
+    :param start_date: 开始日期，datetime或'%Y-%m-%d'格式的字符串
+    :param end_date: 结束日期，datetime或'%Y-%m-%d'格式的字符串
+    """
+    prices = {
+        prefix + '_open_price': 'open',
+        prefix + '_close_price': 'close',
+        prefix + '_highest_price': 'high',
+        prefix + '_lowest_price': 'low',
+    }
+    ad_prices = {'ad_open_price': 'open', 'ad_close_price': 'close', 'ad_highest_price': 'high',
+                 'ad_lowest_price': 'low'}
+    columns = ['last_trade_date', 'turnover_volume'] + list(prices) + list(ad_prices)
+
+    query = {'stock_number': stock_number}
+    date_range = {}
+    if start_date:
+        date_range['$gte'] = pd.to_datetime(start_date).to_pydatetime()
+    if end_date:
+        date_range['$lte'] = pd.to_datetime(end_date).to_pydatetime()
+    if date_range:
+        query['last_trade_date'] = date_range
+
+    cursor = document._get_collection().find(query, {k: 1 for k in columns}).sort('last_trade_date', 1)
+    raw = DataFrame(list(cursor), columns=columns)
+    df = DataFrame({'date': raw['last_trade_date'], 'volume': raw['turnover_volume']})
+
+    if not raw.empty and raw[list(ad_prices)].notna().all().all():
+        scale = raw[prefix + '_close_price'].iloc[-1] / raw['ad_close_price'].iloc[-1]
+        for k, v in ad_prices.items():
+            df[v] = raw[k] * scale
+    else:
+        for k, v in prices.items():
+            df[v] = raw[k]
+
+    df = df.set_index(['date'])[['open', 'close', 'high', 'low', 'volume']]
+    df['close_price'] = df['close']
+    return df
+
+
+def get_margin_trading(stock_number, start_date=None, end_date=None):
+    """
+    读取一只股票的两融数据，走(stock_number, date)索引，返回以日期为索引的DataFrame
+    """
+    query = Q(stock_number=stock_number)
+    if start_date:
+        query &= Q(date__gte=start_date)
+    if end_date:
+        query &= Q(date__lte=end_date)
+
+    fields = ['date', 'rz_remaining_amount', 'rz_buy_amount', 'rz_repay_amount', 'rz_net_buy_amount',
+              'rq_remaining_volume', 'rq_sell_volume', 'rq_repay_volume']
+    cursor = StockMarginTrading.objects(query).only(*fields).order_by('date').as_pymongo()
+    return DataFrame(list(cursor), columns=fields).set_index(['date'])
 
 
 def get_trading_from_tushare(stock_number, start_date=None, end_date=None, ktype='D', autype='qfq'):
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+用本地的日线数据生成全市场的周线或月线数据，默认只重新计算当周或当月
+"""
+
+import logging
+import datetime
+import argparse
+
+from models import StockWeeklyTrading as SWT, StockMonthlyTrading as SMT
+from logger import setup_logging
+from collector.aggregate_util import period_start, load_daily_frame, load_last_ad_close, resample_daily
+from collector.collect_data_util import bulk_upsert, frame_to_records, bulk_step
+
+
+# 周期 -> (集合, pandas的周期频率, 价格字段的前缀)
+periods = {
+    'week': (SWT, 'W', 'weekly'),
+    'month': (SMT, 'M', 'monthly'),
+}
+price_fields = ['open_price', 'close_price', 'highest_price', 'lowest_price']
+
+
+def remove_replaced_weeks(start_date, end_date):
+    """
+    删除区间内没有week字段的旧周线（datayes采集的或按首个交易日写入的），
+    只删除同一只股票同一周已经有按week写入的新周线的，避免补采前几天的日线后留下重复的周线
+    """
+    collection = SWT._get_collection()
+    written = {(i['stock_number'], i['week']) for i in collection.find(
+        {'week': {'$gte': start_date, '$lte': end_date}}, {'_id': 0, 'stock_number': 1, 'week': 1})}
+    legacy = collection.find({'week': {'$exists': False}, 'first_trade_date': {'$gte': start_date, '$lte': end_date}},
+                             {'stock_number': 1, 'first_trade_date': 1})
+    replaced = [i['_id'] for i in legacy if (i['stock_number'], period_start(i['first_trade_date'], 'W')) in written]
+
+    for i in range(0, len(replaced), bulk_step):
+        collection.delete_many({'_id': {'$in': replaced[i:i + bulk_step]}})
+    return len(replaced)
+
+
+def aggregate_trading(period, start_date, end_date):
+    """
+    聚合start_date所在周期到end_date之间的K线，按(stock_number, 周期的第一天)批量upsert，
+    后复权价格接着上一根K线的ad_close_price用日线的昨收价推算
+    :param period: 'week'或'month'
+    """
+    document, freq, prefix = periods[period]
+    start_date = period_start(start_date, freq)
+    bars = resample_daily(load_daily_frame(start_date, end_date), freq, load_last_ad_close(document, start_date))
+    if bars.empty:
+        return 0, 0
+
+    bars = bars.rename(columns={k: prefix + '_' + k for k in price_fields})
+    bars[period] = bars['period'].dt.start_time
+    if period == 'week':
+        bars['end_date'] = bars['last_trade_date']
+    bars['turnover_amount'] = (bars['turnover_amount'] / 10).round().astype('int64')  # tushare的成交额单位为千元
+    bars['increase_rate_value'] = bars['increase_rate']
+    bars['range_percent_value'] = bars['range_percent']
+    bars['increase_rate'] = bars['increase_rate'].astype(str) + '%'
+    bars['range_percent'] = bars['range_percent'].astype(str) + '%'
+    bars = bars.drop(columns=['period'])
+    res = bulk_upsert(document, frame_to_records(bars), ['stock_number', period])
+
+    if period == 'week':
+        removed = remove_replaced_weeks(start_date, end_date)
+        if removed:
+            logging.info('Remove %s replaced weekly trading' % removed)
+    return res
+
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(description=u'用日线数据生成周线或月线数据')
+    parser.add_argument(u'-p', action=u'store', dest='period', choices=list(periods), required=True,
+                        help=u'K线周期，week或month')
+    parser.add_argument(u'-s', action=u'store', dest='start_date', required=False, help=u'起始时间')
+    parser.add_argument(u'-e', action=u'store', dest='end_date', required=False, help=u'结束时间')
+
+    args = parser.parse_args()
+    if args.start_date and args.end_date:
+        try:
+            start_date = datetime.datetime.strptime(args.start_date, '%Y-%m-%d')
+            end_date = datetime.datetime.strptime(args.end_date, '%Y-%m-%d')
+        except Exception as e:
+            print('Wrong date form')
+            raise e
+    else:
+        today = datetime.date.today()
+        end_date = datetime.datetime(year=today.year, month=today.month, day=today.day)
+        start_date = end_date
+
+    return args.period, start_date, end_date
+
+
+if __name__ == '__main__':
+    setup_logging(__file__, logging.WARNING)
+    period, start_date, end_date = setup_argparse()
+    upserted, modified = aggregate_trading(period, start_date, end_date)
+    logging.info('Aggregate %s trading: %s new, %s updated' % (period, upserted, modified))
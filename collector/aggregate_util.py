@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+用本地的日线数据聚合出周线、月线等周期K线
+"""
+
+import datetime
+
+import numpy as np
+from pandas import DataFrame, Series
+
+from models import StockInfo, StockDailyTrading as SDT
+
+
+ad_lookback_days = 366  # 向前查找上一根后复权K线的天数，停牌超过这个时间的股票后复权价从区间第一天重新开始
+daily_projection = ['stock_number', 'stock_name', 'date', 'yesterday_closed_price', 'today_opening_price',
+                    'today_closing_price', 'today_highest_price', 'today_lowest_price', 'turnover_amount',
+                    'turnover_volume']
+
+
+def period_start(date, freq):
+    """
+    date所在周期的第一天，freq为'W'或'M'
+    """
+    if freq == 'W':
+        date = date - datetime.timedelta(days=date.weekday())
+    elif freq == 'M':
+        date = date.replace(day=1)
+    return datetime.datetime(year=date.year, month=date.month, day=date.day)
+
+
+def load_daily_frame(start_date, end_date):
+    """
+    一次查询取出区间内全市场的日线数据，过滤停牌的数据
+    """
+    cursor = SDT._get_collection().find(
+        {'date': {'$gte': start_date, '$lte': end_date}, 'today_closing_price': {'$gt': 0}},
+        {k: 1 for k in daily_projection}
+    )
+    df = DataFrame(list(cursor), columns=daily_projection)
+    if df.empty:
+        return df
+
+    stock_names = {i.stock_number: i.stock_name for i in StockInfo.objects().only('stock_number', 'stock_name')}
+    df['stock_name'] = df['stock_name'].fillna(df['stock_number'].map(stock_names))
+    return df
+
+
+def load_last_ad_close(document, start_date):
+    """
+    每只股票start_date之前最后一根K线的后复权收盘价
+    :param document: 有last_trade_date和ad_close_price字段的周期K线，如StockWeeklyTrading
+    :return: stock_number为索引的Series
+    """
+    cursor = document._get_collection().aggregate([
+        {'$match': {
+            'last_trade_date': {'$lt': start_date, '$gte': start_date - datetime.timedelta(days=ad_lookback_days)},
+            'ad_close_price': {'$gt': 0},
+        }},
+        {'$sort': {'last_trade_date': 1}},
+        {'$group': {'_id': '$stock_number', 'ad_close_price': {'$last': '$ad_close_price'}}},
+    ])
+    return Series({i['_id']: i['ad_close_price'] for i in cursor}, dtype=float)
+
+
+def adjust_factor(df, last_ad_close):
+    """
+    用日线的昨收价推算每个交易日的后复权因子。除权除息日的昨收价是交易所调整过的，
+    当天的因子 = 前一个交易日的因子 × 前一个交易日的收盘价 / 当天的昨收价；
+    区间第一天用上一根K线的后复权收盘价接上，没有后复权价的股票从1开始
+    :param df: 按stock_number、date排好序的日线
+    :param last_ad_close: load_last_ad_close的结果
+    """
+    prev_close = df.groupby('stock_number', sort=False)['today_closing_price'].shift(1)
+    first_close = df['stock_number'].map(last_ad_close).fillna(df['yesterday_closed_price'])
+    ratio = prev_close.where(prev_close.notna(), first_close) / df['yesterday_closed_price']
+    ratio[~np.isfinite(ratio)] = 1.0
+    return ratio.groupby(df['stock_number'], sort=False).cumprod()
+
+
+def resample_daily(df, freq, last_ad_close=None):
+    """
+    把日线数据按freq向量化地聚合成周期K线
+    :param df: load_daily_frame返回的DataFrame
+    :param freq: pandas的周期频率，'W'为周线，'M'为月线
+    :param last_ad_close: load_last_ad_close的结果，传入时同时计算ad_开头的后复权价格
+    :return: 每只股票每个周期一行的DataFrame
+    """
+    if df.empty:
+        return df
+
+    df = df.sort_values(['stock_number', 'date'])
+    df['period'] = df['date'].dt.to_period(freq)
+    ad_columns = {}
+    if last_ad_close is not None:
+        factor = adjust_factor(df, last_ad_close)
+        for field, column, how in [('today_opening_price', 'ad_open_price', 'first'),
+                                   ('today_closing_price', 'ad_close_price', 'last'),
+                                   ('today_highest_price', 'ad_highest_price', 'max'),
+                                   ('today_lowest_price', 'ad_lowest_price', 'min')]:
+            df[column] = (df[field] * factor).round(4)
+            ad_columns[column] = (column, how)
+
+    bars = df.groupby(['stock_number', 'period'], sort=False).agg(
+        stock_name=('stock_name', 'last'),
+        first_trade_date=('date', 'first'),
+        last_trade_date=('date', 'last'),
+        trade_days=('date', 'count'),
+        pre_close_price=('yesterday_closed_price', 'first'),
+        open_price=('today_opening_price', 'first'),
+        close_price=('today_closing_price', 'last'),
+        highest_price=('today_highest_price', 'max'),
+        lowest_price=('today_lowest_price', 'min'),
+        turnover_amount=('turnover_amount', 'sum'),
+        turnover_volume=('turnover_volume', 'sum'),
+        **ad_columns
+    ).reset_index()
+
+    bars['increase_rate'] = ((bars['close_price'] - bars['pre_close_price']) / bars['pre_close_price'] * 100).round(2)
+    bars['range_percent'] = ((bars['highest_price'] - bars['lowest_price']) / bars['pre_close_price'] * 100).round(2)
+    return bars
@@ -6,41 +6,71 @@
 """
 
 
+import time
 import datetime
 import logging
 import argparse
 
-from mongoengine import Q
+import pandas as pd
 
 from models import StockDailyTrading as SDT
 from logger import setup_logging
 from collector.tushare_util import get_pro_client
+from collector.collect_data_util import bulk_upsert, frame_to_records
+from price_store import write_trading_date
+
+
+# tushare daily接口字段到StockDailyTrading字段的映射
+daily_fields = {
+    'pre_close': 'yesterday_closed_price',
+    'open': 'today_opening_price',
+    'close': 'today_closing_price',
+    'high': 'today_highest_price',
+    'low': 'today_lowest_price',
+    'amount': 'turnover_amount',
+    'vol': 'turnover_volume',
+    'change': 'increase_amount',
+}
+int_fields = ['turnover_amount', 'turnover_volume']
+
+
+def format_daily_records(trading_data, date=None):
+    """
+    把tushare daily接口返回的整个DataFrame一次性转换成SDT文档
+    :param trading_data: tushare daily接口返回的DataFrame
+    :param date: 交易日期，不传时使用数据中的trade_date
+    :return: 可直接写入数据库的dict列表
+    """
+    if trading_data is None or trading_data.empty:
+        return []
+
+    df = trading_data.rename(columns=daily_fields)
+    df['stock_number'] = df['ts_code'].str.split('.').str[0]
+    if date is None:
+        df['date'] = pd.to_datetime(df['trade_date'], format='%Y%m%d', errors='coerce')
+        df = df[df['date'].notnull()]
+    else:
+        df['date'] = date
+    df['increase_rate'] = df['pct_chg'].astype(str) + '%'
+    df['increase_rate_value'] = pd.to_numeric(df['pct_chg'], errors='coerce')
+    df[int_fields] = df[int_fields].fillna(0).astype('int64')
+
+    return frame_to_records(df[['stock_number', 'date', 'increase_rate', 'increase_rate_value'] + list(daily_fields.values())])
+
+
+def save_daily_records(records):
+    """
+    按(stock_number, date)批量upsert日线数据
+    """
+    return bulk_upsert(SDT, records, ['stock_number', 'date'],
+                       insert_defaults={'timestamp': int(time.time()), 'year_ma': 0})
 
 
 def collect_stock_daily_trading(date):
     trading_data = get_pro_client().daily(trade_date=date.strftime('%Y%m%d'))
-
-    for i in range(0, len(trading_data)):
-        stock = trading_data.iloc[i]
-        stock_number = stock.ts_code.split('.')[0]
-
-        existSdt = SDT.objects(Q(stock_number=stock_number) & Q(date=date))
-        if existSdt and len(existSdt) > 0:
-            sdt = existSdt[0]
-        else:
-            sdt = SDT(stock_number=stock_number)
-            sdt.date = date
-
-        sdt.yesterday_closed_price = stock.pre_close
-        sdt.today_opening_price = stock.open
-        sdt.today_closing_price = stock.close
-        sdt.today_highest_price = stock.high
-        sdt.today_lowest_price = stock.low
-        sdt.turnover_amount = stock.amount
-        sdt.turnover_volume = stock.vol
-        sdt.increase_amount = stock.change
-        sdt.increase_rate = str(stock.pct_chg) + '%'
-        sdt.save()
+    records = format_daily_records(trading_data, date)
+    upserted, modified = save_daily_records(records)
+    logging.info('Collect %s daily trading: %s new, %s updated' % (date.strftime('%Y%m%d'), upserted, modified))
 
 
 def setup_argparse():
@@ -66,6 +96,10 @@ def main():
     date = setup_argparse()
     logging.info('Start Collect %s Trading Data' % datetime.date.today())
     collect_stock_daily_trading(date)
+    try:
+        write_trading_date(date)
+    except Exception as e:
+        logging.error('Append %s to price store failed: %s' % (date, e))
     logging.info('Collect %s Trading Data Success' % datetime.date.today())
 
 
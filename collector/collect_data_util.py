@@ -3,46 +3,89 @@
 
 import logging
 import json
+import asyncio
 
-import requests
-from mongoengine import Q
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from pandas import DataFrame
+from mongoengine import Q, ValidationError
 
+from collector import http_util
+from collector import response_cache
 from models import StockDailyTrading as SDT
 from models import StockWeeklyTrading as SWT
 
 
 timeout = 30
-default_headers = {
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Encoding': 'gzip, deflate, sdch',
-        'Accept-Language': 'zh-CN,zh;q=0.8,en;q=0.6,zh-TW;q=0.4',
-        'Cache-Control': 'no-cache',
-        'Connection': 'keep-alive',
-        'Pragma': 'no-cache',
-        'Upgrade-Insecure-Requests': '1',
-        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
-                      'Chrome/46.0.2490.86 Safari/537.36'
-    }
-
-
-def send_request(url, headers={}):
-    if headers:
-        default_headers.update(headers)
+bulk_step = 1000  # 每次批量写入数据库的条数
 
+# 东财行情接口rank字段中各列的位置
+rank_columns = {
+    1: 'stock_number',
+    2: 'stock_name',
+    3: 'yesterday_closed_price',
+    4: 'today_opening_price',
+    5: 'today_closing_price',
+    6: 'today_highest_price',
+    7: 'today_lowest_price',
+    8: 'turnover_amount',
+    9: 'turnover_volume',
+    10: 'increase_amount',
+    11: 'increase_rate',
+    12: 'today_average_price',
+    22: 'quantity_relative_ratio',
+    23: 'turnover_rate',
+}
+rank_percent_columns = ['increase_rate', 'turnover_rate']
+
+
+def send_request(url, headers=None, timeout=timeout, endpoint=None):
+    """
+    :param endpoint: 开启缓存时用来查找缓存时间的接口名，见config.response_cache_ttl，
+                     不传时不走缓存，实时行情、融资融券和指数等页面每次都要请求最新数据
+    """
+    if response_cache.is_enabled() and endpoint:
+        return response_cache.cached(endpoint, ('GET', url, headers or {}),
+                                     lambda: fetch_response(url, headers, timeout))
+    return fetch_response(url, headers, timeout)[0]
+
+
+def fetch_response(url, headers=None, timeout=timeout):
+    """
+    :return: (html, 是否为2xx的响应)
+    """
     try:
-        r = requests.get(url, headers=default_headers, timeout=timeout)
-        r.encoding = 'utf-8'
+        r = http_util.get(url, headers=headers, timeout=timeout)
     except Exception as e:
         logging.error('Request url %s failed: %s' % (url, e))
         raise e
     r.encoding = 'utf-8'
     html = r.text
-    if not html:
+    ok = 200 <= r.status_code < 300
+    if not ok:
+        logging.warning('Status %s when request this url:%s' % (r.status_code, url))
+    elif not html:
         logging.warning('No data when request this url:' + url)
-    return html
+    return html, ok
+
 
+def fetch_url(url, headers=None, timeout=timeout):
+    return fetch_response(url, headers, timeout)[0]
 
-def request_and_handle_data(url, headers={}):
+
+async def async_send_request(url, semaphore, limiter, headers=None, timeout=timeout, endpoint=None):
+    """
+    在asyncio中发送请求，semaphore控制并发数，limiter控制对每个host的请求频率
+    """
+    async with semaphore:
+        await limiter.wait(url)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, send_request, url, headers, timeout, endpoint)
+
+
+def request_and_handle_data(url, headers=None):
     res = send_request(url, headers)
 
     try:
@@ -54,6 +97,26 @@ def request_and_handle_data(url, headers={}):
     return data
 
 
+def parse_rank_frame(rank):
+    """
+    把东财行情接口的rank数组一次性解析成DataFrame，'-'转成NaN，
+    百分比列保留原字符串，另外生成去掉%的数值列，如increase_rate_value
+    """
+    text_columns = ['stock_number', 'stock_name'] + rank_percent_columns
+    if not rank:
+        return DataFrame(columns=list(rank_columns.values()) + [c + '_value' for c in rank_percent_columns])
+
+    raw = pd.Series(rank).str.split(',', expand=True)
+    df = raw[list(rank_columns)].rename(columns=rank_columns).replace('-', np.nan)
+
+    for c in rank_columns.values():
+        if c not in text_columns:
+            df[c] = pd.to_numeric(df[c], errors='coerce')
+    for c in rank_percent_columns:
+        df[c + '_value'] = pd.to_numeric(df[c].str.rstrip('%'), errors='coerce')
+    return df
+
+
 def check_duplicate(trading_data):
     if isinstance(trading_data, SDT):
         cursor = SDT.objects(Q(stock_number=trading_data.stock_number) & Q(date=trading_data.date))
@@ -68,3 +131,64 @@ def check_duplicate(trading_data):
             return True
         else:
             return False
+
+
+def frame_to_records(df):
+    """
+    把DataFrame转换成可以直接写入mongodb的dict列表，NaN转成None，时间转成datetime
+    """
+    df = df.astype(object).where(df.notnull(), None)
+    records = df.to_dict('records')
+    for r in records:
+        for k, v in r.items():
+            if isinstance(v, pd.Timestamp):
+                r[k] = v.to_pydatetime()
+    return records
+
+
+def bulk_upsert(document, records, keys, insert_defaults=None, upsert=True, insert_only=False):
+    """
+    以keys作为唯一键，把records无序批量upsert到document对应的集合
+    :param document: mongoengine的Document类
+    :param records: 由字段名到值的dict组成的list
+    :param keys: 用来定位文档的字段
+    :param insert_defaults: 仅在新建文档时写入的默认值
+    :param upsert: 为False时只更新已存在的文档
+    :param insert_only: 为True时只插入不存在的文档，已存在的保持不变
+    :return: 新插入和被修改的文档数
+    """
+    collection = document._get_collection()
+    upserted = modified = 0
+
+    for i in range(0, len(records), bulk_step):
+        ops = []
+        for r in records[i:i + bulk_step]:
+            update = {'$setOnInsert': r} if insert_only else {'$set': r}
+            if insert_defaults and not insert_only:
+                defaults = {k: v for k, v in insert_defaults.items() if k not in r}
+                if defaults:
+                    update['$setOnInsert'] = defaults
+            ops.append(UpdateOne({k: r[k] for k in keys}, update, upsert=upsert))
+
+        try:
+            result = collection.bulk_write(ops, ordered=False)
+            upserted += result.upserted_count
+            modified += result.modified_count
+        except BulkWriteError as e:
+            logging.error('Bulk upsert %s failed: %s' % (collection.name, e.details.get('writeErrors', [])[:5]))
+    return upserted, modified
+
+
+def valid_documents(documents):
+    """
+    逐条校验mongoengine文档，跳过并记录不合法的，批量insert时一条坏数据不会让整批都写不进去
+    """
+    valid = []
+    for d in documents:
+        try:
+            d.validate()
+        except ValidationError as e:
+            logging.error('Skip invalid %s: %s' % (d.__class__.__name__, e))
+            continue
+        valid.append(d)
+    return valid
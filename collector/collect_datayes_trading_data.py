@@ -5,18 +5,17 @@ import datetime
 import logging
 import argparse
 
-import requests
 from mongoengine import Q
 
 from config import datayes_headers, datayes_day_trading
+from collector import http_util
 from models import StockDailyTrading as SDT
 from logger import setup_logging
 
 
 def send_requests(url):
-    headers = datayes_headers
     try:
-        req = requests.get(url, headers=headers, timeout=60)
+        req = http_util.get(url, headers=datayes_headers, timeout=60)
     except Exception as e:
         logging.error('Error when request %s:%s' % (url, e))
         raise e
@@ -49,8 +48,10 @@ def collect_datayes_data(date):
         turnover_amount = int(i['turnoverValue']/10000)
         turnover_volume = int(i['turnoverVol']/100)
         increase_amount = i['closePrice'] - i['actPreClosePrice']
-        increase_rate = str(round(increase_amount/i['actPreClosePrice'], 4) * 100) + '%'
-        turnover_rate = str(i['turnoverRate'] * 100) + '%'
+        increase_rate_value = round(increase_amount/i['actPreClosePrice'], 4) * 100
+        turnover_rate_value = i['turnoverRate'] * 100
+        increase_rate = str(increase_rate_value) + '%'
+        turnover_rate = str(turnover_rate_value) + '%'
         total_stock = int(i['marketValue'] / i['closePrice'])
         circulation_stock = int(i['negMarketValue'] / i['closePrice'])
         date = datetime.datetime.strptime(i['tradeDate'], '%Y-%m-%d')
@@ -60,7 +61,8 @@ def collect_datayes_data(date):
                   today_highest_price=today_highest_price, today_lowest_price=today_lowest_price,
                   turnover_amount=turnover_amount, turnover_volume=turnover_volume, increase_amount=increase_amount,
                   increase_rate=increase_rate, turnover_rate=turnover_rate, total_stock=total_stock,
-                  circulation_stock=circulation_stock, date=date)
+                  circulation_stock=circulation_stock, date=date, increase_rate_value=increase_rate_value,
+                  turnover_rate_value=turnover_rate_value)
 
         try:
             if not check_duplicate(sdt):
@@ -6,16 +6,21 @@ import datetime
 import time
 import random
 import argparse
+import os
+import json
+from os.path import dirname, exists
 
 from mongoengine import Q
 
+from config import his_trading_checkpoint_path as checkpoint_path
 from collector import tushare_util
+from collector.collect_daily_trading_data import format_daily_records, save_daily_records
 from logger import setup_logging
-from models import StockInfo, StockDailyTrading as SDT
+from models import StockDailyTrading as SDT
+from universe import iter_stock_info
 
 
 timeout = 30
-query_step = 100
 
 
 def collect_his_trading(stock_number, stock_name, start_date, end_date):
@@ -47,6 +52,7 @@ def collect_his_trading(stock_number, stock_name, start_date, end_date):
         sdt.turnover_volume = trade_data.vol
         sdt.increase_amount = trade_data.change
         sdt.increase_rate = str(trade_data.pct_chg) + '%'
+        sdt.increase_rate_value = float(trade_data.pct_chg)
         try:
             sdt.save()
         except Exception as e:
@@ -55,31 +61,83 @@ def collect_his_trading(stock_number, stock_name, start_date, end_date):
 
 
 def begin_collect_his(start_date, end_date):
-    stock_info = StockInfo.objects()
-    stock_count = stock_info.count()
-    skip = 0
+    for i in iter_stock_info('stock_number', 'stock_name'):
+        try:
+            collect_his_trading(i.stock_number, i.stock_name, start_date, end_date)
+        except Exception as e:
+            logging.error('Collect %s his data failed:%s' % (i.stock_number, e))
+        finally:
+            time.sleep(random.random())
+
+
+def get_trade_dates(start_date, end_date):
+    """
+    从tushare获取区间内的交易日，升序排列
+    """
+    trade_cal = tushare_util.get_pro_client().trade_cal(exchange='SSE', start_date=start_date.strftime('%Y%m%d'),
+                                                        end_date=end_date.strftime('%Y%m%d'), is_open='1')
+    trade_dates = [datetime.datetime.strptime(d, '%Y%m%d') for d in trade_cal['cal_date']]
+    return sorted(trade_dates)
+
+
+def load_checkpoint(start_date, end_date):
+    """
+    读取同一采集区间上次完成的交易日，没有则返回None
+    """
+    if not exists(checkpoint_path):
+        return None
+
+    try:
+        with open(checkpoint_path) as fd:
+            checkpoint = json.load(fd)
+    except Exception as e:
+        logging.error('Load checkpoint %s failed: %s' % (checkpoint_path, e))
+        return None
+
+    if checkpoint.get('start_date') != start_date.strftime('%Y%m%d') or\
+       checkpoint.get('end_date') != end_date.strftime('%Y%m%d'):
+        return None
+    return datetime.datetime.strptime(checkpoint['last_date'], '%Y%m%d')
+
+
+def save_checkpoint(start_date, end_date, last_date):
+    os.makedirs(dirname(checkpoint_path), exist_ok=True)
+    with open(checkpoint_path, 'w') as fd:
+        json.dump({'start_date': start_date.strftime('%Y%m%d'), 'end_date': end_date.strftime('%Y%m%d'),
+                   'last_date': last_date.strftime('%Y%m%d')}, fd)
+
+
+def begin_collect_his_by_date(start_date, end_date):
+    """
+    按交易日回填整个市场的日线数据，每个交易日只调用一次daily接口，中断后从上次完成的交易日继续
+    """
+    stock_names = {i.stock_number: i.stock_name for i in iter_stock_info('stock_number', 'stock_name')}
+    last_date = load_checkpoint(start_date, end_date)
+    pro_client = tushare_util.get_pro_client()
+
+    for trade_date in get_trade_dates(start_date, end_date):
+        if last_date and trade_date <= last_date:
+            continue
 
-    while skip < stock_count:
         try:
-            stocks = StockInfo.objects().skip(skip).limit(query_step)
+            trading_data = pro_client.daily(trade_date=trade_date.strftime('%Y%m%d'))
+            records = format_daily_records(trading_data, trade_date)
+            for r in records:
+                if stock_names.get(r['stock_number']):
+                    r['stock_name'] = stock_names[r['stock_number']]
+            save_daily_records(records)
         except Exception as e:
-            logging.error('Error when query skip %s  StockInfo:%s' % (skip, e))
-            stocks = []
+            logging.error('Collect %s market trading data failed:%s' % (trade_date.strftime('%Y%m%d'), e))
+            raise e
 
-        for i in stocks:
-            try:
-                collect_his_trading(i.stock_number, i.stock_name, start_date, end_date)
-            except Exception as e:
-                logging.error('Collect %s his data failed:%s' % (i.stock_number, e))
-            finally:
-                time.sleep(random.random())
-        skip += query_step
+        save_checkpoint(start_date, end_date, trade_date)
 
 
 def setup_argparse():
     parser = argparse.ArgumentParser(description=u'用tushare pro api采集日线行情数据')
     parser.add_argument(u'-s', action=u'store', dest='start_date', required=True, help=u'开始采集日期')
     parser.add_argument(u'-e', action=u'store', dest='end_date', required=True, help=u'结束采集日期')
+    parser.add_argument(u'-d', action=u'store_true', dest='by_date', required=False, help=u'按交易日采集整个市场')
 
     args = parser.parse_args()
     try:
@@ -89,12 +147,15 @@ def setup_argparse():
         print('Wrong date form')
         raise e
 
-    return start_date, end_date
+    return start_date, end_date, args.by_date
 
 
 if __name__ == '__main__':
-    start_date, end_date = setup_argparse()
+    start_date, end_date, by_date = setup_argparse()
     setup_logging(__file__, logging.WARNING)
     logging.info('Start collect history trading data')
-    begin_collect_his(start_date, end_date)
+    if by_date:
+        begin_collect_his_by_date(start_date, end_date)
+    else:
+        begin_collect_his(start_date, end_date)
     logging.info('Collect history trading data success')
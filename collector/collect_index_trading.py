@@ -9,10 +9,10 @@ import json
 import logging
 import datetime
 
-import requests
 from mongoengine import Q
 
 from config import market_index
+from collector.collect_data_util import send_request
 from logger import setup_logging
 from models import IndexDailyTrading as IDT
 from models import StockDailyTrading as SDT
@@ -22,27 +22,10 @@ timeout = 60
 
 
 def request_data(url):
-    headers = {
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Encoding': 'gzip, deflate, sdch',
-        'Accept-Language': 'zh-CN,zh;q=0.8,en;q=0.6,zh-TW;q=0.4',
-        'Cache-Control': 'no-cache',
-        'Connection': 'keep-alive',
-        'Host': 'hqdigi2.eastmoney.com',
-        'Pragma': 'no-cache',
-        'Upgrade-Insecure-Requests': '1',
-        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/46.0.2490.86 Safari/537.36'
-    }
+    res = send_request(url, {'Host': 'hqdigi2.eastmoney.com'}, timeout=timeout)
 
     try:
-        r = requests.get(url, headers=headers, timeout=timeout)
-        r.encoding = 'utf-8'
-    except Exception as e:
-        logging.error('Request url %s failed: %s' % (url, e))
-        raise e
-
-    try:
-        data = json.loads(r.text.replace('var js=', '').replace('quotation','\"quotation\"'))
+        data = json.loads(res.replace('var js=', '').replace('quotation','\"quotation\"'))
     except Exception as e:
         logging.error('Error when loads market index data:' + str(e))
         raise e
@@ -6,52 +6,25 @@
 """
 
 import logging
-import datetime
 
 from config import eastmoney_stock_api
-from models import StockInfo
 from logger import setup_logging
-from collector.collect_data_util import request_and_handle_data
+from collector.collect_data_util import request_and_handle_data, parse_rank_frame
+from collector.stock_info_sync import sync_stock_info
 
 
 def collect_stock_info():
     """
-    存储股票最基本的信息
+    存储股票最基本的信息，只写入新股票和改了名字的股票
     """
     url = eastmoney_stock_api
     data = request_and_handle_data(url)
 
-    stock_data = data['rank']
-    for i in stock_data:
-        stock = i.split(',')
-        stock_number = stock[1]
-        stock_name = stock[2]
-        stock_info = StockInfo(stock_number=stock_number, stock_name=stock_name, update_time=datetime.datetime.now())
-
-        if not check_duplicate(stock_info):
-            try:
-                stock_info.save()
-            except Exception as e:
-                logging.error('Saving %s data failed: %s' % (stock_info.stock_number, e))
-
-
-def check_duplicate(stock_info):
-    """
-    检查存储的数据是否重复
-    """
+    stock_data = parse_rank_frame(data['rank']).drop_duplicates('stock_number')
     try:
-        cursor = StockInfo.objects(stock_number=stock_info.stock_number)
-        if cursor:
-            data = cursor.next()
-            if data.stock_name != stock_info.stock_name:
-                data.stock_name = stock_info.stock_name
-                data.save()
-            return True
+        sync_stock_info(stock_data, ['stock_name'])
     except Exception as e:
-        logging.error('Query %s data failed: %s' % (stock_info.stock_number, e))
-        raise e
-
-    return False
+        logging.error('Sync stock basic info failed: %s' % e)
 
 
 if __name__ == '__main__':
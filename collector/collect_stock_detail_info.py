@@ -11,15 +11,20 @@ import datetime
 import logging
 import json
 
-from bs4 import BeautifulSoup
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-from models import StockInfo
-from config import f9_core_content, f9_survey, exchange_market
+from bs4 import BeautifulSoup, SoupStrainer
+
+from config import f9_core_content, f9_survey, exchange_market, collect_concurrency, host_rate_limit
 from logger import setup_logging
-from collector.collect_data_util import send_request
+from universe import iter_stock_info, load_universe
+from collector.collect_data_util import send_request, async_send_request
+from collector.http_util import HostRateLimiter
 
 
-query_step = 100  # 每次查询数据库的步长，以防出现cursor超时的错误
+parse_workers = 4  # 解析html的进程数
 
 
 def estimate_market(stock_number, attr='code'):
@@ -34,80 +39,143 @@ def estimate_market(stock_number, attr='code'):
     return market
 
 
-def collect_company_survey(stock_info):
-    query_id = stock_info.stock_number + estimate_market(stock_info.stock_number)
-
-    company_survey_url = f9_survey.format(query_id)
-    retry = 5
-    survey_table = ''
-
-    while retry:
-        try:
-            survey_html = send_request(company_survey_url)
-            survey_soup = BeautifulSoup(survey_html, 'lxml')
-            survey_table = survey_soup.find('table', id='tablefont').find_all('td')
-            break
-        except Exception as e:
-            retry -= 1
-            time.sleep(1)
-
-    if not survey_soup or not survey_table:
-        return
-
-    stock_info.company_name_cn = survey_table[1].text.strip()
-    stock_info.company_name_en = survey_table[3].text.strip()
-    stock_info.used_name = survey_table[5].text.strip()
-    stock_info.account_firm = survey_table[43].text.strip()
-    stock_info.law_firm = survey_table[45].text.strip()
-    stock_info.industry_involved = survey_table[17].text.strip()
-    stock_info.business_scope = survey_table[47].text.strip()
-    stock_info.company_introduce = survey_table[7].text.strip()
-    stock_info.area = survey_table[25].text.strip()
-
-    core_concept_url = f9_core_content.format(stock_info.stock_number + '.' +
-                                              estimate_market(stock_info.stock_number, 'market'))
-    concept_data = send_request(core_concept_url)
+# 公司概况表格中各字段所在td的位置
+survey_columns = {
+    'company_name_cn': 1,
+    'company_name_en': 3,
+    'used_name': 5,
+    'company_introduce': 7,
+    'industry_involved': 17,
+    'area': 25,
+    'account_firm': 43,
+    'law_firm': 45,
+    'business_scope': 47,
+}
+survey_strainer = SoupStrainer('table', id='tablefont')
+
+
+def parse_survey(survey_html):
+    """
+    只解析F9页面中id为tablefont的表格，返回字段名到值的dict，解析失败返回None。
+    在进程池中运行，所以只接收和返回可以pickle的数据
+    """
+    survey_soup = BeautifulSoup(survey_html, 'lxml', parse_only=survey_strainer)
+    survey_table = survey_soup.find('table', id='tablefont')
+    if not survey_table:
+        return None
+
+    survey_td = survey_table.find_all('td')
+    if len(survey_td) <= max(survey_columns.values()):
+        return None
+    return {k: survey_td[v].text.strip() for k, v in survey_columns.items()}
+
+
+def parse_market_plate(concept_data):
     try:
         concept_json = json.loads(concept_data)
         if concept_json.get('HXTC').get('hxtc'):
-            market_plate = concept_json.get('HXTC').get('hxtc')[0].get('ydnr')
-            stock_info.market_plate = market_plate
+            return concept_json.get('HXTC').get('hxtc')[0].get('ydnr')
     except Exception as e:
         logging.error('parse concept data error, e = ' + str(e))
-        pass
+    return None
+
 
+def survey_urls(stock_number):
+    company_survey_url = f9_survey.format(stock_number + estimate_market(stock_number))
+    core_concept_url = f9_core_content.format(stock_number + '.' + estimate_market(stock_number, 'market'))
+    return company_survey_url, core_concept_url
+
+
+def save_company_survey(stock_info, survey, market_plate):
+    for k, v in survey.items():
+        setattr(stock_info, k, v)
+    if market_plate:
+        stock_info.market_plate = market_plate
     stock_info.update_time = datetime.datetime.now()
     stock_info.save()
 
 
+def collect_company_survey(stock_info):
+    company_survey_url, core_concept_url = survey_urls(stock_info.stock_number)
+    retry = 5
+    survey = None
+
+    while retry:
+        try:
+            survey = parse_survey(send_request(company_survey_url, endpoint='f9_survey'))
+            if survey:
+                break
+        except Exception:
+            pass
+        retry -= 1
+        time.sleep(1)
+
+    if not survey:
+        return
+
+    market_plate = parse_market_plate(send_request(core_concept_url, endpoint='f9_core_content'))
+    save_company_survey(stock_info, survey, market_plate)
+
+
 def start_collect_detail():
+    for i in iter_stock_info():
+        try:
+            collect_company_survey(i)
+        except Exception as e:
+            logging.error('Error when collect %s data: %s' % (i.stock_number, e))
+        time.sleep(random.random())
+
+
+async def async_collect_company_survey(stock_info, semaphore, limiter, parse_pool):
+    loop = asyncio.get_running_loop()
     try:
-        all_stocks = StockInfo.objects()
+        company_survey_url, core_concept_url = survey_urls(stock_info.stock_number)
+        survey_html = await async_send_request(company_survey_url, semaphore, limiter, endpoint='f9_survey')
+        survey = await loop.run_in_executor(parse_pool, parse_survey, survey_html)
+        if not survey:
+            logging.warning('No company survey for %s' % stock_info.stock_number)
+            return
+
+        core_html = await async_send_request(core_concept_url, semaphore, limiter, endpoint='f9_core_content')
+        market_plate = parse_market_plate(core_html)
+        await loop.run_in_executor(None, save_company_survey, stock_info, survey, market_plate)
     except Exception as e:
-        logging.error('Error when query StockInfo:' + str(e))
-        raise e
+        logging.error('Error when collect %s data: %s' % (stock_info.stock_number, e))
 
-    stocks_count = len(all_stocks)
-    skip = 0
 
-    while skip < stocks_count:
-        try:
-            stocks = StockInfo.objects().skip(skip).limit(query_step)
-        except Exception as e:
-            logging.error('Error when query skip %s  StockInfo:%s' % (skip, e))
-            stocks = []
+async def async_start_collect_detail(concurrency=collect_concurrency, rate_limit=host_rate_limit,
+                                     workers=parse_workers):
+    """
+    并发请求F9页面，在进程池中解析html，concurrency为同时进行的请求数，rate_limit为每秒对东财的最大请求数
+    """
+    stocks = load_universe('stock_number')
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = HostRateLimiter(rate_limit)
+
+    with ProcessPoolExecutor(max_workers=workers) as parse_pool:
+        await asyncio.gather(*[async_collect_company_survey(i, semaphore, limiter, parse_pool) for i in stocks])
+
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(description=u'采集公司概况')
+    parser.add_argument(u'-a', action=u'store_true', dest='use_async', required=False, help=u'是否并发采集')
+    parser.add_argument(u'-c', action=u'store', type=int, dest='concurrency', default=collect_concurrency,
+                        required=False, help=u'并发采集时同时进行的请求数')
+    parser.add_argument(u'-q', action=u'store', type=float, dest='rate_limit', default=host_rate_limit,
+                        required=False, help=u'并发采集时每秒的最大请求数')
+    parser.add_argument(u'-p', action=u'store', type=int, dest='workers', default=parse_workers,
+                        required=False, help=u'解析html的进程数')
 
-        for i in stocks:
-            try:
-                collect_company_survey(i)
-            except Exception as e:
-                logging.error('Error when collect %s data: %s' % (i.stock_number, e))
-            time.sleep(random.random())
-        skip += query_step
+    args = parser.parse_args()
+    return args.use_async, args.concurrency, args.rate_limit, args.workers
 
 
 if __name__ == '__main__':
     setup_logging(__file__, logging.WARNING)
+    use_async, concurrency, rate_limit, workers = setup_argparse()
     logging.info('Start to collect stock detail info')
-    start_collect_detail()
+    if use_async:
+        asyncio.run(async_start_collect_detail(concurrency, rate_limit, workers))
+    else:
+        start_collect_detail()
     logging.info('Collect stock detail info Success')
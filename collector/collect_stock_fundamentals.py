@@ -8,50 +8,57 @@ __author__ = 'fengweigang'
 '''
 
 import logging
-import datetime
 
+import pandas as pd
 import tushare as ts
 
-from models import StockInfo
 from logger import setup_logging
+from collector.stock_info_sync import sync_stock_info
+
+
+# tushare的列名到StockInfo字段的映射
+fundamental_fields = {
+    'industry': 'industry',
+    'pe': 'pe',
+    'liquidAssets': 'liquid_assets',
+    'fixedAssets': 'fixed_assets',
+    'reserved': 'reserved',
+    'reservedPerShare': 'reserved_per_share',
+    'esp': 'esp',
+    'bvps': 'bvps',
+    'pb': 'pb',
+    'undp': 'undp',
+    'perundp': 'perundp',
+    'rev': 'rev',
+    'profit': 'profit',
+    'gpr': 'gpr',
+    'npr': 'npr',
+    'holders': 'holders',
+}
+int_fields = ['liquid_assets', 'fixed_assets', 'reserved', 'undp', 'holders']
+float_fields = ['pe', 'reserved_per_share', 'esp', 'bvps', 'pb', 'perundp', 'rev', 'profit', 'gpr', 'npr']
+
+
+def format_fundamentals(df_all_stock):
+    """
+    把tushare的基本面数据整体转换成StockInfo的字段，过滤掉还没有上市的股票。
+    整数字段用可以为空的Int64，缺失的值写入时为None
+    """
+    df_all_stock = df_all_stock[df_all_stock['timeToMarket'].astype(int) > 0]
+    df = df_all_stock[list(fundamental_fields)].rename(columns=fundamental_fields)
+    df[int_fields] = df[int_fields].astype(float).round().astype('Int64')
+    df[float_fields] = df[float_fields].astype(float)
+    df['time_to_market'] = pd.to_datetime(df_all_stock['timeToMarket'].astype(int).astype(str), format='%Y%m%d')
+    df['stock_number'] = df_all_stock.index.astype(str)
+    return df.reset_index(drop=True)
 
 
 def start_collect_fundamentals():
-    df_all_stock = ts.get_stock_basics()
-    for i in range(len(df_all_stock)):
-        df_stock = df_all_stock.iloc[i]
-        if not int(df_stock['timeToMarket']):
-            continue
-
-        try:
-            cursor = StockInfo.objects(stock_number=df_stock.name)
-            if cursor:
-                stock_info = cursor[0]
-            else:
-                stock_info = StockInfo()
-
-            stock_info.update_time = datetime.datetime.now()
-            stock_info.industry = df_stock['industry']
-            stock_info.pe = float(df_stock['pe'])
-            stock_info.liquid_assets = int(df_stock['liquidAssets'])
-            stock_info.fixed_assets = int(df_stock['fixedAssets'])
-            stock_info.reserved = int(df_stock['reserved'])
-            stock_info.reserved_per_share = float(df_stock['reservedPerShare'])
-            stock_info.esp = float(df_stock['esp'])
-            stock_info.bvps = float(df_stock['bvps'])
-            stock_info.pb = float(df_stock['pb'])
-            stock_info.time_to_market = datetime.datetime.strptime(str(df_stock['timeToMarket']), '%Y%m%d')
-            stock_info.undp = float(df_stock['undp'])
-            stock_info.perundp = float(df_stock['perundp'])
-            stock_info.rev = float(df_stock['rev'])
-            stock_info.profit = float(df_stock['profit'])
-            stock_info.gpr = float(df_stock['gpr'])
-            stock_info.npr = float(df_stock['npr'])
-            stock_info.holders = int(df_stock['holders'])
-
-            stock_info.save()
-        except Exception as e:
-            logging.error('Error when collect stock %s fundamentals from tushare:%s' % (df_stock.name, str(e)))
+    try:
+        df = format_fundamentals(ts.get_stock_basics())
+        sync_stock_info(df, list(fundamental_fields.values()) + ['time_to_market'], insert_new=False)
+    except Exception as e:
+        logging.error('Error when collect stock fundamentals from tushare:%s' % e)
 
 
 if __name__ == '__main__':
@@ -5,63 +5,134 @@
 用来采集每天股票的两融情况
 """
 
+import json
 import logging
+import datetime
+import argparse
 
-import requests
-from mongoengine import Q
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
 from config import rzrq_api
 from models import StockMarginTrading as SMT
 from logger import setup_logging
-from collector.collect_data_util import send_request
+from collector.collect_data_util import send_request, bulk_upsert, bulk_step
 
 
-def collect_margin_trading(req_url):
-    html = send_request(req_url)
+# 两融数据中各列的位置和类型
+margin_columns = {
+    'rz_net_buy_amount': (3, float),
+    'rq_repay_volume': (5, int),
+    'rq_sell_volume': (6, int),
+    'rq_remaining_volume': (8, int),
+    'rz_repay_amount': (9, float),
+    'rz_buy_amount': (10, float),
+    'rz_remaining_amount': (12, float),
+}
 
-    margin_data = eval(html)
+
+def to_number(value, num_type=float):
+    """
+    把字符串转换成数字，'-'或空字符串返回None
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if not value or value == '-':
+        return None
+    try:
+        return num_type(float(value))
+    except ValueError:
+        return None
+
+
+def parse_margin_trading(html, date):
+    margin_data = json.loads(html)
+
+    records = []
     for i in margin_data:
-        margin_item = i.decode('utf-8').split(',')
-        stock_number = margin_item[0]
-        stock_name = margin_item[2]
-        rz_net_buy_amount = margin_item[3]
-        rq_repay_volume = margin_item[5]
-        rq_sell_volume = margin_item[6]
-        rq_remaining_volume = margin_item[8]
-        rz_repay_amount = margin_item[9]
-        rz_buy_amount = margin_item[10]
-        rz_remaining_amount = margin_item[12]
-        smt = SMT(stock_number=stock_number, stock_name=stock_name, rz_net_buy_amount=rz_net_buy_amount,
-                  rq_repay_volume=rq_repay_volume, rq_sell_volume=rq_sell_volume,
-                  rq_remaining_volume=rq_remaining_volume, rz_repay_amount=rz_repay_amount,
-                  rz_buy_amount=rz_buy_amount, rz_remaining_amount=rz_remaining_amount)
-
-        if not is_duplicate(smt):
-            smt.save()
-
-
-def is_duplicate(smt):
-    duplicate_data = SMT.objects(Q(stock_number=smt.stock_number) &
-                                 Q(stock_name=smt.stock_name) &
-                                 Q(rz_net_buy_amount=smt.rz_net_buy_amount) &
-                                 Q(rq_repay_volume=smt.rq_repay_volume) &
-                                 Q(rq_sell_volume=smt.rq_sell_volume) &
-                                 Q(rq_remaining_volume=smt.rq_remaining_volume) &
-                                 Q(rz_repay_amount=smt.rz_repay_amount) &
-                                 Q(rz_buy_amount=smt.rz_buy_amount) &
-                                 Q(rz_remaining_amount=smt.rz_remaining_amount))
-    if duplicate_data:
-        return True
-    else:
-        return False
+        margin_item = i.split(',')
+        record = {'stock_number': margin_item[0], 'stock_name': margin_item[2], 'date': date}
+        for k, (index, num_type) in margin_columns.items():
+            record[k] = to_number(margin_item[index], num_type)
+        records.append(record)
+    return records
+
+
+def collect_margin_trading(req_url, date=None):
+    if date is None:
+        date = datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0))
+
+    records = parse_margin_trading(send_request(req_url), date)
+    return bulk_upsert(SMT, records, ['stock_number', 'date'])
+
+
+def remove_duplicate_margin_trading():
+    """
+    同一只股票同一天有多条两融数据时只保留最后写入的一条
+    """
+    collection = SMT._get_collection()
+    pipeline = [
+        {'$group': {'_id': {'stock_number': '$stock_number', 'date': '$date'},
+                    'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+    duplicate_ids = []
+    for i in collection.aggregate(pipeline, allowDiskUse=True):
+        duplicate_ids.extend(sorted(i['ids'])[:-1])
+    for i in range(0, len(duplicate_ids), bulk_step):
+        collection.delete_many({'_id': {'$in': duplicate_ids[i:i + bulk_step]}})
+    return len(duplicate_ids)
+
+
+def migrate_margin_trading():
+    """
+    把以前以字符串存储的两融数据按_id原地转换成数字，全部转换成功后再去掉重复的数据并建立唯一索引。
+    中途失败时不会删除任何数据，重新运行即可
+    """
+    collection = SMT._get_collection()
+    ops = []
+    for doc in collection.find({'rz_remaining_amount': {'$type': 'string'}}):
+        update = {}
+        for k, (_, num_type) in margin_columns.items():
+            value = doc.get(k)
+            if isinstance(value, str):
+                update[k] = to_number(value, num_type)
+        ops.append(UpdateOne({'_id': doc['_id']}, {'$set': update}))
+
+    converted = 0
+    for i in range(0, len(ops), bulk_step):
+        try:
+            converted += collection.bulk_write(ops[i:i + bulk_step], ordered=False).matched_count
+        except BulkWriteError as e:
+            logging.error('Migrate margin trading failed: %s' % e.details.get('writeErrors', [])[:5])
+            return converted, 0
+
+    removed = remove_duplicate_margin_trading()
+    SMT.ensure_indexes()
+    logging.info('Migrate margin trading: %s converted, %s duplicates removed' % (converted, removed))
+    return converted, removed
+
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(description=u'采集两融数据')
+    parser.add_argument(u'-m', action=u'store_true', dest='migrate', required=False,
+                        help=u'把以前以字符串存储的两融数据转换成数字')
+
+    args = parser.parse_args()
+    return args.migrate
 
 
 if __name__ == '__main__':
     setup_logging(__file__, logging.WARNING)
-    logging.info('Start to collect stock margin trading')
-    for url in rzrq_api:
-        try:
-            collect_margin_trading(url)
-        except Exception as e:
-            logging.error('Collect margin trading %s failed:%s' % (url, e))
-    logging.info('collect stock margin trading success')
+    migrate = setup_argparse()
+    if migrate:
+        migrate_margin_trading()
+    else:
+        logging.info('Start to collect stock margin trading')
+        for url in rzrq_api:
+            try:
+                collect_margin_trading(url)
+            except Exception as e:
+                logging.error('Collect margin trading %s failed:%s' % (url, e))
+        logging.info('collect stock margin trading success')
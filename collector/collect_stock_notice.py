@@ -9,73 +9,112 @@
 import datetime
 import logging
 import json
+import asyncio
+import argparse
 
-import requests
-
-from models import StockInfo, StockNotice
-from config import company_notice, single_notice
+from models import StockNotice
+from config import company_notice, single_notice, collect_concurrency, host_rate_limit
 from logger import setup_logging
-from collector.collect_data_util import send_request
-
-
-query_step = 30  # 一次从数据库中取出的数据量
-
+from universe import iter_stock_info, load_universe
+from collector.collect_data_util import send_request, async_send_request, valid_documents
+from collector.http_util import HostRateLimiter
 
-def is_exists(notice_code):
-    cursor = StockNotice.objects(code=notice_code)
 
-    if cursor:
-        return True
-    else:
-        return False
-
-
-def collect_notice(stock_info):
-    req_url = company_notice.format(stock_info.stock_number)
-    raw_data = send_request(req_url).replace('var', '').replace('=', '').replace(';', '').strip()
+def parse_notice(stock_info, html):
+    raw_data = html.replace('var', '').replace('=', '').replace(';', '').strip()
     notice_data = json.loads(raw_data).get('data', [])
 
+    notices = []
     for n in notice_data:
         notice_title = n.get('NOTICETITLE')
         notice_code = n.get('INFOCODE')
         notice_date = datetime.datetime.strptime(n.get('NOTICEDATE').split('T')[0], '%Y-%m-%d')
         notice_url = single_notice.format(stock_info.stock_number, notice_code)
+        notices.append(StockNotice(title=notice_title, code=notice_code, date=notice_date, content_url=notice_url,
+                                   stock_number=stock_info.stock_number, stock_name=stock_info.stock_name))
+    return notices
+
+
+def save_new_notice(notices):
+    """
+    用一次$in查询过滤掉已存在的公告，再批量插入新公告
+    """
+    if not notices:
+        return 0
+
+    codes = list(set([n.code for n in notices]))
+    exists_codes = set(StockNotice.objects(code__in=codes).distinct('code'))
+
+    new_notices = []
+    for n in notices:
+        if n.code not in exists_codes:
+            exists_codes.add(n.code)
+            new_notices.append(n)
+
+    new_notices = valid_documents(new_notices)
+    if new_notices:
+        StockNotice.objects.insert(new_notices, load_bulk=False)
+    return len(new_notices)
+
 
-        if not is_exists(notice_code):
-            stock_notice = StockNotice(title=notice_title, code=notice_code, date=notice_date,
-                content_url=notice_url, stock_number=stock_info.stock_number, stock_name=stock_info.stock_name)
-            stock_notice.save()
+def collect_notice(stock_info):
+    req_url = company_notice.format(stock_info.stock_number)
+    notices = parse_notice(stock_info, send_request(req_url, endpoint='company_notice'))
+    save_new_notice(notices)
 
 
 def start_collect_notice():
+    for i in iter_stock_info('stock_number', 'stock_name'):
+        try:
+            collect_notice(i)
+        except Exception as e:
+            logging.error('Error when collect %s notice: %s' % (i.stock_number, e))
+
+
+async def async_collect_notice(stock_info, semaphore, limiter):
+    req_url = company_notice.format(stock_info.stock_number)
     try:
-        all_stocks = StockInfo.objects()
+        html = await async_send_request(req_url, semaphore, limiter, endpoint='company_notice')
+        notices = parse_notice(stock_info, html)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, save_new_notice, notices)
+    except Exception as e:
+        logging.error('Error when collect %s notice: %s' % (stock_info.stock_number, e))
+
+
+async def async_start_collect_notice(concurrency=collect_concurrency, rate_limit=host_rate_limit):
+    """
+    并发采集所有股票的公告，concurrency为同时进行的请求数，rate_limit为每秒对东财的最大请求数
+    """
+    try:
+        stocks = load_universe('stock_number', 'stock_name')
     except Exception as e:
         logging.error('Error when query StockInfo:' + str(e))
         raise e
 
-    stocks_count = len(all_stocks)
-    skip = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = HostRateLimiter(rate_limit)
+    await asyncio.gather(*[async_collect_notice(i, semaphore, limiter) for i in stocks])
 
-    while skip < stocks_count:
-        try:
-            stocks = StockInfo.objects().skip(skip).limit(query_step)
-        except Exception as e:
-            logging.error('Error when query skip %s  StockInfo:%s' % (skip, e))
-            stocks = []
 
-        for i in stocks:
-            try:
-                collect_notice(i)
-            except Exception as e:
-                logging.error('Error when collect %s notice: %s' % (i.stock_number, e))
-            # time.sleep(random.random())
-        skip += query_step
-        # time.sleep(random.random()*10)
+def setup_argparse():
+    parser = argparse.ArgumentParser(description=u'采集股票公告')
+    parser.add_argument(u'-a', action=u'store_true', dest='use_async', required=False, help=u'是否并发采集')
+    parser.add_argument(u'-c', action=u'store', type=int, dest='concurrency', default=collect_concurrency,
+                        required=False, help=u'并发采集时同时进行的请求数')
+    parser.add_argument(u'-q', action=u'store', type=float, dest='rate_limit', default=host_rate_limit,
+                        required=False, help=u'并发采集时每秒的最大请求数')
+
+    args = parser.parse_args()
+    return args.use_async, args.concurrency, args.rate_limit
 
 
 if __name__ == '__main__':
     setup_logging(__file__, logging.WARNING)
+    use_async, concurrency, rate_limit = setup_argparse()
     logging.info('Start to collect stock detail info')
-    start_collect_notice()
+    if use_async:
+        asyncio.run(async_start_collect_notice(concurrency, rate_limit))
+    else:
+        start_collect_notice()
     logging.info('Collect stock detail info Success')
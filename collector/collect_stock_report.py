@@ -2,67 +2,144 @@
 # -*- coding: utf-8 -*-
 
 """
-获取股票研究报告数据
+获取股票研究报告数据，按页读取报告列表，先批量过滤掉已入库的报告，只并发下载新报告的正文
 """
 
 
 import datetime
 import logging
+import json
+import asyncio
+import argparse
 
-import requests
-from bs4 import BeautifulSoup
-from mongoengine import Q
+from bs4 import BeautifulSoup, SoupStrainer
 
 from models import StockReport
-from config import company_report
+from config import company_report, base_report_url, report_page_size, report_max_page, collect_concurrency,\
+    host_rate_limit
 from logger import setup_logging
-from collector.collect_data_util import send_request
-
-
-page = 20  # 每次查询数据库的步长，以防出现cursor超时的错误
-
-
-def check_duplicate(info_code, date):
-    cursor = StockReport.objects(Q(info_code=info_code) & Q(date=date))
-    if cursor:
-        return True
-    else:
-        return False
-
-
-def collect_company_report():
-    report_list = requests.get(company_report).json().get('data', [])
-
-    for r in report_list:
-        stock_number = r.get('secuFullCode', '').strip().split('.')[0]
-        stock_name = r.get('secuName', '').strip()
-        date = datetime.datetime.strptime(r.get('datetime').split('T')[0], '%Y-%m-%d')
-        title = r.get('title')
-        author = r.get('author')
-        rate_change = r.get('change')
-        rate = r.get('rate')
-        institution = r.get('insName')
-        info_code = r.get('infoCode').strip()
-
-        content_url = 'http://data.eastmoney.com/report/' + date.strftime('%Y%m%d') + '/' + info_code + '.html'
-        try:
-            content = BeautifulSoup(send_request(content_url), 'lxml').find('div', class_='newsContent').text.strip()
-        except Exception as e:
-            logging.error('Error when get %s report content:%s' % (stock_number, e))
-            continue
-
-        if not check_duplicate(info_code, date):
-            stock_report = StockReport(stock_number=stock_number, stock_name=stock_name, date=date, title=title,
-                                       author=author, rate_change=rate_change, rate=rate, institution=institution,
-                                       info_code=info_code, content=content)
-            try:
-                stock_report.save()
-            except Exception as e:
-                logging.error('Error when save %s report %s:%s' % (stock_number, info_code, e))
+from collector.collect_data_util import send_request, async_send_request, valid_documents
+from collector.http_util import HostRateLimiter
+
+
+content_strainer = SoupStrainer('div', class_='newsContent')
+
+
+def parse_report_header(r):
+    date = datetime.datetime.strptime(r.get('datetime').split('T')[0], '%Y-%m-%d')
+    return {
+        'stock_number': r.get('secuFullCode', '').strip().split('.')[0],
+        'stock_name': r.get('secuName', '').strip(),
+        'date': date,
+        'title': r.get('title'),
+        'author': r.get('author'),
+        'rate_change': r.get('change'),
+        'rate': r.get('rate'),
+        'institution': r.get('insName'),
+        'info_code': r.get('infoCode').strip(),
+    }
+
+
+def get_report_page(page):
+    """
+    返回第page页的报告列表和总页数
+    """
+    report_data = json.loads(send_request(company_report % (report_page_size, page)))
+    headers = [parse_report_header(r) for r in report_data.get('data', [])]
+
+    try:
+        pages = int(report_data.get('pages'))
+    except (TypeError, ValueError):
+        pages = page
+    return headers, pages
+
+
+def filter_new_reports(headers):
+    """
+    用一次$in查询过滤掉已入库的报告，同一页中重复的info_code只保留一个
+    """
+    codes = list(set([h['info_code'] for h in headers]))
+    if not codes:
+        return []
+
+    exists_codes = set(StockReport.objects(info_code__in=codes).distinct('info_code'))
+    new_headers = []
+    for h in headers:
+        if h['info_code'] not in exists_codes:
+            exists_codes.add(h['info_code'])
+            new_headers.append(h)
+    return new_headers
+
+
+def parse_report_content(html):
+    content_div = BeautifulSoup(html, 'lxml', parse_only=content_strainer).find('div', class_='newsContent')
+    return content_div.text.strip()
+
+
+async def fetch_report(header, semaphore, limiter):
+    content_url = base_report_url + header['date'].strftime('%Y%m%d') + '/' + header['info_code'] + '.html'
+    try:
+        html = await async_send_request(content_url, semaphore, limiter, endpoint='report_content')
+        return StockReport(content=parse_report_content(html), **header)
+    except Exception as e:
+        logging.error('Error when get %s report content:%s' % (header['stock_number'], e))
+        return None
+
+
+def save_reports(reports):
+    reports = valid_documents(reports)
+    if not reports:
+        return 0
+
+    try:
+        StockReport.objects.insert(reports, load_bulk=False)
+    except Exception as e:
+        logging.error('Error when save reports:%s' % e)
+        return 0
+    return len(reports)
+
+
+async def async_collect_company_report(concurrency=collect_concurrency, rate_limit=host_rate_limit,
+                                       max_page=report_max_page):
+    """
+    从第一页开始翻页，某一页的报告全部已入库时停止，所以耗时只和新报告的数量有关
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = HostRateLimiter(rate_limit)
+    loop = asyncio.get_running_loop()
+    saved = 0
+
+    for page in range(1, max_page + 1):
+        headers, pages = await loop.run_in_executor(None, get_report_page, page)
+        new_headers = await loop.run_in_executor(None, filter_new_reports, headers)
+        if not new_headers:
+            break
+
+        reports = await asyncio.gather(*[fetch_report(h, semaphore, limiter) for h in new_headers])
+        saved += await loop.run_in_executor(None, save_reports, [r for r in reports if r])
+        if page >= pages:
+            break
+
+    logging.info('Collect %s new reports' % saved)
+    return saved
+
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(description=u'采集股票研究报告')
+    parser.add_argument(u'-c', action=u'store', type=int, dest='concurrency', default=collect_concurrency,
+                        required=False, help=u'同时进行的请求数')
+    parser.add_argument(u'-q', action=u'store', type=float, dest='rate_limit', default=host_rate_limit,
+                        required=False, help=u'每秒的最大请求数')
+    parser.add_argument(u'-m', action=u'store', type=int, dest='max_page', default=report_max_page,
+                        required=False, help=u'最多翻的页数')
+
+    args = parser.parse_args()
+    return args.concurrency, args.rate_limit, args.max_page
 
 
 if __name__ == '__main__':
     setup_logging(__file__, logging.WARNING)
-    logging.info('Start to collect stock detail info')
-    collect_company_report()
-    logging.info('Collect stock detail info Success')
+    concurrency, rate_limit, max_page = setup_argparse()
+    logging.info('Start to collect stock report')
+    asyncio.run(async_collect_company_report(concurrency, rate_limit, max_page))
+    logging.info('Collect stock report Success')
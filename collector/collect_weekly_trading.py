@@ -10,7 +10,7 @@ import argparse
 from mongoengine import Q
 
 from models import StockWeeklyTrading as SWT
-from models import StockInfo
+from universe import iter_stock_info
 from config import datayes_week_trading
 from config import datayes_headers
 from collector.collect_data_util import send_request
@@ -18,33 +18,12 @@ from logger import setup_logging
 from collector.collect_data_util import check_duplicate
 
 
-query_step = 100
-
-
 def start_collect_data(start_date, end_date):
-
-    try:
-        all_stocks = StockInfo.objects()
-    except Exception as e:
-        logging.error('Error when query StockInfo:' + str(e))
-        raise e
-
-    stocks_count = all_stocks.count()
-    skip = 0
-
-    while skip < stocks_count:
+    for i in iter_stock_info('stock_number'):
         try:
-            stocks = StockInfo.objects().skip(skip).limit(query_step)
+            collect_stock_data(i.stock_number, start_date, end_date)
         except Exception as e:
-            logging.error('Error when query skip %s  StockInfo:%s' % (skip, e))
-            stocks = []
-
-        for i in stocks:
-            try:
-                collect_stock_data(i.stock_number, start_date, end_date)
-            except Exception as e:
-                logging.error('Error when collect datayes weekly trading data %s: %s' % (i.stock_number, e))
-        skip += query_step
+            logging.error('Error when collect datayes weekly trading data %s: %s' % (i.stock_number, e))
 
 
 def collect_stock_data(stock_number, start_date, end_date):
@@ -53,7 +32,7 @@ def collect_stock_data(stock_number, start_date, end_date):
 
     end_date += datetime.timedelta(days=7)
     url = datayes_week_trading.format(stock_number, start_date.strftime('%Y%m%d'), end_date.strftime('%Y%m%d'))
-    res_data = json.loads(send_request(url, datayes_headers))
+    res_data = json.loads(send_request(url, datayes_headers, endpoint='getMktEquw'))
     if res_data.get('retCode', 0) != 1:
         return
 
@@ -92,6 +71,7 @@ def collect_stock_data(stock_number, start_date, end_date):
         swt.weekly_highest_price = float(i.get('highestPrice'))
         swt.weekly_lowest_price = float(i.get('lowestPrice'))
         swt.increase_rate = str(round(i.get('chgPct') * 100, 2)) + '%'
+        swt.increase_rate_value = round(i.get('chgPct') * 100, 2)
         swt.turnover_amount = int(i.get('turnoverValue')) / 10000
         swt.turnover_volume = int(i.get('turnoverVol')) / 100
 
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+所有采集脚本共用的http请求层，按host复用连接，失败后带随机抖动地退避重试
+"""
+
+import time
+import random
+import logging
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import http_pool_size, http_retry, http_backoff
+
+
+timeout = 30
+retry_status = (429, 500, 502, 503, 504)
+default_headers = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, sdch',
+    'Accept-Language': 'zh-CN,zh;q=0.8,en;q=0.6,zh-TW;q=0.4',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'Pragma': 'no-cache',
+    'Upgrade-Insecure-Requests': '1',
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/46.0.2490.86 Safari/537.36'
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url):
+    """
+    获取url所在host的session，每个host一个连接池
+    """
+    host = urlparse(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=http_pool_size, max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[host] = session
+    return session
+
+
+def backoff_time(attempt, backoff=http_backoff):
+    """
+    指数退避加上全随机抖动，避免重试同时打到同一个host
+    """
+    return random.uniform(0, backoff * (2 ** attempt))
+
+
+def get(url, headers=None, timeout=timeout, retry=http_retry, backoff=http_backoff):
+    """
+    发送GET请求，headers只对本次请求生效
+    :return: requests.Response
+    """
+    req_headers = dict(default_headers)
+    if headers:
+        req_headers.update(headers)
+
+    session = get_session(url)
+    attempt = 0
+    while True:
+        try:
+            r = session.get(url, headers=req_headers, timeout=timeout)
+            if r.status_code not in retry_status or attempt >= retry:
+                return r
+            logging.warning('Request url %s got %s, retry %s' % (url, r.status_code, attempt + 1))
+        except requests.RequestException as e:
+            if attempt >= retry:
+                logging.error('Request url %s failed: %s' % (url, e))
+                raise e
+            logging.warning('Request url %s failed: %s, retry %s' % (url, e, attempt + 1))
+
+        time.sleep(backoff_time(attempt, backoff))
+        attempt += 1
+
+
+class HostRateLimiter(object):
+    """
+    异步采集时限制每秒对同一个host发起的请求数
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = {}
+        self.lock = None
+
+    async def wait(self, url):
+        if not self.interval:
+            return
+
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        host = urlparse(url).netloc
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            now = loop.time()
+            start = max(now, self.next_time.get(host, now))
+            self.next_time[host] = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+把以前以字符串存储的百分比字段（如"9.98%"）转换成数值，写入对应的*_value字段。
+按_id范围分批处理，每批之间休眠一会，可以在白天和采集任务一起在后台运行，重复运行只会处理还没转换的文档
+"""
+
+import time
+import logging
+import argparse
+
+from pymongo import UpdateOne
+
+from models import StockDailyTrading as SDT, StockWeeklyTrading as SWT, StockMonthlyTrading as SMT
+from logger import setup_logging
+
+
+batch_size = 1000
+batch_interval = 0.2  # 每批之间的休眠时间，单位 秒
+
+# 每个集合需要转换的字符串字段
+percent_fields = {
+    'sdt': (SDT, ['increase_rate', 'turnover_rate']),
+    'swt': (SWT, ['increase_rate', 'range_percent']),
+    'smt': (SMT, ['increase_rate', 'range_percent']),
+}
+
+
+def to_percent_value(raw):
+    try:
+        return float(raw.replace('%', '').strip())
+    except (AttributeError, ValueError):
+        return None
+
+
+def migrate_percent_fields(document, fields, step=batch_size, interval=batch_interval):
+    """
+    把document中fields字段的字符串转换成数值，返回修改的文档数
+    """
+    collection = document._get_collection()
+    query = {'$or': [{f: {'$type': 'string'}, f + '_value': {'$exists': False}} for f in fields]}
+    projection = {f: 1 for f in fields}
+    modified = 0
+    last_id = None
+
+    while True:
+        batch_query = dict(query, _id={'$gt': last_id}) if last_id else query
+        docs = list(collection.find(batch_query, projection).sort('_id', 1).limit(step))
+        if not docs:
+            break
+        last_id = docs[-1]['_id']
+
+        ops = []
+        for doc in docs:
+            values = {f + '_value': to_percent_value(doc.get(f)) for f in fields if isinstance(doc.get(f), str)}
+            ops.append(UpdateOne({'_id': doc['_id']}, {'$set': values}))
+
+        try:
+            modified += collection.bulk_write(ops, ordered=False).modified_count
+        except Exception as e:
+            logging.error('Migrate %s percent fields failed: %s' % (collection.name, e))
+        time.sleep(interval)
+
+    logging.info('Migrate %s percent fields: %s modified' % (collection.name, modified))
+    return modified
+
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(description=u'把字符串的百分比字段转换成数值')
+    parser.add_argument(u'-c', action=u'store', dest='collections', nargs='+', default=list(percent_fields),
+                        choices=list(percent_fields), required=False, help=u'需要迁移的集合')
+    parser.add_argument(u'-b', action=u'store', type=int, dest='batch_size', default=batch_size, required=False,
+                        help=u'每批处理的文档数')
+    parser.add_argument(u'-i', action=u'store', type=float, dest='interval', default=batch_interval,
+                        required=False, help=u'每批之间的休眠时间')
+
+    args = parser.parse_args()
+    return args.collections, args.batch_size, args.interval
+
+
+if __name__ == '__main__':
+    setup_logging(__file__, logging.WARNING)
+    collections, step, interval = setup_argparse()
+    for c in collections:
+        document, fields = percent_fields[c]
+        migrate_percent_fields(document, fields, step, interval)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+采集响应的本地磁盘缓存，按请求内容的sha256存放压缩后的原始响应。
+replay模式下只从缓存读取，用于修改解析逻辑后重新解析，或离线测试解析和入库的速度
+"""
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+from os.path import join, exists, getsize, getmtime
+
+from config import response_cache_mode, response_cache_path, response_cache_max_size
+from config import response_cache_default_ttl, response_cache_ttl
+
+
+evict_interval = 200  # 每写入多少次检查一次缓存大小
+_write_count = 0
+
+
+class CacheMiss(Exception):
+    """
+    replay模式下缓存中没有对应的响应
+    """
+    pass
+
+
+def is_enabled():
+    return response_cache_mode in ('on', 'replay')
+
+
+def is_replay():
+    return response_cache_mode == 'replay'
+
+
+def cache_key(*parts):
+    raw = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def cache_file(key):
+    return join(response_cache_path, key[:2], key + '.gz')
+
+
+def get_ttl(endpoint):
+    return response_cache_ttl.get(endpoint, response_cache_default_ttl)
+
+
+def load(key, endpoint):
+    """
+    读取缓存，过期或不存在时返回None，replay模式下忽略过期时间，不存在则抛出CacheMiss
+    """
+    path = cache_file(key)
+    if not exists(path):
+        if is_replay():
+            raise CacheMiss('No cached response for %s' % endpoint)
+        return None
+
+    if not is_replay() and time.time() - getmtime(path) > get_ttl(endpoint):
+        return None
+
+    try:
+        with gzip.open(path, 'rb') as fd:
+            return fd.read()
+    except Exception as e:
+        logging.error('Read cache %s failed: %s' % (path, e))
+        if is_replay():
+            raise CacheMiss('Broken cached response for %s' % endpoint)
+        return None
+
+
+def save(key, data):
+    global _write_count
+    path = cache_file(key)
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(tmp_path, 'wb') as fd:
+            fd.write(data)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error('Write cache %s failed: %s' % (path, e))
+        return
+
+    _write_count += 1
+    if _write_count % evict_interval == 1:
+        evict()
+
+
+def evict(max_size=response_cache_max_size):
+    """
+    缓存目录超过max_size时，从最早写入的文件开始删除，直到降到max_size的80%
+    """
+    files = []
+    total_size = 0
+    for root, _, names in os.walk(response_cache_path):
+        for n in names:
+            path = join(root, n)
+            try:
+                size = getsize(path)
+                files.append((getmtime(path), size, path))
+            except OSError:
+                continue
+            total_size += size
+
+    if total_size <= max_size:
+        return
+
+    files.sort()
+    for _, size, path in files:
+        if total_size <= max_size * 0.8:
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            continue
+
+
+def cached(endpoint, key_parts, fetch, dumps=None, loads=None):
+    """
+    先从缓存读取，未命中时调用fetch并写入缓存
+    :param endpoint: response_cache_ttl中的接口名，没有配置的按默认时间缓存
+    :param key_parts: 决定缓存key的请求参数
+    :param fetch: 实际发起请求的函数，返回(响应, 是否可以缓存)，如5xx的错误页面不缓存
+    :param dumps: 把响应转换为bytes的函数，默认按utf-8编码
+    :param loads: 把bytes转换回响应的函数，默认按utf-8解码
+    """
+    dumps = dumps or (lambda x: x.encode('utf-8'))
+    loads = loads or (lambda x: x.decode('utf-8'))
+    key = cache_key(*key_parts)
+
+    data = load(key, endpoint)
+    if data is not None:
+        return loads(data)
+
+    res, cacheable = fetch()
+    if cacheable and res is not None and len(res):
+        save(key, dumps(res))
+    return res
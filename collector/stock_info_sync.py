@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+StockInfo的批量同步，一次读出现有数据，在内存中和新数据比较，只把有变化的字段用$set批量写回
+"""
+
+import logging
+import datetime
+
+from models import StockInfo
+from collector.collect_data_util import frame_to_records, bulk_upsert
+
+
+def load_stock_info_snapshot(fields):
+    """
+    一次查询取出所有股票的fields字段，返回stock_number到字段dict的映射
+    """
+    projection = {f: 1 for f in fields}
+    projection.update({'stock_number': 1, '_id': 0})
+    cursor = StockInfo._get_collection().find({}, projection)
+    return {i['stock_number']: i for i in cursor}
+
+
+def diff_stock_info(records, snapshot, fields):
+    """
+    返回需要写入的记录，每条只包含stock_number和值有变化的字段，新股票包含全部字段
+    """
+    changes = []
+    for r in records:
+        current = snapshot.get(r['stock_number'])
+        if current is None:
+            changed = {f: r.get(f) for f in fields}
+        else:
+            changed = {f: r.get(f) for f in fields if r.get(f) != current.get(f)}
+
+        if changed:
+            changed['stock_number'] = r['stock_number']
+            changes.append(changed)
+    return changes
+
+
+def sync_stock_info(df, fields, insert_new=True):
+    """
+    把df同步到StockInfo
+    :param df: 包含stock_number列和fields各列的DataFrame
+    :param fields: 需要同步的字段
+    :param insert_new: 是否插入StockInfo中还没有的股票
+    :return: 新插入和被修改的文档数
+    """
+    records = frame_to_records(df[['stock_number'] + list(fields)])
+    snapshot = load_stock_info_snapshot(fields)
+    changes = diff_stock_info(records, snapshot, fields)
+    if not insert_new:
+        changes = [c for c in changes if c['stock_number'] in snapshot]
+    if not changes:
+        return 0, 0
+
+    now = datetime.datetime.now()
+    for c in changes:
+        c['update_time'] = now
+
+    insert_defaults = {'create_time': now, 'total_value': 0, 'circulated_value': 0}
+    upserted, modified = bulk_upsert(StockInfo, changes, ['stock_number'], insert_defaults, upsert=insert_new)
+    logging.info('Sync StockInfo %s: %s inserted, %s modified' % (list(fields), upserted, modified))
+    return upserted, modified
@@ -3,12 +3,36 @@
 
 __author__ = 'fengweigang'
 
+import pickle
+from functools import partial
+
 import tushare
 import config
+from collector import response_cache
+
+
+class CachedProClient(object):
+    """
+    给tushare pro api加上本地响应缓存，调用方式和pro_api一致
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def query(self, api_name, fields='', **kwargs):
+        return response_cache.cached(api_name, ('tushare', api_name, fields, kwargs),
+                                     lambda: (self.client.query(api_name, fields=fields, **kwargs), True),
+                                     dumps=pickle.dumps, loads=pickle.loads)
+
+    def __getattr__(self, name):
+        return partial(self.query, name)
 
 
 def get_pro_client():
-    return tushare.pro_api(config.tushare_token)
+    client = tushare.pro_api(config.tushare_token)
+    if response_cache.is_enabled():
+        return CachedProClient(client)
+    return client
 
 
 def gen_ts_code(stock_number):
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+
 # 使用mongodb存储数据
 mongodb_config = {
     'host': 'localhost',
@@ -37,7 +39,9 @@ log_path = '/usr/local/var/blade-fury/blade-fury.log'
 local_log_path = 'blade-fury.log'
 
 company_report = 'http://datainterface.eastmoney.com/EM_DataCenter/js.aspx?type=SR&sty=GGSR&'\
-                 'js={"data":[(x)],"pages":"(pc)","update":"(ud)","count":"(count)"}&ps=1000&p=1'
+                 'js={"data":[(x)],"pages":"(pc)","update":"(ud)","count":"(count)"}&ps=%s&p=%s'
+report_page_size = 100  # 每页研究报告的数量
+report_max_page = 10  # 每次最多翻的页数，遇到整页都已入库的报告时会提前停止
 base_report_url = 'http://data.eastmoney.com/report/'
 
 market_index = 'http://hqdigi2.eastmoney.com/EM_Quote2010NumericApplication/Index.aspx?type=z&sortType=C&sortRule=-1&'\
@@ -55,3 +59,39 @@ ts_code_pattern = [
     {'code_postfix': '.SH', 'pattern': ['6']},
     {'code_postfix': '.SZ', 'pattern': ['00', '30']}
 ]
+
+# 采集时http请求的连接池和重试配置
+http_pool_size = 10  # 每个host保持的连接数
+http_retry = 3  # 失败后的重试次数
+http_backoff = 0.5  # 重试退避的基数，单位 秒
+collect_concurrency = 10  # 异步采集时同时进行的请求数
+host_rate_limit = 20  # 异步采集时每秒对同一个host发起的最大请求数
+
+# 采集响应的本地缓存，off: 不使用，on: 先读缓存未命中再请求，replay: 只读缓存
+response_cache_mode = os.environ.get('BLADE_FURY_CACHE', 'off')
+response_cache_path = '/usr/local/var/blade-fury/cache'
+response_cache_max_size = 2 * 1024 ** 3  # 缓存目录的最大字节数，超过后按写入时间淘汰
+response_cache_default_ttl = 3600  # 单位 秒
+response_cache_ttl = {  # 按接口名配置的缓存时间，东财接口的名字由send_request的endpoint传入，没有endpoint的请求不缓存，单位 秒
+    'f9_survey': 7 * 86400,
+    'f9_core_content': 7 * 86400,
+    'report_content': 30 * 86400,
+    'company_notice': 1800,
+    'getMktEquw': 12 * 3600,
+    'getMktEquwAdjAf': 12 * 3600,
+    'trade_cal': 7 * 86400,
+    'daily': 6 * 3600,
+}
+
+# 按交易日回填历史日线时记录进度的文件
+his_trading_checkpoint_path = '/usr/local/var/blade-fury/his_trading_checkpoint.json'
+
+# 本地列式日线价格库，每个字段一个按(交易日, 股票)存放的内存映射文件
+price_store_path = '/usr/local/var/blade-fury/price_store'
+price_store_capacity = 6000  # 预留的股票数，超过后会重建文件
+
+# 全市场运行策略时的进程数，每个进程处理股票池的一部分
+quant_workers = int(os.environ.get('BLADE_FURY_QUANT_WORKERS', os.cpu_count() or 1))
+quant_shards_per_worker = 4  # 每个进程分到的分片数，分片越多各进程的负载越均衡
+
+excluded_account_firms = [u'瑞华会计师']  # 全市场分析时过滤这些会计师事务所的客户
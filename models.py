@@ -69,16 +69,19 @@ class StockDailyTrading(Document):
     turnover_volume = IntField()  # 成交量 单位 /手
     increase_amount = FloatField()  # 股票今日上涨额 单位 rmb
     increase_rate = StringField()  # 股票今日涨幅 单位 %
+    increase_rate_value = FloatField()  # 股票今日涨幅的数值 单位 %
     today_average_price = FloatField()  # 股票今日平均价格 单位 rmb
     quantity_relative_ratio = FloatField()  # 股票今日量比
     turnover_rate = StringField()  # 股票今日换手率
+    turnover_rate_value = FloatField()  # 股票今日换手率的数值 单位 %
     total_stock = IntField()  # 股票的当日总股本
     circulation_stock = IntField()  # 股票的当日流通股
     date = DateTimeField(default=datetime.date.today())  # 收录股票交易数据的日期
     timestamp = IntField(default=int(time.time()))  # 收录数据时的时间戳
     year_ma = FloatField(default=0)  # 年线价格 单位 rmb
     meta = {
-        'indexes': ['date', 'stock_number', ('stock_number', '-date'), ('stock_number', 'date')],
+        'indexes': ['date', 'stock_number', ('stock_number', '-date'), ('stock_number', 'date'),
+                    ('date', 'increase_rate_value')],
         'index_background': True,
     }
 
@@ -90,6 +93,7 @@ class StockWeeklyTrading(Document):
 
     stock_number = StringField(required=True, max_length=10)  # 股票编号
     stock_name = StringField(required=True, max_length=20)  # 股票名称
+    week = DateTimeField()  # 所在周的第一天（周一），由日线聚合的周线才有
     first_trade_date = DateTimeField(required=True)  # 首个交易日
     last_trade_date = DateTimeField(required=True)  # 最后交易日
     end_date = DateTimeField(required=True)  # 截止日期
@@ -106,12 +110,47 @@ class StockWeeklyTrading(Document):
     ad_lowest_price = FloatField()  # 后复权最低价
     range_percent = StringField()  # 振幅 单位 %
     increase_rate = StringField()  # 涨幅 单位 %
+    range_percent_value = FloatField()  # 振幅的数值 单位 %
+    increase_rate_value = FloatField()  # 涨幅的数值 单位 %
     turnover_amount = IntField()  # 成交额 单位 /万
     turnover_volume = IntField()  # 成交量 单位 /手
     meta = {
         'indexes': ['stock_number', 'last_trade_date', ('stock_number', 'last_trade_date'),
                     ('stock_number', '-last_trade_date'), ('stock_number', 'first_trade_date'),
-                    ('stock_number', '-first_trade_date')],
+                    ('stock_number', '-first_trade_date'), ('stock_number', 'week')],
+        'index_background': True,
+    }
+
+
+class StockMonthlyTrading(Document):
+    """
+    存储由日线数据聚合出来的股票月线数据
+    """
+
+    stock_number = StringField(required=True, max_length=10)  # 股票编号
+    stock_name = StringField(max_length=20)  # 股票名称
+    month = DateTimeField(required=True)  # 所在月份的第一天
+    first_trade_date = DateTimeField(required=True)  # 首个交易日
+    last_trade_date = DateTimeField(required=True)  # 最后交易日
+    trade_days = IntField()  # 交易天数
+    pre_close_price = FloatField()  # 昨收价
+    monthly_open_price = FloatField()  # 开盘价
+    monthly_close_price = FloatField()  # 收盘价
+    monthly_highest_price = FloatField()  # 最高价
+    monthly_lowest_price = FloatField()  # 最低价
+    ad_open_price = FloatField()  # 后复权开盘价
+    ad_close_price = FloatField()  # 后复权收盘价
+    ad_highest_price = FloatField()  # 后复权最高价
+    ad_lowest_price = FloatField()  # 后复权最低价
+    range_percent = StringField()  # 振幅 单位 %
+    increase_rate = StringField()  # 涨幅 单位 %
+    range_percent_value = FloatField()  # 振幅的数值 单位 %
+    increase_rate_value = FloatField()  # 涨幅的数值 单位 %
+    turnover_amount = IntField()  # 成交额 单位 /万
+    turnover_volume = IntField()  # 成交量 单位 /手
+    meta = {
+        'indexes': [{'fields': ['stock_number', 'month'], 'unique': True},
+                    ('stock_number', 'last_trade_date'), 'last_trade_date'],
         'index_background': True,
     }
 
@@ -164,13 +203,42 @@ class StockMarginTrading(Document):
     stock_number = StringField(required=True, max_length=10)  # 股票编号
     stock_name = StringField(required=True, max_length=20)  # 股票名称
     date = DateTimeField(default=datetime.date.today())  # 收录股票两融数据的日期
-    rz_remaining_amount = StringField()  # 融资余额 单位 rmb
-    rz_buy_amount = StringField()  # 融资买入额 单位 rmb
-    rz_repay_amount = StringField()  # 融资偿还额 单位 rmb
-    rz_net_buy_amount = StringField()  # 融资净买入额 单位 rmb
-    rq_remaining_volume = StringField()  # 融券余量 单位 股
-    rq_sell_volume = StringField()  # 融券卖出量 单位 股
-    rq_repay_volume = StringField()  # 融券偿还量 单位 股
+    rz_remaining_amount = FloatField()  # 融资余额 单位 rmb
+    rz_buy_amount = FloatField()  # 融资买入额 单位 rmb
+    rz_repay_amount = FloatField()  # 融资偿还额 单位 rmb
+    rz_net_buy_amount = FloatField()  # 融资净买入额 单位 rmb
+    rq_remaining_volume = IntField()  # 融券余量 单位 股
+    rq_sell_volume = IntField()  # 融券卖出量 单位 股
+    rq_repay_volume = IntField()  # 融券偿还量 单位 股
+    meta = {
+        'indexes': [{'fields': ['stock_number', 'date'], 'unique': True}, ('stock_number', '-date'), 'date',
+                    ('date', 'rz_remaining_amount')],
+        'index_background': True,
+        'auto_create_index': False,  # 唯一索引要在migrate_margin_trading去重之后由ensure_indexes建立
+    }
+
+
+class IndicatorState(Document):
+    """
+    技术指标的增量计算状态，每只股票每个周期每个指标每组参数一条，每根新K线只需要在上一次的状态上推进一步
+    """
+    stock_number = StringField(required=True, max_length=10)  # 股票编号
+    timeframe = StringField(required=True, choices=['day', 'week', 'month'])  # K线周期
+    indicator = StringField(required=True)  # 指标名称，ma, ema, macd
+    params = StringField(required=True)  # 指标参数，如 12_26_9
+    period = DateTimeField()  # 最后一根K线所在周期的标识，日线为日期，周线为所在周的第一天，月线为所在月份
+    date = DateTimeField()  # 最后一根K线的日期
+    base = DictField()  # 最后一根K线之前的累加状态，同一周期的K线更新时从这里重新计算
+    state = DictField()  # 包含最后一根K线的累加状态
+    value = DictField()  # 最后一根K线的指标值
+    prev_value = DictField()  # 上一根K线的指标值
+    meta = {
+        'indexes': [
+            {'fields': ('timeframe', 'indicator', 'params', 'stock_number'), 'unique': True},
+            ('stock_number', 'timeframe'), ('timeframe', 'indicator', 'params', '-date'),
+        ],
+        'index_background': True,
+    }
 
 
 class QuantResult(Document):
@@ -194,8 +262,12 @@ class QuantResult(Document):
     ten_back_test = BooleanField()  # 十个交易日之后的回测结果
     ten_price = FloatField()  # 十个交易日之后的价格
     meta = {
-        'indexes': ['date', ('strategy_name', 'date'), ('strategy_name', '-date')],
+        'indexes': [
+            'date', ('strategy_name', '-date'),
+            {'fields': ('strategy_name', 'date', 'stock_number'), 'unique': True},
+        ],
         'index_background': True,
+        'auto_create_index': False,  # 唯一索引要在remove_duplicate_quant_result去重之后由ensure_indexes建立
     }
 
 
@@ -234,7 +306,7 @@ class StockReport(Document):
     institution = StringField(required=True, max_length=20)  # 评级的机构
     content = StringField()  # 评级报告的内容
     meta = {
-        'indexes': ['date', 'stock_number'],
+        'indexes': ['date', 'stock_number', 'info_code'],
         'index_background': True,
     }
 
@@ -254,11 +326,35 @@ class ShareHolder(Document):
     share_type = StringField()  # 股份类型：A股，H股
 
 
+def remove_duplicate_quant_result():
+    """
+    同一策略同一天同一只股票有多条结果时只保留最早的一条，以便建立唯一索引
+    """
+    collection = QuantResult._get_collection()
+    pipeline = [
+        {'$group': {'_id': {'strategy_name': '$strategy_name', 'date': '$date', 'stock_number': '$stock_number'},
+                    'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+    duplicate_ids = []
+    for i in collection.aggregate(pipeline, allowDiskUse=True):
+        duplicate_ids.extend(sorted(i['ids'])[1:])
+    if duplicate_ids:
+        collection.delete_many({'_id': {'$in': duplicate_ids}})
+    return len(duplicate_ids)
+
+
 if __name__ == '__main__':
+    remove_duplicate_quant_result()
     StockInfo.ensure_indexes()
     StockNotice.ensure_indexes()
     StockDailyTrading.ensure_indexes()
     StockWeeklyTrading.ensure_indexes()
+    StockMonthlyTrading.ensure_indexes()
     QuantResult.ensure_indexes()
+    IndicatorState.ensure_indexes()
     IndexDailyTrading.ensure_indexes()
     StockReport.ensure_indexes()
+    if not StockMarginTrading._get_collection().find_one({'rz_remaining_amount': {'$type': 'string'}}):
+        # 还有字符串存储的旧数据时，唯一索引由collect_stock_margin_trading.py -m迁移完成后建立
+        StockMarginTrading.ensure_indexes()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地列式日线价格库，是StockDailyTrading的只读镜像。每个字段一个内存映射文件，按交易日逐行存放，每行是全部股票的值，
+所以每天收盘后追加一天只需要在文件末尾写一行。读取时转置成 股票 × 交易日 的视图，不复制数据，多个进程可以共享同一份页缓存。
+没有日线数据的位置为NaN，停牌的日线和StockDailyTrading一样收盘价为0
+"""
+
+import os
+import json
+import logging
+import argparse
+import datetime
+
+import numpy as np
+
+from config import price_store_path, price_store_capacity
+from models import StockDailyTrading as SDT
+from logger import setup_logging
+
+
+# 价格库字段到StockDailyTrading字段的映射
+price_fields = {
+    'pre_close': 'yesterday_closed_price',
+    'open': 'today_opening_price',
+    'close': 'today_closing_price',
+    'high': 'today_highest_price',
+    'low': 'today_lowest_price',
+    'volume': 'turnover_volume',
+    'amount': 'turnover_amount',
+}
+legacy_fields = ['open', 'close', 'high', 'low', 'volume', 'amount']  # 没有记录fields的旧价格库中的字段
+default_fields = ('close', 'high', 'low', 'volume', 'amount')
+dtype = np.float64
+meta_file = 'meta.json'
+
+
+def field_path(field, version=0, store_path=price_store_path):
+    name = '%s.%s' % (field, version) if version else field
+    return os.path.join(store_path, name + '.dat')
+
+
+def load_meta(store_path=price_store_path):
+    """
+    stocks: 每一列对应的股票编号，dates: 已写入的交易日，capacity: 每行预留的股票数，
+    fields: 价格库中的字段，version: 数据文件的版本，扩容时写入新版本的文件，meta替换后才生效
+    """
+    path = os.path.join(store_path, meta_file)
+    if not os.path.exists(path):
+        return {'stocks': [], 'dates': [], 'capacity': price_store_capacity, 'fields': list(price_fields),
+                'version': 0}
+    with open(path) as f:
+        meta = json.load(f)
+    meta.setdefault('fields', legacy_fields)
+    meta.setdefault('version', 0)
+    return meta
+
+
+def save_meta(meta, store_path=price_store_path):
+    """
+    数据文件写完后再原子地替换meta，读取方只会看到完整写入的交易日
+    """
+    path = os.path.join(store_path, meta_file)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, path)
+
+
+def open_field(field, meta, mode='r', store_path=price_store_path):
+    return np.memmap(field_path(field, meta['version'], store_path), dtype=dtype, mode=mode,
+                     shape=(len(meta['dates']), meta['capacity']))
+
+
+def resize_capacity(meta, capacity, store_path=price_store_path):
+    """
+    股票数超过预留容量时，用新的容量把所有字段写成下一个版本的文件，旧版本的文件不动，
+    读取方在新的meta保存之前一直读旧版本，不会用新的容量去读旧文件
+    """
+    version = meta['version'] + 1
+    for field in meta['fields'] if meta['dates'] else []:
+        resized = np.memmap(field_path(field, version, store_path), dtype=dtype, mode='w+',
+                            shape=(len(meta['dates']), capacity))
+        resized[:] = np.nan
+        resized[:, :meta['capacity']] = open_field(field, meta, store_path=store_path)
+        resized.flush()
+        del resized
+    meta['capacity'] = capacity
+    meta['version'] = version
+
+
+def remove_version(fields, version, store_path=price_store_path):
+    for field in fields:
+        path = field_path(field, version, store_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def load_daily_prices(date):
+    """
+    一次查询取出某个交易日全市场的日线数据，包括停牌的股票
+    """
+    projection = {v: 1 for v in price_fields.values()}
+    projection.update({'stock_number': 1, '_id': 0})
+    cursor = SDT._get_collection().find({'date': date}, projection)
+    return {i['stock_number']: i for i in cursor}
+
+
+def write_trading_date(date, store_path=price_store_path):
+    """
+    把date这一天的日线数据写入价格库，已写入的交易日会被覆盖，早于最后一个交易日的新日期会被忽略
+    """
+    os.makedirs(store_path, exist_ok=True)
+    meta = load_meta(store_path)
+    daily_prices = load_daily_prices(date)
+    if not daily_prices:
+        logging.warning('No daily trading data on %s' % date)
+        return False
+
+    date_key = date.strftime('%Y-%m-%d')
+    if date_key not in meta['dates'] and meta['dates'] and date_key < meta['dates'][-1]:
+        logging.warning('%s is earlier than the last date in price store, rebuild it instead' % date_key)
+        return False
+
+    version = meta['version']
+    stock_index = {s: i for i, s in enumerate(meta['stocks'])}
+    for stock_number in sorted(daily_prices):
+        if stock_number not in stock_index:
+            stock_index[stock_number] = len(meta['stocks'])
+            meta['stocks'].append(stock_number)
+    if len(meta['stocks']) > meta['capacity']:
+        resize_capacity(meta, max(meta['capacity'] * 2, len(meta['stocks'])), store_path)
+
+    columns = np.array([stock_index[s] for s in daily_prices])
+    for field in meta['fields']:
+        sdt_field = price_fields[field]
+        row = np.full(meta['capacity'], np.nan, dtype=dtype)
+        row[columns] = [np.nan if i.get(sdt_field) is None else i[sdt_field] for i in daily_prices.values()]
+
+        if date_key in meta['dates']:
+            data = open_field(field, meta, 'r+', store_path)
+            data[meta['dates'].index(date_key)] = row
+            data.flush()
+            del data
+        else:
+            # 截掉上次中断时写了一半的数据，再在末尾追加一行
+            path = field_path(field, meta['version'], store_path)
+            if os.path.exists(path):
+                os.truncate(path, len(meta['dates']) * meta['capacity'] * row.itemsize)
+            with open(path, 'ab') as f:
+                row.tofile(f)
+
+    if date_key not in meta['dates']:
+        meta['dates'].append(date_key)
+    save_meta(meta, store_path)
+    if meta['version'] != version:
+        remove_version(meta['fields'], version, store_path)
+    return True
+
+
+def rebuild_price_store(start_date, end_date, store_path=price_store_path):
+    """
+    删除已有的价格库，用区间内的日线数据重建
+    """
+    os.makedirs(store_path, exist_ok=True)
+    for name in os.listdir(store_path):
+        if name == meta_file or name.endswith('.dat'):
+            os.remove(os.path.join(store_path, name))
+
+    trade_dates = SDT.objects(date__gte=start_date, date__lte=end_date).distinct('date')
+    for d in sorted(trade_dates):
+        write_trading_date(d, store_path)
+
+
+def load_price_store(fields=default_fields, start_date=None, end_date=None, store_path=price_store_path):
+    """
+    读取价格库，返回对齐的数组
+    :param fields: 需要的字段，pre_close, open, close, high, low, volume, amount，价格库中没有的字段不返回
+    :param start_date: 开始日期，包含
+    :param end_date: 结束日期，包含
+    :return: {
+        stocks: 股票编号列表，对应数组的行
+        dates: numpy datetime64[D]数组，对应数组的列
+        fields中的每个字段: 股票 × 交易日 的只读数组
+    }
+    """
+    meta = load_meta(store_path)
+    stocks = meta['stocks']
+    dates = np.array(meta['dates'], dtype='datetime64[D]')
+
+    begin = 0 if start_date is None else np.searchsorted(dates, np.datetime64(start_date, 'D'))
+    end = len(dates) if end_date is None else np.searchsorted(dates, np.datetime64(end_date, 'D'), side='right')
+
+    res = {'stocks': stocks, 'dates': dates[begin:end]}
+    for field in fields:
+        if field not in meta['fields']:
+            continue
+        if len(dates):
+            res[field] = open_field(field, meta, store_path=store_path)[begin:end, :len(stocks)].T
+        else:
+            res[field] = np.empty((len(stocks), 0), dtype=dtype)
+    return res
+
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(description=u'维护本地列式日线价格库')
+    parser.add_argument(u'-t', action=u'store', dest='qr_date', required=False, help=u'追加这一天的数据')
+    parser.add_argument(u'-s', action=u'store', dest='start', required=False, help=u'重建价格库的开始日期')
+    parser.add_argument(u'-e', action=u'store', dest='end', required=False, help=u'重建价格库的结束日期')
+
+    args = parser.parse_args()
+    dates = []
+    for d in [args.qr_date, args.start, args.end]:
+        dates.append(datetime.datetime.strptime(d, '%Y%m%d') if d else None)
+    return dates
+
+
+if __name__ == '__main__':
+    setup_logging(__file__, logging.WARNING)
+    qr_date, start, end = setup_argparse()
+    if start:
+        rebuild_price_store(start, end or datetime.datetime.now())
+    else:
+        if not qr_date:
+            today = datetime.date.today()
+            qr_date = datetime.datetime(year=today.year, month=today.month, day=today.day)
+        write_trading_date(qr_date)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+signal_kernels在 股票 × K线 矩阵上的计算和逐只股票用pandas计算的结果一致
+"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from analysis.signal_kernels import align_bars, rolling_mean, ewm_scan, ewm_mean
+
+
+class SignalKernelsTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.values = 10 + rng.randn(5, 60).cumsum(axis=1) * 0.1
+        self.values[1, 20:23] = np.nan  # 中间有缺失的数据
+        self.values[2, :45] = np.nan  # 上市不久，数据不足
+        self.values[3, -1] = np.nan  # 最后一天没有数据
+        self.values[4, :] = np.nan  # 没有任何数据
+
+    def assert_rows(self, res, expected):
+        for i, row in enumerate(expected):
+            np.testing.assert_allclose(res[i], row, rtol=1e-10, equal_nan=True)
+
+    def test_align_bars(self):
+        valid = ~np.isnan(self.values)
+        valid[0, 10:15] = False  # 停牌
+        count = 30
+        res = align_bars(self.values, valid, count)
+
+        self.assertEqual(res.shape, (len(self.values), count))
+        expected = []
+        for row, mask in zip(self.values, valid):
+            bars = row[mask][-count:]
+            expected.append(np.concatenate([np.full(count - len(bars), np.nan), bars]))
+        self.assert_rows(res, expected)
+
+    def test_rolling_mean(self):
+        for n in (1, 5, 20, 60, 61):
+            expected = [pd.Series(row).rolling(window=n, center=False).mean().values for row in self.values]
+            self.assert_rows(rolling_mean(self.values, n), expected)
+
+    def test_ewm_mean(self):
+        for span in (9, 12, 26):
+            expected = [pd.Series(row).ewm(span=span).mean().values for row in self.values]
+            self.assert_rows(ewm_mean(self.values, span), expected)
+
+    def test_ewm_scan_state(self):
+        span = 12
+        res, num, den = ewm_scan(self.values[:, :-1], span)
+        full = ewm_mean(self.values, span)
+
+        # 用最后的分子分母推进一根K线，和对完整的数据重新计算一致
+        decay = 1 - 2.0 / (span + 1)
+        last = self.values[:, -1]
+        valid = ~np.isnan(last)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            step = (decay * num + np.where(valid, last, 0)) / (decay * den + valid)
+        np.testing.assert_allclose(step, full[:, -1], rtol=1e-10, equal_nan=True)
+        np.testing.assert_allclose(res, full[:, :-1], rtol=1e-10, equal_nan=True)
+
+    def test_aligned_indicators(self):
+        # 和策略的用法一致：先对齐最近的K线，再在对齐后的矩阵上计算
+        valid = ~np.isnan(self.values)
+        bars = align_bars(self.values, valid, 40)
+        for row, mask, aligned_ma, aligned_ema in zip(self.values, valid, rolling_mean(bars, 10), ewm_mean(bars, 12)):
+            close = pd.Series(row[mask][-40:])
+            n = len(close)
+            if not n:
+                continue
+            np.testing.assert_allclose(aligned_ma[-n:], close.rolling(window=10).mean().values, equal_nan=True)
+            np.testing.assert_allclose(aligned_ema[-n:], close.ewm(span=12).mean().values, equal_nan=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+遍历股票池，按_id范围分批读取StockInfo，只取需要的字段，整个遍历只扫描一遍集合
+"""
+
+from models import StockInfo, StockDailyTrading as SDT
+
+
+batch_size = 500  # 每次从数据库中取出的数据量
+
+
+def traded_stocks(trade_date):
+    """
+    trade_date当天有交易数据的股票编号
+    """
+    return set(SDT.objects(date=trade_date).distinct('stock_number'))
+
+
+def iter_stock_info(*fields, **kwargs):
+    """
+    分批遍历StockInfo
+    :param fields: 只取出这些字段，不传则取出全部字段
+    :param kwargs:{
+        batch_size: 每批的数量
+        exclude_firms: 过滤会计师事务所包含这些关键字的股票
+        trade_date: 只保留这一天有交易数据的股票，用来过滤停牌的股票
+    }
+    """
+    step = kwargs.get('batch_size', batch_size)
+    exclude_firms = kwargs.get('exclude_firms')
+    traded = traded_stocks(kwargs['trade_date']) if kwargs.get('trade_date') else None
+
+    if fields and exclude_firms and 'account_firm' not in fields:
+        fields += ('account_firm',)
+
+    last_id = None
+    while True:
+        cursor = StockInfo.objects(id__gt=last_id) if last_id else StockInfo.objects()
+        if fields:
+            cursor = cursor.only(*fields)
+        stocks = list(cursor.order_by('id').limit(step))
+        if not stocks:
+            break
+        last_id = stocks[-1].id
+
+        for i in stocks:
+            if exclude_firms and i.account_firm and [f for f in exclude_firms if f in i.account_firm]:
+                continue
+            if traded is not None and i.stock_number not in traded:
+                continue
+            yield i
+
+
+def load_universe(*fields, **kwargs):
+    """
+    把过滤后的股票池一次性取出，参数同iter_stock_info
+    """
+    return list(iter_stock_info(*fields, **kwargs))